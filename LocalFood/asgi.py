@@ -2,6 +2,9 @@
 ASGI config for LocalFood project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Run it with ``LOCALFOOD_ASGI=1`` to serve the async catalog views, e.g.::
+
+    LOCALFOOD_ASGI=1 uvicorn LocalFood.asgi:application --workers 4
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
@@ -44,7 +44,12 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'localfood_app.middleware.RequestProfilingMiddleware',
+    'localfood_app.middleware.MetricsMiddleware',
+    'localfood_app.middleware.SlowQueryMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'localfood_app.middleware.ReplicaPinningMiddleware',
+    'localfood_app.middleware.PageCacheMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -74,6 +79,10 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'LocalFood.wsgi.application'
 
+# ASGI deployment profile (uvicorn): serves the async catalog views and
+# disables persistent connections, which Django does not support under ASGI.
+ASGI_PROFILE = os.environ.get('LOCALFOOD_ASGI') == '1'
+
 
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
@@ -85,10 +94,32 @@ DATABASES = {
         'HOST': 'localhost',
         'PASSWORD': 'coderslab',
         'USER': 'postgres',
-        'PORT': 5432
+        'PORT': 5432,
+        # Keep connections open between requests instead of reconnecting on
+        # every request; each worker thread holds at most one connection, so
+        # the per-process limit is the number of worker threads.
+        'CONN_MAX_AGE': int(os.environ.get('LOCALFOOD_CONN_MAX_AGE', 0 if ASGI_PROFILE else 60)),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'connect_timeout': int(os.environ.get('LOCALFOOD_CONNECT_TIMEOUT', 5)),
+        },
     }
 }
 
+# Read replicas for catalog reads, e.g. LOCALFOOD_DB_REPLICAS=replica-1,replica-2
+DATABASE_REPLICAS = []
+for number, host in enumerate(filter(None, os.environ.get('LOCALFOOD_DB_REPLICAS', '').split(',')), start=1):
+    DATABASES[f'replica{number}'] = {
+        **DATABASES['default'],
+        'HOST': host.strip(),
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica{number}')
+
+DATABASE_ROUTERS = ['localfood_app.routers.ReplicaRouter']
+
+# Seconds a client keeps reading from the primary after writing to it
+REPLICA_PIN_SECONDS = int(os.environ.get('LOCALFOOD_REPLICA_PIN_SECONDS', 5))
 
 
 
@@ -147,6 +178,138 @@ GS_BUCKET_NAME = 'local_food'
 
 AUTH_USER_MODEL = 'localfood_app.User'
 
+# Read sessions and the logged-in user from the cache, falling back to the database
+SESSION_CACHE = os.environ.get('LOCALFOOD_SESSION_CACHE', '1') == '1'
+if SESSION_CACHE:
+    SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+# Sessions keep the path of the backend that logged the user in, so both stay
+# listed whichever way SESSION_CACHE is set
+AUTHENTICATION_BACKENDS = [
+    'localfood_app.backends.CachedModelBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+USER_CACHE_TIMEOUT = int(os.environ.get('LOCALFOOD_USER_CACHE_TIMEOUT', 3600))
+
 LOGIN_URL = '/login/'
 LOGIN_REDIRECT_URL = '/home/'
 
+
+# request profiling
+
+# Server-Timing headers with total, SQL and template time for every request
+REQUEST_PROFILING = os.environ.get('LOCALFOOD_PROFILING') == '1'
+# Share of requests (0-1) run under cProfile; dumps are kept for slow ones only
+REQUEST_PROFILING_SAMPLE_RATE = float(os.environ.get('LOCALFOOD_PROFILING_SAMPLE_RATE', 0))
+REQUEST_PROFILING_SLOW_MS = float(os.environ.get('LOCALFOOD_PROFILING_SLOW_MS', 500))
+REQUEST_PROFILING_DIR = os.environ.get('LOCALFOOD_PROFILING_DIR', os.path.join(BASE_DIR, 'profiles'))
+
+
+# metrics
+
+# Shared by all worker processes; clear it when the service (re)starts
+METRICS_ENABLED = os.environ.get('LOCALFOOD_METRICS', '1') == '1'
+METRICS_DIR = os.environ.get('LOCALFOOD_METRICS_DIR', os.path.join(BASE_DIR, 'metrics'))
+# /metrics answers 404 unless the scraper sends "Authorization: Bearer <token>"
+# or connects from one of the addresses (comma-separated)
+METRICS_TOKEN = os.environ.get('LOCALFOOD_METRICS_TOKEN', '')
+METRICS_ALLOWED_IPS = [ip for ip in os.environ.get('LOCALFOOD_METRICS_ALLOWED_IPS', '').split(',') if ip]
+
+
+# slow-query log
+
+# Statements slower than this (in ms) are logged with their EXPLAIN plan; 0 disables
+SLOW_QUERY_MS = float(os.environ.get('LOCALFOOD_SLOW_QUERY_MS', 0))
+SLOW_QUERY_LOG_DIR = os.environ.get('LOCALFOOD_SLOW_QUERY_LOG_DIR', os.path.join(BASE_DIR, 'slow_queries'))
+SLOW_QUERY_LOG_MAX_BYTES = 10 * 1024 * 1024
+SLOW_QUERY_LOG_BACKUP_COUNT = 5
+
+
+# caches
+
+# Use a shared backend (e.g. django.core.cache.backends.redis.RedisCache with
+# LOCALFOOD_CACHE_LOCATION=redis://127.0.0.1:6379) when running several workers
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('LOCALFOOD_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('LOCALFOOD_CACHE_LOCATION', 'localfood'),
+    }
+}
+PRODUCT_CACHE_TIMEOUT = int(os.environ.get('LOCALFOOD_PRODUCT_CACHE_TIMEOUT', 3600))
+
+
+# full-page cache for anonymous visitors
+
+PAGE_CACHE_ENABLED = os.environ.get('LOCALFOOD_PAGE_CACHE', '1') == '1'
+PAGE_CACHE_URL_NAMES = ['localfood_app:welcome', 'localfood_app:category']
+# Pages are served as fresh for SOFT_TTL seconds, then as stale copies (while
+# one worker renders a new one) until HARD_TTL
+PAGE_CACHE_SOFT_TTL = int(os.environ.get('LOCALFOOD_PAGE_CACHE_SOFT_TTL', 60))
+PAGE_CACHE_HARD_TTL = int(os.environ.get('LOCALFOOD_PAGE_CACHE_HARD_TTL', 3600))
+PAGE_CACHE_LOCK_SECONDS = 30
+# Seconds a worker finding no copy at all polls for the one rendering it; this
+# holds the request thread, so by default it renders the page itself
+PAGE_CACHE_WAIT = float(os.environ.get('LOCALFOOD_PAGE_CACHE_WAIT', 0))
+
+
+# username availability
+
+# Bloom filter of existing usernames kept by every process
+USERNAME_FILTER_ERROR_RATE = 0.01
+USERNAME_FILTER_MIN_CAPACITY = 100_000
+# How often a process loads the users created by other processes
+USERNAME_FILTER_REFRESH_SECONDS = 5
+# How far below the highest user ID seen each refresh reads again, for sign-ups
+# committed out of ID order
+USERNAME_FILTER_RESCAN_IDS = 1000
+
+
+# login and sign-up throttling
+
+THROTTLE_ENABLED = os.environ.get('LOCALFOOD_THROTTLE', '1') == '1'
+# (requests, window in seconds) per client IP and per submitted username
+THROTTLE_RATES = {
+    'login': {'ip': (30, 60), 'username': (10, 600)},
+    'signup': {'ip': (10, 3600), 'username': (5, 600)},
+}
+# Request header holding the client IP behind a reverse proxy, e.g. HTTP_X_REAL_IP
+THROTTLE_IP_HEADER = os.environ.get('LOCALFOOD_THROTTLE_IP_HEADER')
+
+
+# "near me" catalog search
+
+# Radius in km when the request gives none, and the largest one allowed
+NEAR_ME_DEFAULT_KM = 30
+NEAR_ME_MAX_KM = 300
+
+
+# "frequently bought together" recommendations
+
+# Related products stored per product by manage.py build_recommendations
+RECOMMENDATIONS_TOP_K = 10
+# Related products shown on the product and basket pages
+RECOMMENDATIONS_SHOWN = 4
+
+
+# popularity sorts
+
+# Recent sales count half as much after this many days in the "trending" sort
+TRENDING_HALF_LIFE_DAYS = float(os.environ.get('LOCALFOOD_TRENDING_HALF_LIFE_DAYS', 7))
+# Changing either requires running manage.py rebuild_popularity
+TRENDING_EPOCH = os.environ.get('LOCALFOOD_TRENDING_EPOCH', '2024-01-01T00:00:00+00:00')
+
+
+# server-sent events (ASGI profile)
+
+# 'unix' fans events out to every worker process on this host through datagram
+# sockets in EVENTS_SOCKET_DIR; 'process' delivers them within one process only
+EVENTS_BACKEND = os.environ.get('LOCALFOOD_EVENTS_BACKEND', 'unix')
+EVENTS_SOCKET_DIR = os.environ.get('LOCALFOOD_EVENTS_SOCKET_DIR', '/tmp/localfood-events')
+# Messages a slow stream may fall behind before its client is told to reload
+EVENTS_QUEUE_SIZE = 100
+# Seconds between keep-alive comments on an idle stream
+EVENTS_KEEPALIVE_SECONDS = 15
+# Minimum seconds between two stock updates on a product page stream; the
+# changes in between are merged into one update per product
+STOCK_EVENTS_INTERVAL_SECONDS = float(os.environ.get('LOCALFOOD_STOCK_EVENTS_INTERVAL_SECONDS', 2))
+# Products one stock stream may follow
+STOCK_EVENTS_MAX_PRODUCTS = 50
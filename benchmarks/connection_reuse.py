@@ -0,0 +1,112 @@
+"""
+Benchmark requests per second with and without persistent database connections.
+
+Calls Django's ``WSGIHandler`` directly, as a WSGI server would, so
+``request_started`` and ``request_finished`` run ``close_old_connections`` like
+in a real worker. ``django.test.Client`` disconnects that handler and would
+reuse one connection in both runs. The same view is run once with
+``CONN_MAX_AGE = 0`` and once with the configured value, and the number of
+database connections opened is printed next to the throughput.
+
+Usage:
+    python benchmarks/connection_reuse.py --requests 2000 --path /category/vegetables/
+"""
+import argparse
+import io
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'LocalFood.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.core.handlers.wsgi import WSGIHandler  # noqa: E402
+from django.db import connections  # noqa: E402
+from django.db.backends.signals import connection_created  # noqa: E402
+
+opened = 0
+
+
+def count_connection(sender, connection, **kwargs):
+    global opened
+    opened += 1
+
+
+connection_created.connect(count_connection)
+
+
+def request(handler, path):
+    """
+    Sends one GET request through the WSGI handler and consumes the response.
+
+    :param handler: The ``WSGIHandler``.
+    :param path: The URL path, optionally with a query string.
+    :return: The status line.
+    """
+    path_info, _, query_string = path.partition('?')
+    environ = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': path_info, 'QUERY_STRING': query_string, 'SCRIPT_NAME': '',
+        'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'HTTP_HOST': 'localhost', 'SERVER_PROTOCOL': 'HTTP/1.1',
+        'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr, 'wsgi.url_scheme': 'http',
+        'wsgi.version': (1, 0), 'wsgi.multithread': False, 'wsgi.multiprocess': True, 'wsgi.run_once': False,
+    }
+    status = []
+    response = handler(environ, lambda status_line, headers, exc_info=None: status.append(status_line))
+    try:
+        for _ in response:
+            pass
+    finally:
+        # sends request_finished, as a WSGI server does
+        response.close()
+    return status[0]
+
+
+def run(handler, path, requests, conn_max_age):
+    """
+    Sends ``requests`` GET requests to ``path`` with the given ``CONN_MAX_AGE``.
+
+    :param handler: The ``WSGIHandler`` driving the request cycle.
+    :param path: The URL path to request.
+    :param requests: Number of requests to send.
+    :param conn_max_age: The ``CONN_MAX_AGE`` value to apply for this run.
+    :return: A (requests per second, connections opened) tuple.
+    """
+    global opened
+    connections.close_all()
+    for alias in connections:
+        connections[alias].settings_dict['CONN_MAX_AGE'] = conn_max_age
+    opened = 0
+    start = time.perf_counter()
+    for _ in range(requests):
+        request(handler, path)
+    elapsed = time.perf_counter() - start
+    connections.close_all()
+    return requests / elapsed, opened
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--path', default='/search/?q=a')
+    parser.add_argument('--conn-max-age', type=int,
+                        help='CONN_MAX_AGE of the persistent run; the configured value, or 60 if that is 0.')
+    args = parser.parse_args()
+
+    configured = args.conn_max_age or connections['default'].settings_dict['CONN_MAX_AGE'] or 60
+    handler = WSGIHandler()
+    status = request(handler, args.path)
+    if not status.startswith('200'):
+        parser.error(f'{args.path} answered {status}')
+
+    for label, max_age in (('reconnect per request', 0), ('persistent', configured)):
+        rps, connects = run(handler, args.path, args.requests, max_age)
+        print(f'{label:<24} CONN_MAX_AGE={max_age!s:<6} {rps:8.1f} req/s  {connects:>6} connections')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,252 @@
+"""
+Minimal asyncio HTTP/1.1 client used by the benchmark and load-test scripts.
+
+Only the standard library is used so the scripts run anywhere the project does.
+"""
+import asyncio
+import uuid
+from urllib.parse import urlencode, urlsplit
+
+
+class Response:
+    """
+    A parsed HTTP response.
+
+    Attributes:
+        status (int): The HTTP status code.
+        headers (list): The response headers as (lower-cased name, value) pairs.
+        body (bytes): The response body.
+    """
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def header(self, name, default=None):
+        """
+        Returns the first value of a response header.
+
+        :param name: The header name, case-insensitive.
+        :param default: Value returned when the header is missing.
+        :return: The header value.
+        """
+        name = name.lower()
+        for key, value in self.headers:
+            if key == name:
+                return value
+        return default
+
+    def header_values(self, name):
+        """
+        Returns every value of a response header, e.g. all ``Set-Cookie`` lines.
+
+        :param name: The header name, case-insensitive.
+        :return: A list of header values.
+        """
+        name = name.lower()
+        return [value for key, value in self.headers if key == name]
+
+
+def split_url(url):
+    """
+    Splits a URL into host, port and request target.
+
+    :param url: An absolute ``http://`` URL.
+    :return: A (host, port, target) tuple.
+    """
+    parts = urlsplit(url)
+    target = parts.path or '/'
+    if parts.query:
+        target += '?' + parts.query
+    return parts.hostname, parts.port or 80, target
+
+
+def build_request(method, target, host, headers=None, body=b''):
+    """
+    Serializes an HTTP/1.1 request.
+
+    :param method: The HTTP method.
+    :param target: The request target (path and query string).
+    :param host: The value of the Host header.
+    :param headers: Extra headers as a dict.
+    :param body: The request body.
+    :return: The request as bytes.
+    """
+    lines = [f'{method} {target} HTTP/1.1', f'Host: {host}', f'Content-Length: {len(body)}']
+    lines.extend(f'{name}: {value}' for name, value in (headers or {}).items())
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body
+
+
+async def read_response(reader):
+    """
+    Reads one HTTP response from a stream, supporting Content-Length and
+    chunked bodies.
+
+    :param reader: An ``asyncio.StreamReader``.
+    :return: A ``Response``.
+    """
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError('Connection closed before the response')
+    status = int(status_line.split()[1])
+
+    headers = []
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers.append((name.strip().lower(), value.strip()))
+    response = Response(status, headers, b'')
+
+    if response.header('transfer-encoding', '').lower() == 'chunked':
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            if size == 0:
+                await reader.readline()
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readline()
+        response.body = b''.join(chunks)
+    elif response.header('content-length') is not None:
+        response.body = await reader.readexactly(int(response.header('content-length')))
+    else:
+        response.body = await reader.read()
+    return response
+
+
+async def fetch(url, method='GET', headers=None, body=b''):
+    """
+    Sends a single request over a new connection.
+
+    :param url: An absolute ``http://`` URL.
+    :param method: The HTTP method.
+    :param headers: Extra headers as a dict.
+    :param body: The request body.
+    :return: A ``Response``.
+    """
+    host, port, target = split_url(url)
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write(build_request(method, target, f'{host}:{port}',
+                                   {**(headers or {}), 'Connection': 'close'}, body))
+        await writer.drain()
+        return await read_response(reader)
+    finally:
+        writer.close()
+
+
+def encode_multipart(fields, files):
+    """
+    Encodes form fields and files as ``multipart/form-data``.
+
+    :param fields: The form fields as a dict.
+    :param files: The files as a dict of field name to (filename, content type, bytes).
+    :return: A (content type, body) tuple.
+    """
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n'.encode()
+                     + str(value).encode() + b'\r\n')
+    for name, (filename, content_type, content) in files.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                     f'Content-Type: {content_type}\r\n\r\n'.encode() + content + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return f'multipart/form-data; boundary={boundary}', b''.join(parts)
+
+
+class Session:
+    """
+    A browser-like client for one server: keeps its connection alive between
+    requests, stores cookies and sends Django's CSRF token with every POST.
+
+    Attributes:
+        base_url (str): The server URL, e.g. ``http://127.0.0.1:8000``.
+        cookies (dict): The cookies set by the server.
+    """
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.cookies = {}
+        self._host, self._port, _ = split_url(self.base_url)
+        self._reader = None
+        self._writer = None
+
+    async def get(self, path):
+        """
+        Sends a GET request.
+
+        :param path: The path and query string.
+        :return: A ``Response``.
+        """
+        return await self.request('GET', path)
+
+    async def post(self, path, data=None, files=None):
+        """
+        Sends a form POST, url-encoded or multipart when files are given.
+
+        :param path: The path.
+        :param data: The form fields as a dict.
+        :param files: Files as a dict of field name to (filename, content type, bytes).
+        :return: A ``Response``.
+        """
+        data = data or {}
+        if files:
+            content_type, body = encode_multipart(data, files)
+        else:
+            content_type, body = 'application/x-www-form-urlencoded', urlencode(data).encode()
+        headers = {'Content-Type': content_type, 'Referer': self.base_url + path}
+        if 'csrftoken' in self.cookies:
+            headers['X-CSRFToken'] = self.cookies['csrftoken']
+        return await self.request('POST', path, headers, body)
+
+    async def request(self, method, path, headers=None, body=b''):
+        """
+        Sends a request over the kept-alive connection, reconnecting once if the
+        server closed it in the meantime.
+
+        :param method: The HTTP method.
+        :param path: The path and query string.
+        :param headers: Extra headers as a dict.
+        :param body: The request body.
+        :return: A ``Response``.
+        """
+        headers = dict(headers or {})
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{name}={value}' for name, value in self.cookies.items())
+        data = build_request(method, path, f'{self._host}:{self._port}', headers, body)
+        for attempt in range(2):
+            reused = self._writer is not None
+            if not reused:
+                self._reader, self._writer = await asyncio.open_connection(self._host, self._port)
+            try:
+                self._writer.write(data)
+                await self._writer.drain()
+                response = await read_response(self._reader)
+                break
+            except (ConnectionError, asyncio.IncompleteReadError):
+                await self.close()
+                if not reused or attempt:
+                    raise
+        self._store_cookies(response)
+        read_to_eof = response.header('content-length') is None and response.header('transfer-encoding') is None
+        if read_to_eof or response.header('connection', '').lower() == 'close':
+            await self.close()
+        return response
+
+    async def close(self):
+        """
+        Closes the connection; the next request opens a new one.
+        """
+        if self._writer is not None:
+            self._writer.close()
+            self._reader = self._writer = None
+
+    def _store_cookies(self, response):
+        for cookie in response.header_values('set-cookie'):
+            name, _, value = cookie.split(';', 1)[0].partition('=')
+            if 'max-age=0' in cookie.lower():
+                self.cookies.pop(name.strip(), None)
+            else:
+                self.cookies[name.strip()] = value.strip().strip('"')
@@ -0,0 +1,295 @@
+"""
+End-to-end load test: buyers and sellers using a running server at the same time.
+
+Buyer sessions log in, browse the home page, search, open a category and a
+product, add products to their basket and pay; seller sessions log in, add a
+product (with an image) and keep polling their orders. Sessions arrive as
+Poisson processes at ``--buyer-rate`` and ``--seller-rate`` per second for
+``--duration`` seconds, each with its own kept-alive connection, cookies and
+CSRF token, and wait an exponentially distributed think time between steps.
+At the end the throughput, latency percentiles and error rate of every step
+are printed (and written as JSON with ``--output``).
+
+The accounts are taken from the database the server uses, so run
+``manage.py generate_dataset`` first (all generated users share the password
+``localfood``) and start the server, e.g.
+
+    gunicorn LocalFood.wsgi:application -w 8
+    python benchmarks/load_test.py --url http://127.0.0.1:8000 --buyer-rate 20 --seller-rate 2 --duration 60
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import statistics
+import struct
+import sys
+import time
+import zlib
+from collections import defaultdict
+from pathlib import Path
+
+BENCHMARKS_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCHMARKS_DIR.parent))
+sys.path.insert(0, str(BENCHMARKS_DIR))
+
+from http_client import Session  # noqa: E402
+from stats import percentile  # noqa: E402
+
+PRODUCT_LINK = re.compile(r'/product_detail/(\d+)/')
+CATEGORY_LINK = re.compile(r'/category/([\w-]+)/')
+ORDER_ID_INPUT = re.compile(r'name="order_id" value="(\d+)"')
+CATEGORY_OPTION = re.compile(r'<option value="(\d+)"')
+SEARCH_WORDS = ['honey', 'apple', 'cheese', 'bread', 'milk', 'jam', 'eggs', 'smoked']
+
+
+class StepFailed(Exception):
+    """
+    Raised when a step gets an unexpected response; ends the session.
+    """
+
+
+class Stats:
+    """
+    Latencies and errors per step.
+    """
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.sessions = defaultdict(int)
+
+    def report(self, elapsed):
+        """
+        Returns the per-step summary.
+
+        :param elapsed: The duration of the run in seconds.
+        :return: A dict of step name to its statistics.
+        """
+        report = {}
+        for step in sorted(set(self.latencies) | set(self.errors)):
+            latencies = self.latencies[step]
+            total = len(latencies) + self.errors[step]
+            report[step] = {
+                'requests': total,
+                'throughput_rps': round(total / elapsed, 2),
+                'error_rate': round(self.errors[step] / total, 4),
+                'p50_ms': round(percentile(latencies, 0.50) * 1000, 2) if latencies else None,
+                'p95_ms': round(percentile(latencies, 0.95) * 1000, 2) if latencies else None,
+                'p99_ms': round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+                'mean_ms': round(statistics.fmean(latencies) * 1000, 2) if latencies else None,
+            }
+        return report
+
+
+class Scenario:
+    """
+    Base class of a scripted user session.
+
+    :param stats: The shared ``Stats``.
+    :param args: The command line arguments.
+    :param username: The account the session logs in with.
+    """
+    def __init__(self, stats, args, username):
+        self.stats = stats
+        self.args = args
+        self.username = username
+        self.session = Session(args.url)
+        self.rng = random.Random()
+
+    async def step(self, name, method, path, data=None, files=None, expect=(200,)):
+        """
+        Runs one timed request and records it under the step name.
+
+        :return: The response body as text.
+        """
+        start = time.perf_counter()
+        try:
+            if method == 'GET':
+                response = await self.session.get(path)
+            else:
+                response = await self.session.post(path, data, files)
+        except (OSError, asyncio.IncompleteReadError) as exc:
+            self.stats.errors[name] += 1
+            raise StepFailed(f'{name}: {exc}')
+        if response.status not in expect:
+            self.stats.errors[name] += 1
+            raise StepFailed(f'{name}: HTTP {response.status}')
+        self.stats.latencies[name].append(time.perf_counter() - start)
+        return response.body.decode('utf-8', 'replace')
+
+    async def think(self):
+        await asyncio.sleep(self.rng.expovariate(1 / self.args.think_time) if self.args.think_time else 0)
+
+    async def login(self):
+        await self.step('login_form', 'GET', '/login/')
+        await self.step('login', 'POST', '/login/',
+                        {'username': self.username, 'password': self.args.password}, expect=(302,))
+
+    async def run(self):
+        self.stats.sessions[type(self).__name__] += 1
+        try:
+            await self.login()
+            await self.script()
+        except StepFailed:
+            pass
+        finally:
+            await self.session.close()
+
+
+class BuyerScenario(Scenario):
+    """
+    Browses, searches, fills the basket and pays.
+    """
+    async def script(self):
+        page = await self.step('home', 'GET', '/home/')
+        product_ids = PRODUCT_LINK.findall(page)
+        categories = CATEGORY_LINK.findall(page)
+        await self.think()
+
+        page = await self.step('search', 'GET', f'/search/?q={self.rng.choice(SEARCH_WORDS)}')
+        product_ids += PRODUCT_LINK.findall(page)
+        await self.think()
+
+        if categories:
+            page = await self.step('category', 'GET', f'/category/{self.rng.choice(categories)}/')
+            product_ids += PRODUCT_LINK.findall(page)
+            await self.think()
+        if not product_ids:
+            return
+
+        for product_id in self.rng.sample(product_ids, min(len(product_ids), self.rng.randint(1, 3))):
+            await self.step('product_detail', 'GET', f'/product_detail/{product_id}/')
+            await self.think()
+            await self.step('add_to_basket', 'POST', f'/product_detail/{product_id}/', expect=(302,))
+
+        page = await self.step('basket', 'GET', '/basket/')
+        order_id = ORDER_ID_INPUT.search(page)
+        await self.think()
+        if order_id:
+            await self.step('pay', 'POST', '/basket/', {'order_id': order_id.group(1), 'payment': 'paid'},
+                            expect=(302,))
+
+
+class SellerScenario(Scenario):
+    """
+    Adds a product and polls the seller's orders.
+    """
+    async def script(self):
+        page = await self.step('add_product_form', 'GET', '/add_product/')
+        categories = CATEGORY_OPTION.findall(page)
+        await self.think()
+        if categories:
+            await self.step('add_product', 'POST', '/add_product/', {
+                'name': f'Load test product {self.rng.randrange(10 ** 6)}',
+                'description': 'Created by the load test.',
+                'price': f'{self.rng.uniform(1, 100):.2f}',
+                'quantity': self.rng.randint(1, 100),
+                'category': self.rng.choice(categories),
+            }, {'file_path': ('product.png', 'image/png', PNG_IMAGE)}, expect=(302,))
+
+        for _ in range(self.args.seller_polls):
+            await self.think()
+            await self.step('seller_orders', 'GET', '/seller_orders/')
+
+
+def make_png(width=8, height=8):
+    """
+    Returns a small valid PNG image, built without Pillow.
+    """
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    rows = b''.join(b'\x00' + b'\x60\xa0\x40' * width for _ in range(height))
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(rows)) + chunk(b'IEND', b''))
+
+
+PNG_IMAGE = make_png()
+
+
+def load_usernames(buyers, sellers):
+    """
+    Reads the accounts to use from the database the server uses.
+
+    :return: A (buyer usernames, seller usernames) tuple.
+    """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'LocalFood.settings')
+    import django
+
+    django.setup()
+    from django.db import connections
+
+    from localfood_app.models import User
+
+    buyer_names = list(User.objects.filter(is_buyer=True).order_by('pk').values_list('username', flat=True)[:buyers])
+    seller_names = list(User.objects.filter(is_seller=True).order_by('pk').values_list('username', flat=True)[:sellers])
+    connections.close_all()
+    if not buyer_names or not seller_names:
+        raise SystemExit('No buyers or sellers in the database; run manage.py generate_dataset first.')
+    return buyer_names, seller_names
+
+
+async def arrivals(scenario_class, rate, usernames, stats, args, deadline, tasks):
+    """
+    Starts sessions as a Poisson process until the deadline; arrivals while
+    ``--max-sessions`` sessions are running are counted as dropped.
+    """
+    rng = random.Random()
+    while rate > 0:
+        await asyncio.sleep(rng.expovariate(rate))
+        if time.monotonic() >= deadline:
+            return
+        if len([task for task in tasks if not task.done()]) >= args.max_sessions:
+            stats.errors['session_dropped'] += 1
+            continue
+        tasks.append(asyncio.create_task(scenario_class(stats, args, rng.choice(usernames)).run()))
+
+
+async def run(args):
+    buyers, sellers = await asyncio.to_thread(load_usernames, args.accounts, args.accounts)
+    stats = Stats()
+    tasks = []
+    start = time.monotonic()
+    deadline = start + args.duration
+    await asyncio.gather(
+        arrivals(BuyerScenario, args.buyer_rate, buyers, stats, args, deadline, tasks),
+        arrivals(SellerScenario, args.seller_rate, sellers, stats, args, deadline, tasks),
+    )
+    if tasks:
+        await asyncio.wait(tasks, timeout=args.drain)
+    for task in tasks:
+        task.cancel()
+    elapsed = time.monotonic() - start
+
+    report = stats.report(elapsed)
+    print(f'{elapsed:.1f}s, sessions: {dict(stats.sessions)}')
+    print(f'{"step":<18} {"requests":>8} {"req/s":>8} {"errors":>7} {"p50":>9} {"p95":>9} {"p99":>9}')
+    for step, entry in report.items():
+        latencies = ''.join(f'{entry[key]:>7.1f}ms' if entry[key] is not None else f'{"-":>9}'
+                            for key in ('p50_ms', 'p95_ms', 'p99_ms'))
+        print(f'{step:<18} {entry["requests"]:>8} {entry["throughput_rps"]:>8.1f} '
+              f'{entry["error_rate"] * 100:>6.1f}% {latencies}')
+    if args.output:
+        Path(args.output).write_text(json.dumps({'elapsed_s': elapsed, 'steps': report}, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--duration', type=float, default=60.0, help='Seconds during which sessions arrive.')
+    parser.add_argument('--buyer-rate', type=float, default=10.0, help='Buyer sessions started per second.')
+    parser.add_argument('--seller-rate', type=float, default=1.0, help='Seller sessions started per second.')
+    parser.add_argument('--think-time', type=float, default=1.0, help='Mean pause between steps in seconds.')
+    parser.add_argument('--seller-polls', type=int, default=5)
+    parser.add_argument('--max-sessions', type=int, default=500, help='Concurrent sessions; arrivals beyond are dropped.')
+    parser.add_argument('--accounts', type=int, default=1000, help='Number of buyer and seller accounts to use.')
+    parser.add_argument('--password', default='localfood')
+    parser.add_argument('--drain', type=float, default=60.0, help='Seconds to wait for running sessions at the end.')
+    parser.add_argument('--output', help='Write the report as JSON to this file.')
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
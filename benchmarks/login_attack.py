@@ -0,0 +1,112 @@
+"""
+Worker CPU under a simulated credential-stuffing attack on the login form.
+
+Sends ``--attempts`` login POSTs with wrong passwords through Django's full
+request cycle, spread over ``--usernames`` accounts of the configured database
+and ``--ips`` client addresses, once with the login throttle disabled and once
+enabled. Every attempt that reaches the form runs a full password hash, so the
+CPU time of this process is the CPU an attack of that size costs one worker.
+
+For each run it reports the CPU and wall time per attempt, how many attempts
+were rejected with 429 before hashing, and how many were hashed. The results
+are written to ``--output`` as JSON.
+
+Usage:
+    python benchmarks/login_attack.py --attempts 500 --usernames 50 --ips 5
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+
+BENCHMARKS_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCHMARKS_DIR.parent))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'LocalFood.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.core.cache import cache  # noqa: E402
+from django.test import Client  # noqa: E402
+from django.test.utils import override_settings  # noqa: E402
+
+from localfood_app.models import User  # noqa: E402
+from localfood_app.throttle import local_counters  # noqa: E402
+
+
+def attack(usernames, ips, attempts, throttle):
+    """
+    Sends the login attempts of one run.
+
+    :param usernames: The targeted usernames, tried in turn.
+    :param ips: The client addresses the attempts come from, in turn.
+    :param attempts: The number of attempts.
+    :param throttle: Whether the login throttle is enabled.
+    :return: The measurements of the run.
+    """
+    cache.clear()
+    local_counters.clear()
+    client = Client(HTTP_HOST='localhost')
+    statuses = Counter()
+    with override_settings(THROTTLE_ENABLED=throttle):
+        cpu_start, wall_start = time.process_time(), time.perf_counter()
+        for number in range(attempts):
+            response = client.post('/login/', {
+                'username': usernames[number % len(usernames)],
+                'password': f'guess-{number}',
+            }, REMOTE_ADDR=ips[number % len(ips)])
+            statuses[response.status_code] += 1
+        cpu, wall = time.process_time() - cpu_start, time.perf_counter() - wall_start
+
+    return {
+        'throttle': throttle,
+        'attempts': attempts,
+        'rejected': statuses[429],
+        'hashed': attempts - statuses[429],
+        'cpu_s': round(cpu, 3),
+        'wall_s': round(wall, 3),
+        'cpu_ms_per_attempt': round(cpu / attempts * 1000, 3),
+        'statuses': dict(statuses),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--attempts', type=int, default=500)
+    parser.add_argument('--usernames', type=int, default=50, help='Number of targeted accounts.')
+    parser.add_argument('--ips', type=int, default=1, help='Number of attacking client addresses.')
+    parser.add_argument('--output', default=str(BENCHMARKS_DIR / 'results' / 'login_attack.json'))
+    args = parser.parse_args()
+    # one warning per rejected attempt otherwise
+    logging.getLogger('django.request').setLevel(logging.ERROR)
+
+    usernames = list(User.objects.order_by('pk').values_list('username', flat=True)[:args.usernames])
+    usernames += [f'nobody{number}' for number in range(args.usernames - len(usernames))]
+    ips = [f'10.0.{number // 250}.{number % 250 + 1}' for number in range(args.ips)]
+
+    results = {
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'usernames': len(usernames),
+        'ips': len(ips),
+        'runs': [attack(usernames, ips, args.attempts, throttle) for throttle in (False, True)],
+    }
+    for run in results['runs']:
+        print(f'throttle {"on " if run["throttle"] else "off"}  {run["attempts"]} attempts  '
+              f'{run["rejected"]:5d} rejected  {run["hashed"]:5d} hashed  '
+              f'CPU {run["cpu_s"]:7.2f} s ({run["cpu_ms_per_attempt"]:.2f} ms/attempt)  wall {run["wall_s"]:7.2f} s')
+
+    Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+    Path(args.output).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
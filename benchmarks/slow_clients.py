@@ -0,0 +1,114 @@
+"""
+Concurrency benchmark: latency of normal requests while many slow clients are connected.
+
+Opens ``--slow-clients`` connections that trickle their request headers in
+small pieces (like buyers on a bad mobile connection), then measures the
+latency of ``--probes`` ordinary requests sent at the same time and prints the
+p50/p95/p99 percentiles. Run it once against the WSGI setup and once against
+the ASGI profile to compare:
+
+    gunicorn LocalFood.wsgi:application -w 4
+    LOCALFOOD_ASGI=1 uvicorn LocalFood.asgi:application --workers 4
+
+    python benchmarks/slow_clients.py --url http://127.0.0.1:8000/search/?q=a
+"""
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from http_client import build_request, fetch, split_url  # noqa: E402
+from stats import percentile  # noqa: E402
+
+
+async def slow_client(url, piece_delay, stop):
+    """
+    Keeps a connection busy by sending a request one small piece at a time.
+
+    :param url: The URL requested by the slow client.
+    :param piece_delay: Seconds to wait between pieces.
+    :param stop: Event ending the slow client.
+    """
+    host, port, target = split_url(url)
+    request = build_request('GET', target, f'{host}:{port}', {'Connection': 'close'})
+    while not stop.is_set():
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+        except OSError:
+            await asyncio.sleep(piece_delay)
+            continue
+        try:
+            for offset in range(0, len(request), 8):
+                if stop.is_set():
+                    break
+                writer.write(request[offset:offset + 8])
+                await writer.drain()
+                await asyncio.sleep(piece_delay)
+            await reader.read()
+        except OSError:
+            pass
+        finally:
+            writer.close()
+
+
+async def probe(url, latencies, errors):
+    """
+    Sends one ordinary request and records its latency.
+
+    :param url: The URL to request.
+    :param latencies: List collecting latencies in seconds.
+    :param errors: List collecting failed status codes or exceptions.
+    """
+    start = time.perf_counter()
+    try:
+        response = await fetch(url)
+    except OSError as exc:
+        errors.append(exc)
+        return
+    latencies.append(time.perf_counter() - start)
+    if response.status >= 400:
+        errors.append(response.status)
+
+
+async def run(args):
+    stop = asyncio.Event()
+    slow = [asyncio.create_task(slow_client(args.url, args.piece_delay, stop))
+            for _ in range(args.slow_clients)]
+    await asyncio.sleep(args.warmup)
+
+    latencies, errors = [], []
+    for start in range(0, args.probes, args.probe_concurrency):
+        batch = range(start, min(args.probes, start + args.probe_concurrency))
+        await asyncio.gather(*(probe(args.url, latencies, errors) for _ in batch))
+
+    stop.set()
+    for task in slow:
+        task.cancel()
+    await asyncio.gather(*slow, return_exceptions=True)
+
+    if not latencies:
+        print(f'all {len(errors)} probes failed')
+        return
+    print(f'slow clients: {args.slow_clients}  probes: {len(latencies)}  errors: {len(errors)}')
+    for label, fraction in (('p50', 0.50), ('p95', 0.95), ('p99', 0.99)):
+        print(f'{label}: {percentile(latencies, fraction) * 1000:8.1f} ms')
+    print(f'mean: {statistics.fmean(latencies) * 1000:7.1f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--url', default='http://127.0.0.1:8000/search/?q=a')
+    parser.add_argument('--slow-clients', type=int, default=200)
+    parser.add_argument('--piece-delay', type=float, default=0.5)
+    parser.add_argument('--probes', type=int, default=500)
+    parser.add_argument('--probe-concurrency', type=int, default=20)
+    parser.add_argument('--warmup', type=float, default=2.0)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
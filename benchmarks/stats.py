@@ -0,0 +1,15 @@
+"""
+Statistics helpers shared by the benchmark scripts.
+"""
+
+
+def percentile(values, fraction):
+    """
+    Returns a percentile of a list of values (nearest rank).
+
+    :param values: The values.
+    :param fraction: The percentile as a fraction, e.g. 0.99.
+    :return: The percentile value.
+    """
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
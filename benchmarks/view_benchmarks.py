@@ -0,0 +1,219 @@
+"""
+View benchmark suite: latency, query count and allocations of every page.
+
+Runs each scenario through Django's full request cycle (middleware, sessions,
+templates) against the configured database, which should hold a generated
+data set (``manage.py generate_dataset``). For every view it measures
+
+- the p50/p95/p99 latency of ``--iterations`` requests (after ``--warmup``),
+- the number of SQL queries of one request, over all database aliases,
+- the peak memory allocated while serving one request (median of a separate
+  ``tracemalloc`` pass, so tracing does not slow down the timed requests).
+
+The results are written to ``--output`` as JSON and compared with
+``--baseline``; the script exits with status 1 when a view's p95 is more than
+``--max-regression`` percent slower than in the baseline. Record a baseline on
+the reference machine with ``--save-baseline``.
+
+Usage:
+    python benchmarks/view_benchmarks.py --iterations 200
+    python benchmarks/view_benchmarks.py --only search,basket --max-regression 10
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from contextlib import ExitStack
+from datetime import datetime, timezone
+from pathlib import Path
+
+BENCHMARKS_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCHMARKS_DIR.parent))
+sys.path.insert(0, str(BENCHMARKS_DIR))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'LocalFood.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.db import connection, connections  # noqa: E402
+from django.test import Client  # noqa: E402
+from django.test.utils import CaptureQueriesContext  # noqa: E402
+
+from localfood_app.models import Category, Order, OrderProduct, Product, User  # noqa: E402
+from stats import percentile  # noqa: E402
+
+
+def build_scenarios(search_query):
+    """
+    Picks users and objects from the data set and returns the requests to benchmark.
+
+    :param search_query: The phrase used by the search scenario.
+    :return: A dict of scenario name to ``(method, path, data, user)``.
+    """
+    basket_line = OrderProduct.objects.filter(order__is_paid=False).select_related('order__buyer').first()
+    paid_order = Order.objects.filter(is_paid=True, orderproduct__isnull=False).select_related('buyer').first()
+    sold_line = OrderProduct.objects.filter(order=paid_order).select_related('product__seller').first()
+    category = Category.objects.filter(product__isnull=False).first()
+    product = Product.objects.order_by('pk').first()
+    if None in (basket_line, paid_order, sold_line, category, product):
+        raise SystemExit('The database has no orders or products; run manage.py generate_dataset first.')
+
+    buyer = basket_line.order.buyer
+    seller = sold_line.product.seller
+    return {
+        'home': ('get', '/home/', None, buyer),
+        'category': ('get', f'/category/{category.slug}/', None, buyer),
+        'search': ('get', f'/search/?q={search_query}', None, buyer),
+        'product_detail': ('get', f'/product_detail/{product.pk}/', None, buyer),
+        # the product is already in the basket, so this only bumps its quantity
+        'add_to_basket': ('post', f'/product_detail/{basket_line.product_id}/', {}, buyer),
+        'basket': ('get', '/basket/', None, buyer),
+        'order_history': ('get', '/order_history/', None, paid_order.buyer),
+        'order_history_detail': ('get', f'/order_history/{paid_order.pk}/', None, paid_order.buyer),
+        'seller_orders': ('get', '/seller_orders/', None, seller),
+        'seller_order_detail': ('get', f'/seller_order_detail/{paid_order.pk}/', None, seller),
+    }
+
+
+def request(client, method, path, data):
+    """
+    Sends one request and fails loudly on an error response.
+    """
+    response = getattr(client, method)(path, data) if data is not None else getattr(client, method)(path)
+    if response.status_code >= 400:
+        raise RuntimeError(f'{method.upper()} {path} returned {response.status_code}')
+    return response
+
+
+def count_queries(client, method, path, data):
+    """
+    Returns the number of queries of one request, summed over all databases.
+    """
+    with ExitStack() as stack:
+        contexts = [stack.enter_context(CaptureQueriesContext(connections[alias])) for alias in connections]
+        request(client, method, path, data)
+    return sum(len(context) for context in contexts)
+
+
+def peak_allocation(client, method, path, data, repeat):
+    """
+    Returns the median peak of memory allocated while serving a request, in KiB.
+    """
+    peaks = []
+    tracemalloc.start()
+    try:
+        for _ in range(repeat):
+            baseline, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            request(client, method, path, data)
+            _, peak = tracemalloc.get_traced_memory()
+            peaks.append((peak - baseline) / 1024)
+    finally:
+        tracemalloc.stop()
+    return statistics.median(peaks)
+
+
+def benchmark(scenario, args):
+    """
+    Runs the timed, query-counting and allocation passes of one scenario.
+    """
+    method, path, data, user = scenario
+    client = Client(HTTP_HOST='localhost')
+    client.force_login(user)
+    for _ in range(args.warmup):
+        request(client, method, path, data)
+
+    latencies = []
+    for _ in range(args.iterations):
+        start = time.perf_counter()
+        request(client, method, path, data)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    return {
+        'method': method.upper(),
+        'path': path,
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p95_ms': round(percentile(latencies, 0.95), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'mean_ms': round(statistics.fmean(latencies), 3),
+        'queries': count_queries(client, method, path, data),
+        'peak_alloc_kib': round(peak_allocation(client, method, path, data, args.alloc_iterations), 1),
+    }
+
+
+def compare(results, baseline, max_regression):
+    """
+    Prints the change of every view against the baseline.
+
+    :return: The names of the views whose p95 regressed beyond the threshold.
+    """
+    regressions = []
+    for name, result in results['views'].items():
+        previous = baseline['views'].get(name)
+        if previous is None:
+            print(f'{name:<22} not in baseline')
+            continue
+        change = (result['p95_ms'] - previous['p95_ms']) / previous['p95_ms'] * 100
+        queries = result['queries'] - previous['queries']
+        status = 'REGRESSION' if change > max_regression else 'ok'
+        print(f'{name:<22} p95 {previous["p95_ms"]:8.2f} -> {result["p95_ms"]:8.2f} ms ({change:+6.1f}%)  '
+              f'queries {queries:+d}  {status}')
+        if change > max_regression:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--alloc-iterations', type=int, default=10)
+    parser.add_argument('--search', default='honey', help='Search phrase of the search scenario.')
+    parser.add_argument('--only', help='Comma-separated scenario names.')
+    parser.add_argument('--output', default=str(BENCHMARKS_DIR / 'results' / 'latest.json'))
+    parser.add_argument('--baseline', default=str(BENCHMARKS_DIR / 'baseline.json'))
+    parser.add_argument('--save-baseline', action='store_true', help='Also write the results as the baseline.')
+    parser.add_argument('--max-regression', type=float, default=20.0, help='Allowed p95 slowdown in percent.')
+    args = parser.parse_args()
+
+    scenarios = build_scenarios(args.search)
+    if args.only:
+        scenarios = {name: scenarios[name] for name in args.only.split(',')}
+
+    results = {
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'dataset': {'products': Product.objects.count(), 'orders': Order.objects.count(),
+                    'users': User.objects.count()},
+        'views': {},
+    }
+    for name, scenario in scenarios.items():
+        result = benchmark(scenario, args)
+        results['views'][name] = result
+        print(f'{name:<22} p50 {result["p50_ms"]:8.2f}  p95 {result["p95_ms"]:8.2f}  p99 {result["p99_ms"]:8.2f} ms  '
+              f'{result["queries"]:3d} queries  {result["peak_alloc_kib"]:8.1f} KiB')
+
+    Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+    Path(args.output).write_text(json.dumps(results, indent=2))
+    if args.save_baseline:
+        Path(args.baseline).write_text(json.dumps(results, indent=2))
+        return
+
+    if not Path(args.baseline).exists():
+        print(f'No baseline at {args.baseline}; run with --save-baseline to record one.')
+        return
+    regressions = compare(results, json.loads(Path(args.baseline).read_text()), args.max_regression)
+    if regressions:
+        print(f'p95 regressed by more than {args.max_regression}%: {", ".join(regressions)}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+"""
+Daily sales rollups for the seller analytics page.
+
+``SellerDailySales`` holds the units, revenue and paid orders of a seller per
+day, ``ProductDailySales`` the same per product. The ``order_paid`` signal adds
+each payment to the rows of its day (``record_order``), so "how much did I
+sell this month" sums at most 31 rows instead of scanning the order lines.
+Both are kept because the number of orders of a seller is not the sum of the
+orders of their products: an order with two of their products counts once.
+
+Revenue is the quantity times the product price at the time of the payment.
+``rebuild`` recomputes both tables from the paid orders, in chunks of orders,
+e.g. after bulk writes (``manage.py backfill_sales_rollups``); it uses the
+current prices, and the creation date of orders paid before ``paid_at`` was
+recorded.
+"""
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from . import product_cache
+from .models import Order, OrderProduct, ProductDailySales, SellerDailySales
+
+
+def _add(model, keys, deltas, **fields):
+    """
+    Adds to the counters of a rollup row, creating it with ``fields`` if needed.
+    """
+    rows = model.objects.filter(**keys)
+    if rows.update(**{name: F(name) + value for name, value in deltas.items()}):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**keys, **deltas, **fields)
+    except IntegrityError:
+        # created concurrently
+        rows.update(**{name: F(name) + value for name, value in deltas.items()})
+
+
+def record_order(order):
+    """
+    Adds a paid order to the rollups of the day it was paid.
+
+    :param order: The paid order, with ``paid_at`` set.
+    """
+    day = timezone.localdate(order.paid_at)
+    lines = OrderProduct.objects.filter(order=order, product__seller__isnull=False).values(
+        'product_id', 'product__seller_id', 'quantity', 'product__price')
+    products, sellers = _sum_lines(lines)
+    for (seller_id, product_id), (units, revenue) in products.items():
+        _add(ProductDailySales, {'product_id': product_id, 'day': day},
+             {'units': units, 'revenue': revenue, 'orders': 1}, seller_id=seller_id)
+    for seller_id, (units, revenue) in sellers.items():
+        _add(SellerDailySales, {'seller_id': seller_id, 'day': day}, {'units': units, 'revenue': revenue, 'orders': 1})
+
+
+def _sum_lines(lines):
+    """
+    Sums the units and revenue of the lines of one order per product and per seller.
+    """
+    products, sellers = defaultdict(lambda: [0, Decimal(0)]), defaultdict(lambda: [0, Decimal(0)])
+    for line in lines:
+        revenue = line['quantity'] * line['product__price']
+        for totals in (products[line['product__seller_id'], line['product_id']], sellers[line['product__seller_id']]):
+            totals[0] += line['quantity']
+            totals[1] += revenue
+    return products, sellers
+
+
+def rebuild(chunk_size=5000, batch_size=1000):
+    """
+    Recomputes both rollups from the paid orders, reading ``chunk_size`` orders
+    per query.
+
+    :param chunk_size: The number of orders read per query.
+    :param batch_size: The number of rows inserted per query.
+    :return: The number of paid orders read.
+    """
+    products, sellers = defaultdict(lambda: [0, Decimal(0), 0]), defaultdict(lambda: [0, Decimal(0), 0])
+    paid = Order.objects.filter(is_paid=True).order_by('pk').values_list('pk', flat=True)
+    last_order_id, orders = 0, 0
+    while True:
+        order_ids = list(paid.filter(pk__gt=last_order_id)[:chunk_size])
+        if not order_ids:
+            break
+        lines = OrderProduct.objects.filter(
+            order_id__gt=last_order_id, order_id__lte=order_ids[-1], order__is_paid=True,
+            product__seller__isnull=False,
+        ).values('order_id', 'order__paid_at', 'order__created_at', 'product_id', 'product__seller_id',
+                 'quantity', 'product__price').order_by('order_id')
+        current_order, order_lines = None, []
+        for line in lines:
+            if line['order_id'] != current_order and order_lines:
+                _add_to_totals(order_lines, products, sellers)
+                order_lines = []
+            current_order = line['order_id']
+            order_lines.append(line)
+        if order_lines:
+            _add_to_totals(order_lines, products, sellers)
+        last_order_id, orders = order_ids[-1], orders + len(order_ids)
+
+    with transaction.atomic():
+        ProductDailySales.objects.all().delete()
+        SellerDailySales.objects.all().delete()
+        ProductDailySales.objects.bulk_create([
+            ProductDailySales(seller_id=seller_id, product_id=product_id, day=day,
+                              units=units, revenue=revenue, orders=count)
+            for (seller_id, product_id, day), (units, revenue, count) in products.items()
+        ], batch_size=batch_size)
+        SellerDailySales.objects.bulk_create([
+            SellerDailySales(seller_id=seller_id, day=day, units=units, revenue=revenue, orders=count)
+            for (seller_id, day), (units, revenue, count) in sellers.items()
+        ], batch_size=batch_size)
+    return orders
+
+
+def _add_to_totals(order_lines, products, sellers):
+    paid_at = order_lines[0]['order__paid_at'] or order_lines[0]['order__created_at']
+    day = timezone.localdate(paid_at)
+    order_products, order_sellers = _sum_lines(order_lines)
+    for (seller_id, product_id), (units, revenue) in order_products.items():
+        totals = products[seller_id, product_id, day]
+        totals[0], totals[1], totals[2] = totals[0] + units, totals[1] + revenue, totals[2] + 1
+    for seller_id, (units, revenue) in order_sellers.items():
+        totals = sellers[seller_id, day]
+        totals[0], totals[1], totals[2] = totals[0] + units, totals[1] + revenue, totals[2] + 1
+
+
+def default_range(today=None):
+    """
+    Returns the range shown when the analytics page gets none: the last 30 days.
+
+    :param today: The last day of the range, by default today.
+    :return: A (start, end) tuple of dates, both inclusive.
+    """
+    today = timezone.localdate() if today is None else today
+    return today - timedelta(days=29), today
+
+
+def seller_report(seller, start, end, top=10):
+    """
+    Returns the sales of a seller between two days from the rollups.
+
+    :param seller: The seller.
+    :param start: The first day, inclusive.
+    :param end: The last day, inclusive.
+    :param top: The number of best-selling products to list.
+    :return: A dict with the ``totals`` (units, revenue, orders), the ``days``
+        with sales, oldest first, and the ``top_products`` as dicts of
+        ``product``, units, revenue and orders, by revenue.
+    """
+    days = list(SellerDailySales.objects.filter(seller=seller, day__range=(start, end)).order_by('day'))
+    totals = {
+        'units': sum(day.units for day in days),
+        'revenue': sum((day.revenue for day in days), Decimal(0)),
+        'orders': sum(day.orders for day in days),
+    }
+    top_products = list(ProductDailySales.objects.filter(seller=seller, day__range=(start, end)).values(
+        'product_id').annotate(units=Sum('units'), revenue=Sum('revenue'), orders=Sum('orders')).order_by(
+        '-revenue', 'product_id')[:top])
+    products = product_cache.get_products(row['product_id'] for row in top_products)
+    for row in top_products:
+        row['product'] = products.get(row['product_id'])
+    return {'totals': totals, 'days': days, 'top_products': top_products}
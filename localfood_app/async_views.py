@@ -0,0 +1,297 @@
+"""
+Async versions of the read-heavy catalog views, served when the project runs
+with the ASGI deployment profile (``LOCALFOOD_ASGI=1``).
+
+Database access goes through Django's async ORM; only template rendering, which
+is synchronous in Django, the conditional GET validators and the product cache
+run in a worker thread.
+"""
+import asyncio
+import json
+from datetime import datetime
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.http import Http404, HttpResponseBadRequest, StreamingHttpResponse
+from django.shortcuts import render, redirect
+from django.views import View
+
+from . import catalog, conditional, events, popularity, product_cache, recommendations, stock
+from .conditional import AsyncConditionalGetMixin
+from .models import Order
+from .pagination import aget_keyset_page, aget_page
+
+arender = sync_to_async(render)
+add_product_to_basket = sync_to_async(Order.add_product_to_basket)
+aget_product = sync_to_async(product_cache.get_product)
+arelated_products = sync_to_async(recommendations.related_products)
+# the listing filters may query the user's address and the province counts
+afor_request = sync_to_async(catalog.for_request)
+aprecomputed_count = sync_to_async(catalog.precomputed_count)
+afilter_context = sync_to_async(catalog.filter_context)
+amissed_order_messages = sync_to_async(events.missed_order_messages)
+astock_levels = sync_to_async(stock.levels)
+
+
+async def alisting_page(queryset, request, per_page, category_slug=None):
+    """
+    Async counterpart of ``catalog.listing_page``.
+    """
+    sort = catalog.selected_sort(request)
+    if sort:
+        return await aget_keyset_page(queryset, popularity.SORTS[sort], request.GET.get('after'), per_page)
+    count = await aprecomputed_count(request, category_slug)
+    return await aget_page(queryset, request.GET.get('page'), per_page, count=count)
+
+
+class AsyncLoginRequiredMixin(LoginRequiredMixin):
+    """
+    ``LoginRequiredMixin`` for async views, loading the user with ``request.auser()``.
+    """
+    async def dispatch(self, request, *args, **kwargs):
+        request.user = await request.auser()
+        if not request.user.is_authenticated:
+            return self.handle_no_permission()
+        return await super(LoginRequiredMixin, self).dispatch(request, *args, **kwargs)
+
+
+class HomePageView(AsyncLoginRequiredMixin, AsyncConditionalGetMixin, View):
+    """
+    Async view for displaying the home page with a list of products.
+    """
+    def get_validators(self, request):
+        products = catalog.for_request(catalog.recent_products(), request)
+        return conditional.listing_validators(request, products)
+
+    async def get(self, request):
+        """
+        Handles GET requests to display the home page with a paginated list of products.
+
+        :param request: The HTTP request object.
+        :return: Rendered home page with a list of products.
+        """
+        listing = await afor_request(catalog.recent_products(), request)
+        products = await alisting_page(listing, request, 10)
+        ctx = {
+            'products': products,
+            **await afilter_context(request),
+        }
+        return await arender(request, 'localfood_app/dashboard.html', ctx)
+
+    async def post(self, request):
+        """
+        Handles POST requests to add a product to the basket.
+
+        :param request: The HTTP request object.
+        :return: Redirect back to the previous page.
+        """
+        await add_product_to_basket(request.user, request.POST.get('product_id'))
+        return redirect(request.META.get('HTTP_REFERER'))
+
+
+class CategoryProductView(AsyncConditionalGetMixin, View):
+    """
+    Async view for displaying products in a specific category.
+    """
+    def get_validators(self, request, slug):
+        products = catalog.for_request(catalog.category_products(slug), request)
+        return conditional.listing_validators(request, products)
+
+    async def get(self, request, slug):
+        """
+        Handles GET requests to display products filtered by category.
+
+        :param request: The HTTP request object.
+        :param slug: The slug of the category.
+        :return: Rendered category products page with a list of products.
+        """
+        listing = await afor_request(catalog.category_products(slug), request)
+        products = await alisting_page(listing, request, 10, slug)
+        ctx = {
+            'products': products,
+            **await afilter_context(request, slug),
+        }
+        return await arender(request, 'localfood_app/dashboard.html', ctx)
+
+    async def post(self, request, slug):
+        """
+        Handles POST requests to add a product from a specific category to the basket.
+
+        :param request: The HTTP request object.
+        :param slug: The slug of the category.
+        :return: Redirects back to the previous page.
+        """
+        user = await request.auser()
+        await add_product_to_basket(user, request.POST.get('product_id'))
+        return redirect(request.META.get('HTTP_REFERER'))
+
+
+class ProductSearchView(AsyncConditionalGetMixin, View):
+    """
+    Async view for handling product search functionality.
+    """
+    def get_validators(self, request):
+        products = catalog.for_request(catalog.search_products(request.GET.get('q', '').strip()), request)
+        return conditional.listing_validators(request, products)
+
+    async def get(self, request):
+        """
+        Handles GET requests to search for products based on user input.
+
+        :param request: The HTTP request object containing the search query.
+        :return: Rendered search results page with filtered products and pagination.
+        """
+        query = request.GET.get('q', '').strip()
+        listing = await afor_request(catalog.search_products(query), request)
+        products = await aget_page(listing, request.GET.get('page'), 10)
+        ctx = {
+            'products': products,
+            'query': query,
+            **await afilter_context(request, with_counts=False),
+        }
+        return await arender(request, 'localfood_app/search_page.html', ctx)
+
+
+class ProductDetailView(AsyncConditionalGetMixin, View):
+    """
+    Async view for displaying the details of a specific product.
+    """
+    def get_validators(self, request, product_id):
+        return conditional.product_validators(request, product_id)
+
+    async def get(self, request, product_id):
+        """
+        Handles GET requests to display the details of a specific product.
+
+        :param request: The HTTP request object.
+        :param product_id: The ID of the product to display.
+        :return: Rendered product detail page.
+        """
+        product = await aget_product(product_id)
+        if product is None:
+            raise Http404('No product matches the given query.')
+        return await arender(request, 'localfood_app/product_detail.html', {
+            'product': product,
+            'related_products': await arelated_products(product.pk),
+            'stock_events': settings.ASGI_PROFILE,
+        })
+
+    async def post(self, request, product_id):
+        """
+        Handles POST requests to add the product to the user's basket.
+
+        :param request: The HTTP request object.
+        :param product_id: The ID of the product to add to the basket.
+        :return: Redirects to the home page.
+        """
+        user = await request.auser()
+        await add_product_to_basket(user, product_id)
+        return redirect('localfood_app:home')
+
+
+def sse_message(event, data, event_id=None):
+    """
+    Formats one server-sent event.
+
+    :param event: The event type.
+    :param data: The JSON-serializable payload.
+    :param event_id: The ID the client sends back as ``Last-Event-ID`` when it reconnects.
+    :return: The event as text.
+    """
+    lines = [f'event: {event}']
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'data: {json.dumps(data)}')
+    return '\n'.join(lines) + '\n\n'
+
+
+def event_stream_response(stream):
+    """
+    Wraps an async iterator of server-sent events in an uncached, unbuffered response.
+    """
+    response = StreamingHttpResponse(stream, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # nginx would otherwise buffer the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+class SellerOrderEventsView(AsyncLoginRequiredMixin, View):
+    """
+    Server-sent event stream of the orders paid for a seller's products,
+    replacing polling of the seller orders page.
+    """
+    async def get(self, request):
+        """
+        Handles GET requests to open the stream. A client reconnecting with
+        ``Last-Event-ID`` first gets the orders paid since that event.
+
+        :param request: The HTTP request object.
+        :return: A ``text/event-stream`` response of ``order`` events.
+        """
+        try:
+            since = datetime.fromisoformat(request.headers.get('Last-Event-ID', ''))
+        except ValueError:
+            since = None
+        return event_stream_response(self.stream(request.user.pk, since))
+
+    async def stream(self, seller_id, since):
+        subscription = events.subscribe(events.seller_topic(seller_id))
+        try:
+            yield f'retry: {settings.EVENTS_KEEPALIVE_SECONDS * 1000}\n\n'
+            if since is not None:
+                for message in await amissed_order_messages(seller_id, since):
+                    yield sse_message('order', message, message['paid_at'])
+            while not subscription.overflowed:
+                try:
+                    message = await asyncio.wait_for(subscription.get(), settings.EVENTS_KEEPALIVE_SECONDS)
+                except TimeoutError:
+                    yield ': keep-alive\n\n'
+                    continue
+                yield sse_message('order', message, message['paid_at'])
+            yield sse_message('reload', {})
+        finally:
+            events.unsubscribe(subscription)
+
+
+class ProductStockEventsView(View):
+    """
+    Server-sent event stream of the stock levels of the products on a page,
+    e.g. ``?product=3``, so buyers see a product selling out without reloading.
+    """
+    async def get(self, request):
+        """
+        Handles GET requests to open the stream.
+
+        :param request: The HTTP request object.
+        :return: A ``text/event-stream`` response of ``stock`` events, whose
+            data maps product IDs to their quantity, or a 400 response for
+            missing, invalid or too many product IDs.
+        """
+        product_ids = request.GET.getlist('product')
+        if not product_ids or not all(product_id.isdigit() for product_id in product_ids):
+            return HttpResponseBadRequest('Product IDs are required.')
+        product_ids = sorted({int(product_id) for product_id in product_ids})
+        if len(product_ids) > settings.STOCK_EVENTS_MAX_PRODUCTS:
+            return HttpResponseBadRequest(f'At most {settings.STOCK_EVENTS_MAX_PRODUCTS} products can be followed.')
+        return event_stream_response(self.stream(product_ids))
+
+    async def stream(self, product_ids):
+        subscription = events.subscribe_latest([stock.product_topic(product_id) for product_id in product_ids],
+                                               key=lambda message: message['product'])
+        try:
+            yield f'retry: {settings.EVENTS_KEEPALIVE_SECONDS * 1000}\n\n'
+            # the levels may have changed while the page was rendered or the stream reconnected
+            yield sse_message('stock', await astock_levels(product_ids))
+            while True:
+                try:
+                    messages = await asyncio.wait_for(subscription.get(), settings.EVENTS_KEEPALIVE_SECONDS)
+                except TimeoutError:
+                    yield ': keep-alive\n\n'
+                    continue
+                yield sse_message('stock', {message['product']: message['quantity'] for message in messages.values()})
+                # the changes until then are merged into the next update
+                await asyncio.sleep(settings.STOCK_EVENTS_INTERVAL_SECONDS)
+        finally:
+            events.unsubscribe(subscription)
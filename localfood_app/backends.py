@@ -0,0 +1,72 @@
+import copy
+
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+
+from .metrics import record_cache_access
+
+
+def user_cache_key(user_id):
+    """
+    Returns the cache key of a user.
+
+    :param user_id: The ID of the user.
+    :return: The cache key.
+    """
+    return f'user:v1:{user_id}'
+
+
+def _cacheable(user):
+    """
+    Returns a copy of a user to cache: the password hash is left out (and
+    loaded again if the copy needs it), only the session hash ``get_user``
+    verifies is kept.
+    """
+    cached = copy.copy(user)
+    cached._session_auth_hash = user.get_session_auth_hash()
+    del cached.password
+    return cached
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    ``ModelBackend`` that keeps the users loaded by ``AuthenticationMiddleware``
+    in the cache when ``settings.SESSION_CACHE`` is on, so identifying the user
+    of a request needs no query. ``signals.py`` removes a user from the cache
+    whenever it is saved, e.g. by the profile and password change views, or by
+    ``login`` updating ``last_login``, and again when the transaction commits.
+
+    Sessions store the path of the backend that logged the user in, so
+    ``ModelBackend`` stays listed after this one for the sessions it created.
+    """
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        """
+        Returns the user with the given credentials; when they are invalid,
+        stops ``ModelBackend`` from hashing the same password again.
+        """
+        user = super().authenticate(request, username=username, password=password, **kwargs)
+        if user is None:
+            raise PermissionDenied
+        return user
+
+    def get_user(self, user_id):
+        """
+        Returns the active user with the given ID, from the cache where possible.
+
+        :param user_id: The ID of the user.
+        :return: The user, or None.
+        """
+        if not settings.SESSION_CACHE:
+            return super().get_user(user_id)
+        key = user_cache_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            record_cache_access('user', hits=0, misses=1)
+            user = super().get_user(user_id)
+            if user is not None:
+                cache.set(key, _cacheable(user), timeout=settings.USER_CACHE_TIMEOUT)
+            return user
+        record_cache_access('user', hits=1)
+        return user if self.user_can_authenticate(user) else None
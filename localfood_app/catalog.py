@@ -0,0 +1,225 @@
+from collections import namedtuple
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.db.models import OuterRef, Prefetch, Subquery
+
+from . import geo, popularity, provinces
+from .models import Address, Product, ProductImage
+from .pagination import get_keyset_page, get_page
+
+NearSearch = namedtuple('NearSearch', 'latitude longitude km near')
+
+
+def with_listing_relations(queryset):
+    """
+    Loads the relations the catalog templates use, so rendering a page of
+    products does not run a query per product.
+
+    :param queryset: A queryset of products.
+    :return: The queryset with product images prefetched.
+    """
+    return queryset.prefetch_related(
+        Prefetch('productimage_set', queryset=ProductImage.objects.order_by('pk'))
+    )
+
+
+def recent_products():
+    """
+    Returns all products, newest first.
+
+    :return: A queryset of products for the home page.
+    """
+    return with_listing_relations(Product.objects.order_by('-created_at'))
+
+
+def category_products(slug):
+    """
+    Returns the products of a category, newest first.
+
+    :param slug: The slug of the category.
+    :return: A queryset of products in the category.
+    """
+    return with_listing_relations(
+        Product.objects.filter(category__slug=slug).order_by('-created_at')
+    )
+
+
+def search_products(query):
+    """
+    Returns the products whose name contains the query, or all products
+    for an empty query, newest first.
+
+    :param query: The search phrase.
+    :return: A queryset of matching products.
+    """
+    queryset = Product.objects.order_by('-created_at')
+    if query:
+        queryset = queryset.filter(name__icontains=query)
+    return with_listing_relations(queryset)
+
+
+def near_search(request):
+    """
+    Returns the "near me" search of a catalog request, if any.
+
+    The ``near`` parameter is a postal code, or ``me`` for the address of the
+    logged-in user; ``km`` is the radius. The result is kept on the request, as
+    the conditional GET validators and the view both need it.
+
+    :param request: The HTTP request.
+    :return: A ``NearSearch``, or None when the request has no (known) location.
+    """
+    if not hasattr(request, 'near_search'):
+        request.near_search = _near_search(request)
+    return request.near_search
+
+
+def _near_search(request):
+    near = request.GET.get('near', '').strip()
+    if near == 'me':
+        location = None
+        if request.user.is_authenticated:
+            location = Address.objects.filter(user=request.user, grid_cell__isnull=False).values_list(
+                'latitude', 'longitude').order_by('pk').first()
+    else:
+        location = geo.locate(near)
+    if location is None:
+        return None
+    try:
+        km = float(request.GET.get('km', settings.NEAR_ME_DEFAULT_KM))
+    except ValueError:
+        km = settings.NEAR_ME_DEFAULT_KM
+    km = min(max(km, 1), settings.NEAR_ME_MAX_KM)
+    return NearSearch(*location, km, near)
+
+
+def nearby_products(queryset, search):
+    """
+    Narrows a product listing to the sellers within a radius, nearest first.
+
+    The sellers are found through the grid cells around the point, so only
+    their addresses get an exact distance computed. A seller with several
+    addresses is as near as the nearest one.
+
+    :param queryset: A queryset of products.
+    :param search: The ``NearSearch``.
+    :return: The products within ``search.km``, annotated with ``distance`` in
+        kilometres and ordered by it.
+    """
+    addresses = Address.objects.filter(grid_cell__in=geo.cells_within(search.latitude, search.longitude, search.km))
+    nearest = addresses.filter(user=OuterRef('seller_id')).annotate(
+        distance=geo.distance_km(search.latitude, search.longitude)
+    ).order_by('distance').values('distance')[:1]
+    return queryset.filter(seller_id__in=addresses.values('user_id')).annotate(
+        distance=Subquery(nearest)
+    ).filter(distance__lte=search.km).order_by('distance', '-created_at')
+
+
+def selected_province(request):
+    """
+    Returns the province a catalog request is filtered by.
+
+    :param request: The HTTP request.
+    :return: The province from the ``province`` parameter, or None.
+    """
+    province = request.GET.get('province', '')
+    return province if province in provinces.PROVINCES else None
+
+
+def for_request(queryset, request):
+    """
+    Applies the province filter and the "near me" search of a request to a
+    product listing.
+
+    :param queryset: A queryset of products.
+    :param request: The HTTP request.
+    :return: The queryset, filtered by the seller province and narrowed by
+        ``nearby_products`` if the request asks for them.
+    """
+    province = selected_province(request)
+    if province:
+        queryset = queryset.filter(seller_province=province)
+    search = near_search(request)
+    return nearby_products(queryset, search) if search else queryset
+
+
+def precomputed_count(request, category_slug=None):
+    """
+    Returns the number of products of a province-filtered listing from the
+    precomputed counts, or None if the listing has to be counted.
+
+    :param request: The HTTP request of the home page or of a category page.
+    :param category_slug: The slug of the listed category, or None for all.
+    :return: The number of products, or None.
+    """
+    province = selected_province(request)
+    if province is None or near_search(request):
+        return None
+    return provinces.listing_count(province, category_slug)
+
+
+def selected_sort(request):
+    """
+    Returns the popularity sort a catalog request asks for.
+
+    :param request: The HTTP request.
+    :return: A key of ``popularity.SORTS`` from the ``sort`` parameter, or None
+        for the newest products first.
+    """
+    sort = request.GET.get('sort', '')
+    return sort if sort in popularity.SORTS else None
+
+
+def listing_page(queryset, request, per_page, category_slug=None):
+    """
+    Returns the requested page of a home or category listing.
+
+    A popularity sort is paginated by keyset (the ``after`` parameter) over its
+    index; the default order by page number, counted from the precomputed
+    province counts where possible.
+
+    :param queryset: The queryset of the listed products, as returned by ``for_request``.
+    :param request: The HTTP request.
+    :param per_page: Number of products per page.
+    :param category_slug: The slug of the listed category, or None for all.
+    :return: A ``KeysetPage`` for a popularity sort, otherwise a ``Page``.
+    """
+    sort = selected_sort(request)
+    if sort:
+        return get_keyset_page(queryset, popularity.SORTS[sort], request.GET.get('after'), per_page)
+    return get_page(queryset, request.GET.get('page'), per_page, count=precomputed_count(request, category_slug))
+
+
+def filter_context(request, category_slug=None, with_counts=True):
+    """
+    Returns the template context of the listing filters.
+
+    :param request: The HTTP request.
+    :param category_slug: The slug of the listed category, or None for all.
+    :param with_counts: Whether to show the number of products per province
+        and the popularity sorts, which only apply to listings without a
+        search phrase.
+    :return: A dict with the ``near`` search, the selected ``province``, the
+        ``provinces`` as (name, count) pairs, the selected ``sort`` and the
+        offered ``sorts``, and the ``filter_query`` to append to pagination links.
+    """
+    search = near_search(request)
+    province = selected_province(request)
+    counts = provinces.counts_by_province(category_slug) if with_counts else {}
+    parameters = {}
+    if search:
+        parameters.update(near=search.near, km=f'{search.km:g}')
+    if province:
+        parameters['province'] = province
+    sort = selected_sort(request) if with_counts else None
+    if sort:
+        parameters['sort'] = sort
+    return {
+        'near': search,
+        'province': province,
+        'provinces': [(name, counts.get(name, 0) if with_counts else None) for name in provinces.PROVINCES],
+        'sort': sort,
+        'sorts': list(popularity.SORTS) if with_counts else [],
+        'filter_query': '&' + urlencode(parameters) if parameters else '',
+    }
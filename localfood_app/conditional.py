@@ -0,0 +1,137 @@
+"""
+Conditional GET for the catalog pages.
+
+The views compute an ``ETag`` and ``Last-Modified`` before doing any work. A
+listing's come from the latest ``updated_at`` of the listed products, one
+query on the ``updated_at`` index, and from the page cache generation, which
+the signals bump whenever a product is deleted or a category or address
+changes; a product page's come from the cached product and the categories
+version of the product cache. A client that already has the current page gets a 304 without the
+products being counted or loaded or a template being rendered. The pages also
+show the user's name, the category sidebar and a CSRF token, so the ETag
+covers the user and the session (whose key changes whenever the CSRF token is
+rotated, i.e. on login) as well.
+"""
+import hashlib
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db.models import Max
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+from . import page_cache, product_cache
+
+
+def _timestamp(*values):
+    """
+    Returns the latest of the given datetimes as a Unix timestamp, or None.
+    """
+    values = [value for value in values if value is not None]
+    return int(max(values).timestamp()) if values else None
+
+
+def _validators(request, last_modified, *state):
+    """
+    Builds the validators of a page from the state it was rendered from.
+
+    :param request: The HTTP request.
+    :param last_modified: The Unix timestamp of the latest change, or None.
+    :param state: Values that change whenever the page content changes.
+    :return: An (etag, last_modified) tuple.
+    """
+    key = repr((
+        request.user.pk,
+        request.get_full_path(),
+        getattr(getattr(request, 'session', None), 'session_key', None),
+        *state,
+    ))
+    return f'"{hashlib.md5(key.encode(), usedforsecurity=False).hexdigest()}"', last_modified
+
+
+def listing_validators(request, products):
+    """
+    Returns the validators of a product listing page.
+
+    :param request: The HTTP request.
+    :param products: The queryset of the listed products.
+    :return: An (etag, last_modified) tuple.
+    """
+    updated = products.order_by().aggregate(updated=Max('updated_at'))['updated']
+    return _validators(request, _timestamp(updated), updated, cache.get(page_cache.GENERATION_KEY, 0))
+
+
+def product_validators(request, product_id):
+    """
+    Returns the validators of a product detail page.
+
+    :param request: The HTTP request.
+    :param product_id: The ID of the product.
+    :return: An (etag, last_modified) tuple, or None if the product does not exist.
+    """
+    product = product_cache.get_product(product_id)
+    if product is None:
+        return None
+    return _validators(
+        request,
+        _timestamp(product.updated_at),
+        product.updated_at, product_cache.categories_version(),
+    )
+
+
+def _not_modified(request, validators):
+    if validators is None:
+        return None
+    etag, last_modified = validators
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        _add_headers(response, validators)
+    return response
+
+
+def _add_headers(response, validators):
+    etag, last_modified = validators
+    if response.status_code in (200, 304):
+        response.headers.setdefault('ETag', etag)
+        if last_modified is not None:
+            response.headers.setdefault('Last-Modified', http_date(last_modified))
+    patch_vary_headers(response, ('Cookie',))
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+class ConditionalGetMixin:
+    """
+    Answers GET and HEAD requests with 304 when the client's copy is current.
+
+    Views implement ``get_validators`` with the same arguments as ``get``,
+    returning an (etag, last_modified) tuple or None to skip the check.
+    """
+    def get_validators(self, request, *args, **kwargs):
+        raise NotImplementedError
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return super().dispatch(request, *args, **kwargs)
+        validators = self.get_validators(request, *args, **kwargs)
+        response = _not_modified(request, validators)
+        if response is not None:
+            return response
+        response = super().dispatch(request, *args, **kwargs)
+        return _add_headers(response, validators) if validators else response
+
+
+class AsyncConditionalGetMixin(ConditionalGetMixin):
+    """
+    ``ConditionalGetMixin`` for async views; the validators are computed in a
+    worker thread.
+    """
+    async def dispatch(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return await super(ConditionalGetMixin, self).dispatch(request, *args, **kwargs)
+        validators = await sync_to_async(self.get_validators)(request, *args, **kwargs)
+        response = _not_modified(request, validators)
+        if response is not None:
+            return response
+        response = await super(ConditionalGetMixin, self).dispatch(request, *args, **kwargs)
+        return _add_headers(response, validators) if validators else response
@@ -0,0 +1,332 @@
+"""
+Publish/subscribe for the server-sent event streams of the ASGI profile.
+
+Streams subscribe to a topic (e.g. ``seller:42``) on the in-process ``hub``
+and wait on a bounded asyncio queue, so an idle connection costs no queries
+and no polling. ``publish`` is called from the synchronous request threads,
+typically after a transaction commits, and hands the message to the backend
+chosen by ``settings.EVENTS_BACKEND``:
+
+- ``process`` delivers it to the subscribers of the publishing process only,
+  which is enough with a single worker.
+- ``unix`` fans it out to every worker process on the host. Each process
+  receiving events binds a datagram socket in ``settings.EVENTS_SOCKET_DIR``
+  and a publisher sends the message to all of them. Sockets of processes that
+  have exited are removed by the next publisher. Nothing leaves the host, so
+  several hosts need a shared broker instead.
+
+A subscriber that falls ``settings.EVENTS_QUEUE_SIZE`` messages behind stops
+receiving them and is marked ``overflowed``; its stream then tells the client
+to reload. Streams that only show the latest state (e.g. stock levels) use
+``subscribe_latest`` instead, which merges the messages waiting to be read.
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+import threading
+import uuid
+from collections import defaultdict
+from pathlib import Path
+
+from django.conf import settings
+from django.db.models import F, Sum
+
+from .models import OrderProduct
+
+logger = logging.getLogger(__name__)
+
+MAX_DATAGRAM = 64 * 1024
+
+
+class Subscription:
+    """
+    The queue of the messages of some topics for one stream.
+
+    Attributes:
+        topics (tuple): The subscribed topics.
+        overflowed (bool): Whether messages were dropped because the queue was full.
+    """
+    def __init__(self, topics, loop, maxsize):
+        self.topics = tuple(topics)
+        self.overflowed = False
+        self._loop = loop
+        self._queue = asyncio.Queue(maxsize)
+
+    def _put(self, message):
+        try:
+            self._queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+    def deliver(self, message):
+        """
+        Queues a message, from any thread.
+        """
+        try:
+            self._loop.call_soon_threadsafe(self._put, message)
+        except RuntimeError:
+            # the stream's event loop is closed
+            pass
+
+    async def get(self):
+        """
+        Waits for the next message.
+        """
+        return await self._queue.get()
+
+
+class MergingSubscription(Subscription):
+    """
+    A subscription keeping only the latest message per key, for streams showing
+    a current state: however many messages arrive between two reads, ``get``
+    returns at most one per key, and the subscription never overflows.
+    """
+    def __init__(self, topics, loop, key):
+        super().__init__(topics, loop, 0)
+        self._key = key
+        self._pending = {}
+        self._changed = asyncio.Event()
+
+    def _put(self, message):
+        self._pending[self._key(message)] = message
+        self._changed.set()
+
+    async def get(self):
+        """
+        Waits for messages and returns them as a dict by key.
+        """
+        await self._changed.wait()
+        self._changed.clear()
+        pending, self._pending = self._pending, {}
+        return pending
+
+
+class Hub:
+    """
+    The subscriptions of this process, by topic.
+    """
+    def __init__(self):
+        self._subscriptions = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def add(self, subscription):
+        """
+        Starts delivering the messages of its topics to a subscription.
+
+        :param subscription: A ``Subscription``; pass it to ``unsubscribe`` when the stream ends.
+        :return: The subscription.
+        """
+        with self._lock:
+            for topic in subscription.topics:
+                self._subscriptions[topic].add(subscription)
+        return subscription
+
+    def subscribe(self, topic, maxsize=None):
+        """
+        Subscribes the running event loop to a topic.
+
+        :param topic: The topic.
+        :param maxsize: The queue size, by default ``settings.EVENTS_QUEUE_SIZE``.
+        :return: A ``Subscription``; pass it to ``unsubscribe`` when the stream ends.
+        """
+        return self.add(Subscription((topic,), asyncio.get_running_loop(),
+                                     settings.EVENTS_QUEUE_SIZE if maxsize is None else maxsize))
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for topic in subscription.topics:
+                subscriptions = self._subscriptions.get(topic, set())
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    self._subscriptions.pop(topic, None)
+
+    def deliver(self, topic, message):
+        """
+        Hands a message to the subscribers of a topic in this process.
+        """
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(topic, ()))
+        for subscription in subscriptions:
+            subscription.deliver(message)
+
+
+hub = Hub()
+
+
+class ProcessBackend:
+    """
+    Delivers published messages to the subscribers of this process.
+    """
+    def publish(self, topic, message):
+        hub.deliver(topic, message)
+
+    def listen(self):
+        pass
+
+
+class UnixSocketBackend:
+    """
+    Fans published messages out to every process on the host through datagram
+    sockets in a shared directory.
+    """
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self._listening = False
+        self._lock = threading.Lock()
+
+    def publish(self, topic, message):
+        payload = json.dumps([topic, message]).encode()
+        if len(payload) > MAX_DATAGRAM:
+            logger.warning('Dropped an event of %d bytes on %s', len(payload), topic)
+            return
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sender:
+            sender.setblocking(False)
+            for path in self.directory.glob('*.sock'):
+                try:
+                    sender.sendto(payload, str(path))
+                except (ConnectionRefusedError, FileNotFoundError):
+                    # the receiving process has exited
+                    path.unlink(missing_ok=True)
+                except BlockingIOError:
+                    logger.warning('Dropped an event on %s: the receiver at %s is not reading', topic, path)
+
+    def listen(self):
+        """
+        Starts receiving the messages of other processes, once per process.
+        """
+        with self._lock:
+            if self._listening:
+                return
+            self.directory.mkdir(parents=True, exist_ok=True)
+            path = self.directory / f'{os.getpid()}-{uuid.uuid4().hex[:8]}.sock'
+            receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            receiver.bind(str(path))
+            threading.Thread(target=self._receive, args=(receiver,), name='localfood-events', daemon=True).start()
+            self._listening = True
+
+    def _receive(self, receiver):
+        while True:
+            try:
+                topic, message = json.loads(receiver.recv(MAX_DATAGRAM))
+            except (ValueError, TypeError):
+                continue
+            hub.deliver(topic, message)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def backend():
+    """
+    Returns the backend chosen by ``settings.EVENTS_BACKEND``.
+    """
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            if settings.EVENTS_BACKEND == 'unix':
+                _backend = UnixSocketBackend(settings.EVENTS_SOCKET_DIR)
+            else:
+                _backend = ProcessBackend()
+        return _backend
+
+
+def reset():
+    """
+    Forgets the backend, so the next use follows the current settings; for tests.
+    """
+    global _backend
+    with _backend_lock:
+        _backend = None
+
+
+def publish(topic, message):
+    """
+    Publishes a message to the subscribers of a topic in every process the
+    backend reaches. Errors are logged, never raised to the publisher.
+
+    :param topic: The topic.
+    :param message: A JSON-serializable message.
+    """
+    try:
+        backend().publish(topic, message)
+    except OSError:
+        logger.exception('Could not publish an event on %s', topic)
+
+
+def subscribe(topic):
+    """
+    Subscribes the running event loop to a topic, starting to receive the
+    messages of other processes if the backend needs it.
+
+    :param topic: The topic.
+    :return: A ``Subscription``.
+    """
+    backend().listen()
+    return hub.subscribe(topic)
+
+
+def subscribe_latest(topics, key):
+    """
+    Subscribes the running event loop to several topics, keeping only the
+    latest message per key (see ``MergingSubscription``).
+
+    :param topics: The topics.
+    :param key: A function returning the key of a message.
+    :return: A ``MergingSubscription``.
+    """
+    backend().listen()
+    return hub.add(MergingSubscription(topics, asyncio.get_running_loop(), key))
+
+
+def unsubscribe(subscription):
+    hub.unsubscribe(subscription)
+
+
+def seller_topic(seller_id):
+    return f'seller:{seller_id}'
+
+
+def _order_message(order_id, paid_at, units, total):
+    return {'order': order_id, 'paid_at': paid_at.isoformat(), 'units': units, 'total': f'{total:.2f}'}
+
+
+def paid_order_messages(order):
+    """
+    Returns the notifications of a paid order for the sellers of its products.
+
+    :param order: The paid order, with ``paid_at`` set.
+    :return: A dict of seller ID to message, with the order ID, the payment time,
+        and the units and value of that seller's products.
+    """
+    rows = OrderProduct.objects.filter(order=order, product__seller__isnull=False).values(
+        'product__seller_id').annotate(units=Sum('quantity'), total=Sum(F('quantity') * F('product__price')))
+    return {row['product__seller_id']: _order_message(order.pk, order.paid_at, row['units'], row['total'])
+            for row in rows.order_by()}
+
+
+def missed_order_messages(seller_id, since, limit=50):
+    """
+    Returns the notifications of a seller for the orders paid after a time,
+    for a stream reconnecting with ``Last-Event-ID``.
+
+    :param seller_id: The ID of the seller.
+    :param since: The payment time of the last order the client received.
+    :param limit: The maximum number of messages; the newest are kept.
+    :return: A list of messages like those of ``paid_order_messages``, oldest first.
+    """
+    rows = OrderProduct.objects.filter(product__seller_id=seller_id, order__paid_at__gt=since).values(
+        'order_id', 'order__paid_at').annotate(
+        units=Sum('quantity'), total=Sum(F('quantity') * F('product__price'))).order_by('-order__paid_at')[:limit]
+    return [_order_message(row['order_id'], row['order__paid_at'], row['units'], row['total'])
+            for row in reversed(rows)]
+
+
+def publish_paid_order(messages):
+    """
+    Publishes the notifications returned by ``paid_order_messages``.
+    """
+    for seller_id, message in messages.items():
+        publish(seller_topic(seller_id), message)
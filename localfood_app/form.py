@@ -80,17 +80,52 @@ class LoginForm(forms.Form):
     username = forms.CharField()
     password = forms.CharField(widget=forms.PasswordInput)
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.user_cache = None
+
     def clean(self):
         cleaned_data = super().clean()
         username = cleaned_data.get("username")
         password = cleaned_data.get("password")
 
         if username and password:
-            user = authenticate(username=username, password=password)
-            if user is None:
+            self.user_cache = authenticate(username=username, password=password)
+            if self.user_cache is None:
                 raise forms.ValidationError("Please enter a correct username and password.")
         return cleaned_data
 
+    def get_user(self):
+        """
+        Returns the user authenticated while cleaning the form, so the password
+        is only checked once per login.
+        """
+        return self.user_cache
+
+
+class SalesRangeForm(forms.Form):
+    """
+    Form for choosing the days shown on the seller analytics page.
+
+    Attributes:
+        start (DateField): The first day, inclusive.
+        end (DateField): The last day, inclusive.
+    """
+    MAX_DAYS = 366
+
+    start = forms.DateField(widget=forms.DateInput(attrs={'type': 'date', 'class': 'form-control form-control-sm'}))
+    end = forms.DateField(widget=forms.DateInput(attrs={'type': 'date', 'class': 'form-control form-control-sm'}))
+
+    def clean(self):
+        cleaned_data = super().clean()
+        start, end = cleaned_data.get('start'), cleaned_data.get('end')
+        if start and end:
+            if start > end:
+                raise forms.ValidationError('The start date must not be after the end date.')
+            if (end - start).days >= self.MAX_DAYS:
+                raise forms.ValidationError(f'Choose at most {self.MAX_DAYS} days.')
+        return cleaned_data
+
 
 class AddProductForm(forms.ModelForm):
     """
@@ -111,6 +146,62 @@ class AddProductForm(forms.ModelForm):
         fields = ['name', 'description', 'price', 'quantity', 'category', 'file_path']
 
 
+class ProductImportForm(AddProductForm):
+    """
+    Form validating one row of a product import with the rules of ``AddProductForm``.
+
+    The category is looked up by slug from a preloaded map instead of a query
+    per row, and imported products have no image.
+    """
+    file_path = None
+
+    class Meta(AddProductForm.Meta):
+        fields = ['name', 'description', 'price', 'quantity']
+
+
+class ProductImportUploadForm(forms.Form):
+    """
+    Form for uploading a product import file.
+
+    Attributes:
+        file (FileField): A CSV file with a header row, or a JSON Lines file.
+    """
+    file = forms.FileField(widget=forms.ClearableFileInput(attrs={'class': 'form-control-file',
+                                                                  'accept': '.csv,.jsonl,.ndjson'}))
+
+
+class InventoryForm(forms.ModelForm):
+    """
+    Form for editing the price and quantity of one product on the inventory page.
+
+    The fields keep the value they were shown with in a hidden input, so
+    ``changed_data`` only lists what the seller changed.
+
+    Attributes:
+        product (IntegerField): The ID of the product.
+        price (DecimalField): The price of the product.
+        quantity (PositiveIntegerField): The available quantity of the product.
+    """
+    product = forms.IntegerField(widget=forms.HiddenInput)
+
+    class Meta:
+        model = Product
+        fields = ['price', 'quantity']
+        widgets = {
+            'price': forms.NumberInput(attrs={'class': 'form-control form-control-sm'}),
+            'quantity': forms.NumberInput(attrs={'class': 'form-control form-control-sm'}),
+        }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        for name in self._meta.fields:
+            self.fields[name].show_hidden_initial = True
+
+
+# the inventory page edits at most one page of products per submit
+InventoryFormSet = forms.formset_factory(InventoryForm, extra=0, max_num=50, absolute_max=50, validate_max=True)
+
+
 class ProfileForm(forms.ModelForm):
     """
     Form for updating user profile information.
@@ -0,0 +1,136 @@
+"""
+Distances between buyers and sellers without a spatial database.
+
+Addresses are placed at the centroid of their postal district (the first two
+digits of a Polish postal code), from the table bundled in
+``data/postal_centroids.csv``. Every located address also stores the number of
+its cell in a grid of ``GRID_DEGREES`` squares. A "near me" search first
+selects the addresses in the grid cells overlapping the search radius through
+the index on that column, then computes the exact great-circle (haversine)
+distance for those rows only. The distance uses plain SQL math functions,
+which Django provides on SQLite as well, so this works without PostGIS.
+"""
+import csv
+import math
+import re
+from functools import lru_cache
+from pathlib import Path
+
+from django.db.models import F
+from django.db.models.functions import ASin, Cos, Power, Radians, Sin, Sqrt
+
+CENTROIDS_PATH = Path(__file__).resolve().parent / 'data' / 'postal_centroids.csv'
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = 111.2
+# Changing the grid size requires running ``manage.py locate_addresses``
+GRID_DEGREES = 0.25
+GRID_COLUMNS = round(360 / GRID_DEGREES)
+
+POSTAL_CODE_RE = re.compile(r'^\s*(\d{2})-?\d{3}\s*$')
+
+
+@lru_cache(maxsize=None)
+def centroids():
+    """
+    Returns the bundled postal district centroids.
+
+    :return: A dict of two-digit postal code prefix to (latitude, longitude).
+    """
+    with open(CENTROIDS_PATH, newline='', encoding='utf-8') as file:
+        return {row['prefix']: (float(row['latitude']), float(row['longitude'])) for row in csv.DictReader(file)}
+
+
+def locate(postal_code):
+    """
+    Returns the coordinates of a postal code.
+
+    :param postal_code: A postal code such as ``00-950`` or ``00950``.
+    :return: A (latitude, longitude) tuple, or None if the code is unknown.
+    """
+    match = POSTAL_CODE_RE.match(postal_code or '')
+    return centroids().get(match.group(1)) if match else None
+
+
+def location_fields(postal_code):
+    """
+    Returns the stored location of an address with a postal code.
+
+    :param postal_code: The postal code.
+    :return: A (latitude, longitude, grid cell) tuple, all None if the code is unknown.
+    """
+    location = locate(postal_code)
+    return (*location, grid_cell(*location)) if location else (None, None, None)
+
+
+def locate_addresses(address_model, batch_size=1000):
+    """
+    Sets the location of every address from its postal code.
+
+    :param address_model: The ``Address`` model.
+    :param batch_size: The number of addresses updated per query.
+    :return: The number of addresses with a known location.
+    """
+    located, batch = 0, []
+    for address in address_model.objects.only('pk', 'postal_code').iterator(chunk_size=batch_size):
+        address.latitude, address.longitude, address.grid_cell = location_fields(address.postal_code)
+        located += address.grid_cell is not None
+        batch.append(address)
+        if len(batch) == batch_size:
+            address_model.objects.bulk_update(batch, ['latitude', 'longitude', 'grid_cell'])
+            batch = []
+    address_model.objects.bulk_update(batch, ['latitude', 'longitude', 'grid_cell'])
+    return located
+
+
+def grid_cell(latitude, longitude):
+    """
+    Returns the number of the grid cell containing a point.
+    """
+    row = math.floor((latitude + 90) / GRID_DEGREES)
+    column = math.floor((longitude + 180) / GRID_DEGREES) % GRID_COLUMNS
+    return row * GRID_COLUMNS + column
+
+
+def cells_within(latitude, longitude, km):
+    """
+    Returns the grid cells overlapping the bounding box of a circle.
+
+    :param latitude: The latitude of the centre.
+    :param longitude: The longitude of the centre.
+    :param km: The radius in kilometres.
+    :return: A list of cell numbers.
+    """
+    latitude_delta = km / KM_PER_DEGREE
+    widest = min(abs(latitude) + latitude_delta, 89.0)
+    longitude_delta = min(km / (KM_PER_DEGREE * math.cos(math.radians(widest))), 180.0)
+    first_row, last_row = (math.floor((max(min(value, 90.0), -90.0) + 90) / GRID_DEGREES)
+                           for value in (latitude - latitude_delta, latitude + latitude_delta))
+    first_column = math.floor((longitude - longitude_delta + 180) / GRID_DEGREES)
+    last_column = math.floor((longitude + longitude_delta + 180) / GRID_DEGREES)
+    columns = {column % GRID_COLUMNS for column in range(first_column, last_column + 1)}
+    return [row * GRID_COLUMNS + column for row in range(first_row, last_row + 1) for column in sorted(columns)]
+
+
+def haversine_km(latitude1, longitude1, latitude2, longitude2):
+    """
+    Returns the great-circle distance between two points in kilometres.
+    """
+    phi1, phi2 = math.radians(latitude1), math.radians(latitude2)
+    a = (math.sin((phi2 - phi1) / 2) ** 2
+         + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(longitude2 - longitude1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def distance_km(latitude, longitude):
+    """
+    Returns a database expression of the haversine distance between a point and
+    the ``latitude``/``longitude`` fields of the queried model.
+
+    :param latitude: The latitude of the point.
+    :param longitude: The longitude of the point.
+    :return: An expression of the distance in kilometres.
+    """
+    a = (Power(Sin((Radians(F('latitude')) - math.radians(latitude)) / 2), 2)
+         + math.cos(math.radians(latitude)) * Cos(Radians(F('latitude')))
+         * Power(Sin((Radians(F('longitude')) - math.radians(longitude)) / 2), 2))
+    return 2 * EARTH_RADIUS_KM * ASin(Sqrt(a))
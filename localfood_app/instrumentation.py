@@ -0,0 +1,108 @@
+"""
+Request instrumentation shared by the profiling and slow-query middleware.
+
+Timings are collected into a ``RequestTimings`` object bound to the current
+request through a context variable, so nothing is recorded (and nothing is
+paid) unless a middleware has activated it.
+"""
+import time
+from contextlib import contextmanager, ExitStack
+from contextvars import ContextVar
+
+from django.db import connections
+from django.template.base import Template
+
+_active_timings = ContextVar('localfood_request_timings', default=None)
+_current_template = ContextVar('localfood_current_template', default=None)
+_template_instrumentation_installed = False
+
+
+class RequestTimings:
+    """
+    Time spent by a single request in SQL and template rendering.
+
+    Attributes:
+        sql_time (float): Seconds spent executing SQL.
+        sql_count (int): Number of executed SQL statements.
+        template_time (float): Seconds spent rendering top-level templates.
+    """
+    __slots__ = ('sql_time', 'sql_count', 'template_time')
+
+    def __init__(self):
+        self.sql_time = 0.0
+        self.sql_count = 0
+        self.template_time = 0.0
+
+
+def current_template():
+    """
+    Returns the name of the innermost template being rendered right now.
+
+    :return: The template name, or None outside template rendering.
+    """
+    return _current_template.get()
+
+
+def install_template_instrumentation():
+    """
+    Wraps ``Template.render`` once per process so renders report their time
+    and name. Included templates are tracked as the current template but
+    their time is counted only once, in the top-level render.
+    """
+    global _template_instrumentation_installed
+    if _template_instrumentation_installed:
+        return
+    original_render = Template.render
+
+    def render(self, context):
+        outermost = _current_template.get() is None
+        token = _current_template.set(self.origin.template_name or self.name)
+        start = time.perf_counter()
+        try:
+            return original_render(self, context)
+        finally:
+            _current_template.reset(token)
+            timings = _active_timings.get()
+            if outermost and timings is not None:
+                timings.template_time += time.perf_counter() - start
+
+    Template.render = render
+    _template_instrumentation_installed = True
+
+
+@contextmanager
+def execute_wrappers(wrapper):
+    """
+    Installs an ``execute_wrapper`` on every database connection of the current thread.
+
+    :param wrapper: The execute wrapper, see ``connection.execute_wrapper``.
+    """
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(wrapper))
+        yield
+
+
+@contextmanager
+def collect_timings():
+    """
+    Collects SQL and template timings for the code run inside the block.
+
+    :return: The ``RequestTimings`` being filled.
+    """
+    timings = RequestTimings()
+
+    def sql_timer(execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            timings.sql_time += time.perf_counter() - start
+            timings.sql_count += 1
+
+    token = _active_timings.set(timings)
+    try:
+        with execute_wrappers(sql_timer):
+            yield timings
+    finally:
+        _active_timings.reset(token)
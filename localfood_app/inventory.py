@@ -0,0 +1,44 @@
+"""
+Bulk edits of a seller's prices and stock from the inventory page.
+
+``update_products`` applies the changed rows of a submitted page with one
+locking read and ``bulk_update`` in one transaction, instead of saving every
+product (and running its signals) in turn. Only the fields the seller changed
+are taken from the form, so a quantity lowered by a payment while the page was
+open is not put back. The caches are invalidated once for the whole batch;
+prices and quantities do not move a product between the province counts.
+"""
+from django.db import transaction
+from django.utils import timezone
+
+from . import page_cache, product_cache, stock
+from .models import Product
+
+FIELDS = ('price', 'quantity')
+
+
+def update_products(seller, changes, batch_size=500):
+    """
+    Updates the price and quantity of some products of a seller.
+
+    :param seller: The seller; products of other sellers are left out.
+    :param changes: A dict of product ID to a dict of the changed fields.
+    :param batch_size: The number of products updated per query.
+    :return: The number of products updated.
+    """
+    if not changes:
+        return 0
+    now = timezone.now()
+    with transaction.atomic():
+        products = list(Product.objects.select_for_update().filter(seller=seller, pk__in=changes).only(
+            'pk', *FIELDS))
+        for product in products:
+            for name, value in changes[product.pk].items():
+                setattr(product, name, value)
+            product.updated_at = now
+        Product.objects.bulk_update(products, [*FIELDS, 'updated_at'], batch_size=batch_size)
+        levels = {product.pk: product.quantity for product in products}
+        transaction.on_commit(lambda: stock.publish(levels))
+    product_cache.invalidate(levels)
+    page_cache.invalidate()
+    return len(products)
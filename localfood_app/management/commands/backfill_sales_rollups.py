@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from localfood_app import analytics
+from localfood_app.models import ProductDailySales, SellerDailySales
+
+
+class Command(BaseCommand):
+    """
+    Recomputes the daily seller and product sales rollups from the paid orders,
+    e.g. after bulk imports of orders.
+    """
+    help = 'Rebuilds SellerDailySales and ProductDailySales from the paid orders, in chunks of orders.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Orders read per query.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows inserted per query.')
+
+    def handle(self, *args, **options):
+        orders = analytics.rebuild(chunk_size=options['chunk_size'], batch_size=options['batch_size'])
+        self.stdout.write(f'Read {orders} paid orders; {SellerDailySales.objects.count()} seller days, '
+                          f'{ProductDailySales.objects.count()} product days.')
@@ -0,0 +1,127 @@
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from scipy import sparse
+
+from localfood_app import product_cache
+from localfood_app.models import Order, OrderProduct, Product, RelatedProduct
+
+
+class Command(BaseCommand):
+    """
+    Builds the "frequently bought together" recommendations from the paid orders.
+
+    The paid order lines are read in chunks of orders. Each chunk becomes a
+    sparse order x product incidence matrix ``B``, and ``B.T @ B`` (the number
+    of orders containing each pair of products) is added to a sparse
+    co-occurrence matrix, so memory grows with the number of product pairs
+    bought together rather than with the number of orders. The products of
+    every row are scored by cosine similarity, ``orders(a, b) /
+    sqrt(orders(a) * orders(b))``, so best-sellers are not recommended for
+    everything, and the best ``--top-k`` replace the ``RelatedProduct`` rows.
+    The products whose related products changed get a new ``updated_at``.
+    """
+    help = 'Rebuilds the "frequently bought together" products from the paid orders.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int, default=settings.RECOMMENDATIONS_TOP_K,
+                            help='Related products stored per product.')
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Orders read per query.')
+        parser.add_argument('--min-support', type=int, default=1,
+                            help='Orders two products must share to be related.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows inserted per query.')
+
+    def handle(self, *args, **options):
+        product_count = (Product.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+        co_occurrence, orders = self.count_pairs(product_count, options['chunk_size'])
+        rows = list(self.top_related(co_occurrence, options['top_k'], options['min_support']))
+
+        with transaction.atomic():
+            changed = self.changed_products(rows)
+            RelatedProduct.objects.all().delete()
+            RelatedProduct.objects.bulk_create(rows, batch_size=options['batch_size'])
+            # a new updated_at moves the product page ETag in every process
+            for start in range(0, len(changed), options['batch_size']):
+                Product.objects.filter(pk__in=changed[start:start + options['batch_size']]).update(
+                    updated_at=timezone.now())
+            product_cache.invalidate_on_commit(changed)
+        self.stdout.write(f'Read {orders} paid orders; stored {len(rows)} related products '
+                          f'for {len({row.product_id for row in rows})} products.')
+
+    def changed_products(self, rows):
+        """
+        Returns the products whose related products differ between the stored
+        rows and new ones.
+
+        :param rows: The new ``RelatedProduct`` instances, ordered by product and rank.
+        :return: A sorted list of product IDs.
+        """
+        stored, built = {}, {}
+        for product_id, related_id in RelatedProduct.objects.order_by('product_id', 'rank').values_list(
+                'product_id', 'related_id').iterator(chunk_size=10000):
+            stored.setdefault(product_id, []).append(related_id)
+        for row in rows:
+            built.setdefault(row.product_id, []).append(row.related_id)
+        return sorted(product_id for product_id in stored.keys() | built.keys()
+                      if stored.get(product_id) != built.get(product_id))
+
+    def count_pairs(self, product_count, chunk_size):
+        """
+        Counts the paid orders containing each pair of products.
+
+        :param product_count: One more than the largest product ID.
+        :param chunk_size: The number of orders read per query.
+        :return: A (co-occurrence matrix, number of orders) tuple; the diagonal
+            holds the number of orders of each product.
+        """
+        co_occurrence = sparse.csr_matrix((product_count, product_count), dtype=np.int64)
+        paid = Order.objects.filter(is_paid=True).order_by('pk').values_list('pk', flat=True)
+        last_order_id, orders = 0, 0
+        while True:
+            order_ids = list(paid.filter(pk__gt=last_order_id)[:chunk_size])
+            if not order_ids:
+                return co_occurrence, orders
+            lines = np.array(OrderProduct.objects.filter(
+                order_id__gt=last_order_id, order_id__lte=order_ids[-1], order__is_paid=True,
+                product_id__lt=product_count,
+            ).values_list('order_id', 'product_id'), dtype=np.int64).reshape(-1, 2)
+            last_order_id, orders = order_ids[-1], orders + len(order_ids)
+            if not len(lines):
+                continue
+
+            order_rows, order_numbers = np.unique(lines[:, 0], return_inverse=True)
+            incidence = sparse.csr_matrix(
+                (np.ones(len(lines), dtype=np.int64), (order_numbers, lines[:, 1])),
+                shape=(len(order_rows), product_count),
+            )
+            # a product on two lines of one order counts once
+            incidence.sum_duplicates()
+            incidence.data[:] = 1
+            co_occurrence += (incidence.T @ incidence).tocsr()
+
+    def top_related(self, co_occurrence, top_k, min_support):
+        """
+        Yields the best related products of every product.
+
+        :param co_occurrence: The matrix returned by ``count_pairs``.
+        :param top_k: The number of related products per product.
+        :param min_support: The number of orders two products must share.
+        :return: A generator of unsaved ``RelatedProduct`` instances.
+        """
+        frequency = co_occurrence.diagonal()
+        co_occurrence = (co_occurrence - sparse.diags(frequency, format='csr', dtype=frequency.dtype)).tocsr()
+        co_occurrence.data[co_occurrence.data < min_support] = 0
+        co_occurrence.eliminate_zeros()
+
+        for product_id in np.flatnonzero(np.diff(co_occurrence.indptr)):
+            start, end = co_occurrence.indptr[product_id], co_occurrence.indptr[product_id + 1]
+            related, counts = co_occurrence.indices[start:end], co_occurrence.data[start:end]
+            scores = counts / np.sqrt(frequency[product_id] * frequency[related].astype(np.float64))
+            # best score first, then most shared orders, then lowest ID
+            best = np.lexsort((related, -counts, -scores))[:top_k]
+            for rank, index in enumerate(best, start=1):
+                yield RelatedProduct(product_id=int(product_id), related_id=int(related[index]), rank=rank,
+                                     score=float(scores[index]), orders=int(counts[index]))
@@ -0,0 +1,314 @@
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, time as dt_time, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from io import BytesIO, StringIO
+from multiprocessing import get_context
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.core.management.color import no_style
+from django.db import connection, connections
+from django.db.models import Max
+
+from localfood_app import analytics, popularity, provinces
+from localfood_app.models import User, Category, Product, ProductImage, Address, Order, OrderProduct
+
+PLACEHOLDER_IMAGE = 'product_image/placeholder.png'
+PASSWORD = 'localfood'
+
+CATEGORY_NAMES = [
+    'Vegetables', 'Fruit', 'Dairy', 'Cheese', 'Eggs', 'Bread', 'Honey', 'Meat', 'Poultry', 'Fish',
+    'Preserves', 'Juices', 'Herbs', 'Mushrooms', 'Grains', 'Flour', 'Oils', 'Pickles', 'Sweets', 'Cider',
+]
+PRODUCT_ADJECTIVES = ['Organic', 'Fresh', 'Smoked', 'Homemade', 'Farm', 'Wild', 'Seasonal', 'Traditional']
+PRODUCT_NOUNS = [
+    'carrots', 'potatoes', 'apples', 'plums', 'milk', 'butter', 'oscypek', 'twaróg', 'eggs', 'rye bread',
+    'buckwheat honey', 'kiełbasa', 'chicken', 'trout', 'cherry jam', 'apple juice', 'dill', 'chanterelles',
+    'kasza', 'rapeseed oil', 'sauerkraut', 'gingerbread', 'cabbage', 'strawberries', 'sour cream',
+]
+FIRST_NAMES = ['Anna', 'Piotr', 'Katarzyna', 'Tomasz', 'Agnieszka', 'Paweł', 'Magdalena', 'Michał', 'Zofia', 'Jan']
+LAST_NAMES = ['Nowak', 'Kowalski', 'Wiśniewski', 'Wójcik', 'Kamiński', 'Lewandowski', 'Zieliński', 'Szymański']
+CITIES = [
+    ('Warszawa', 'Mazowieckie', '00'), ('Kraków', 'Małopolskie', '30'), ('Wrocław', 'Dolnośląskie', '50'),
+    ('Poznań', 'Wielkopolskie', '60'), ('Gdańsk', 'Pomorskie', '80'), ('Łódź', 'Łódzkie', '90'),
+    ('Lublin', 'Lubelskie', '20'), ('Białystok', 'Podlaskie', '15'), ('Rzeszów', 'Podkarpackie', '35'),
+    ('Katowice', 'Śląskie', '40'), ('Kielce', 'Świętokrzyskie', '25'), ('Olsztyn', 'Warmińsko-mazurskie', '10'),
+    ('Opole', 'Opolskie', '45'), ('Szczecin', 'Zachodniopomorskie', '70'), ('Bydgoszcz', 'Kujawsko-pomorskie', '85'),
+    ('Zielona Góra', 'Lubuskie', '65'),
+]
+
+
+def _rng(seed, phase, start):
+    """
+    Returns the random generator of one chunk; the same seed, phase and chunk
+    always produce the same rows, whichever process generates them.
+    """
+    return random.Random(f'{seed}:{phase}:{start}')
+
+
+@contextmanager
+def _historical_timestamps(*models):
+    """
+    Lets ``bulk_create`` store the generated ``created_at`` values instead of
+    overwriting them with the current time.
+    """
+    fields = [model._meta.get_field('created_at') for model in models]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+def _generate_users(plan, start, stop):
+    rng = _rng(plan['seed'], 'users', start)
+    users, addresses = [], []
+    for index in range(start, stop):
+        pk = plan['user_offset'] + index + 1
+        is_seller = index < plan['sellers']
+        username = f'seller{pk}' if is_seller else f'buyer{pk}'
+        users.append(User(
+            pk=pk,
+            username=username,
+            password=plan['password_hash'],
+            first_name=rng.choice(FIRST_NAMES),
+            last_name=rng.choice(LAST_NAMES),
+            email=f'{username}@example.com',
+            is_seller=is_seller,
+            is_buyer=not is_seller,
+        ))
+        city, province, postal_prefix = rng.choice(CITIES)
+        address = Address(
+            pk=plan['address_offset'] + index + 1,
+            user_id=pk,
+            city=city,
+            street_name='Polna',
+            street_number=str(rng.randint(1, 200)),
+            province=province,
+            postal_code=f'{postal_prefix}-{rng.randint(0, 999):03d}',
+        )
+        # bulk_create does not call save()
+        address.locate()
+        addresses.append(address)
+    User.objects.bulk_create(users, batch_size=plan['batch_size'])
+    Address.objects.bulk_create(addresses, batch_size=plan['batch_size'])
+    return stop - start
+
+
+def _generate_products(plan, start, stop):
+    rng = _rng(plan['seed'], 'products', start)
+    products, images = [], []
+    for index in range(start, stop):
+        pk = plan['product_offset'] + index + 1
+        products.append(Product(
+            pk=pk,
+            name=f'{rng.choice(PRODUCT_ADJECTIVES)} {rng.choice(PRODUCT_NOUNS)}',
+            description='Produced locally in small batches.',
+            price=Decimal(rng.randint(100, 20000)) / 100,
+            quantity=rng.randint(0, 500),
+            category_id=plan['category_offset'] + rng.randrange(plan['categories']) + 1,
+            seller_id=plan['user_offset'] + rng.randrange(plan['sellers']) + 1,
+            created_at=plan['until'] - timedelta(seconds=rng.randrange(plan['days'] * 86400)),
+        ))
+        for number in range(plan['images_per_product']):
+            images.append(ProductImage(
+                pk=plan['image_offset'] + index * plan['images_per_product'] + number + 1,
+                product_id=pk,
+                file_path=PLACEHOLDER_IMAGE,
+            ))
+    with _historical_timestamps(Product):
+        Product.objects.bulk_create(products, batch_size=plan['batch_size'])
+    ProductImage.objects.bulk_create(images, batch_size=plan['batch_size'])
+    return stop - start
+
+
+def _generate_orders(plan, start, stop):
+    rng = _rng(plan['seed'], 'orders', start)
+    orders, lines = [], []
+    for index in range(start, stop):
+        pk = plan['order_offset'] + index + 1
+        created_at = plan['until'] - timedelta(seconds=rng.randrange(plan['days'] * 86400))
+        # a buyer has at most one unpaid order (the basket), so only the first
+        # order of each buyer may be left unpaid
+        if index < plan['buyers']:
+            buyer_index = index
+            is_paid = rng.random() >= plan['basket_ratio']
+        else:
+            buyer_index = rng.randrange(plan['buyers'])
+            is_paid = True
+        orders.append(Order(
+            pk=pk,
+            buyer_id=plan['user_offset'] + plan['sellers'] + buyer_index + 1,
+            created_at=created_at,
+            is_paid=is_paid,
+            paid_at=created_at if is_paid else None,
+            is_realized=is_paid and rng.random() < 0.5,
+        ))
+        product_indexes = rng.sample(range(plan['products']), rng.randint(1, plan['max_lines']))
+        for number, product_index in enumerate(product_indexes):
+            lines.append(OrderProduct(
+                pk=plan['line_offset'] + index * plan['max_lines'] + number + 1,
+                order_id=pk,
+                product_id=plan['product_offset'] + product_index + 1,
+                quantity=rng.randint(1, 5),
+                created_at=created_at,
+            ))
+    with _historical_timestamps(Order, OrderProduct):
+        Order.objects.bulk_create(orders, batch_size=plan['batch_size'])
+        OrderProduct.objects.bulk_create(lines, batch_size=plan['batch_size'])
+    return stop - start
+
+
+class Command(BaseCommand):
+    """
+    Generates a large, deterministic data set for load tests and benchmarks.
+
+    Rows get explicit primary keys computed from the current maximum IDs, so
+    the chunks of every phase can be inserted in parallel by a process pool
+    and the same seed always produces the same data on an empty database.
+    All generated users have the password ``localfood``.
+    """
+    help = 'Generates users, sellers, categories, products, images and orders in bulk.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--buyers', type=int, default=100_000)
+        parser.add_argument('--sellers', type=int, default=5_000)
+        parser.add_argument('--categories', type=int, default=20)
+        parser.add_argument('--products', type=int, default=500_000)
+        parser.add_argument('--images-per-product', type=int, default=1)
+        parser.add_argument('--orders', type=int, default=1_000_000)
+        parser.add_argument('--max-lines', type=int, default=5, help='Maximum products per order.')
+        parser.add_argument('--basket-ratio', type=float, default=0.1, help='Share of buyers with a basket.')
+        parser.add_argument('--days', type=int, default=365, help='Spread creation dates over this many days.')
+        parser.add_argument('--until', help='Latest creation date (YYYY-MM-DD), defaults to today.')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--batch-size', type=int, default=5_000)
+        parser.add_argument('--chunk-size', type=int, default=50_000, help='Rows per worker task.')
+        parser.add_argument('--workers', type=int, default=os.cpu_count())
+
+    def handle(self, *args, **options):
+        plan = self.make_plan(options)
+        self.ensure_placeholder_image()
+        self.create_categories(plan)
+
+        phases = [
+            ('users', _generate_users, plan['sellers'] + plan['buyers']),
+            ('products', _generate_products, plan['products']),
+            ('orders', _generate_orders, plan['orders']),
+        ]
+        # forked workers must not share the parent's database connections, and
+        # the parent does not touch the database again until they are done
+        connections.close_all()
+        executor = None
+        if options['workers'] > 1:
+            executor = ProcessPoolExecutor(options['workers'], mp_context=get_context('fork'))
+        try:
+            for name, generate, total in phases:
+                start_time = time.perf_counter()
+                chunks = [(start, min(start + options['chunk_size'], total))
+                          for start in range(0, total, options['chunk_size'])]
+                if executor is None:
+                    for start, stop in chunks:
+                        generate(plan, start, stop)
+                else:
+                    for future in [executor.submit(generate, plan, start, stop) for start, stop in chunks]:
+                        future.result()
+                self.stdout.write(f'{name}: {total} in {time.perf_counter() - start_time:.1f}s')
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        # bulk_create skips the signal handlers that maintain these
+        start_time = time.perf_counter()
+        provinces.backfill_seller_provinces()
+        provinces.rebuild_counts()
+        popularity.rebuild()
+        analytics.rebuild()
+        self.stdout.write(f'province counts, popularity and sales rollups in {time.perf_counter() - start_time:.1f}s')
+
+        start_time = time.perf_counter()
+        call_command('build_recommendations', stdout=StringIO())
+        self.stdout.write(f'recommendations in {time.perf_counter() - start_time:.1f}s')
+
+        self.reset_sequences()
+        self.stdout.write(self.style.SUCCESS('Dataset generated.'))
+
+    def make_plan(self, options):
+        """
+        Computes the parameters and primary key offsets shared by all workers.
+        """
+        def offset(model):
+            return model.objects.aggregate(max_id=Max('id'))['max_id'] or 0
+
+        until = (
+            datetime.strptime(options['until'], '%Y-%m-%d').date()
+            if options['until'] else datetime.now(dt_timezone.utc).date()
+        )
+        return {
+            'seed': options['seed'],
+            'batch_size': options['batch_size'],
+            'buyers': options['buyers'],
+            'sellers': options['sellers'],
+            'categories': options['categories'],
+            'products': options['products'],
+            'images_per_product': options['images_per_product'],
+            'orders': options['orders'],
+            'max_lines': options['max_lines'],
+            'basket_ratio': options['basket_ratio'],
+            'days': options['days'],
+            'until': datetime.combine(until, dt_time.max, tzinfo=dt_timezone.utc),
+            # hashed once with a random salt: a weaker salt would make every
+            # login rehash the password and log out the user's other sessions
+            'password_hash': make_password(PASSWORD),
+            'user_offset': offset(User),
+            'address_offset': offset(Address),
+            'category_offset': offset(Category),
+            'product_offset': offset(Product),
+            'image_offset': offset(ProductImage),
+            'order_offset': offset(Order),
+            'line_offset': offset(OrderProduct),
+        }
+
+    def create_categories(self, plan):
+        """
+        Creates the categories; there are few, so no worker is needed.
+        """
+        categories = []
+        for index in range(plan['categories']):
+            pk = plan['category_offset'] + index + 1
+            name = CATEGORY_NAMES[index % len(CATEGORY_NAMES)]
+            if index >= len(CATEGORY_NAMES):
+                name = f'{name} {index // len(CATEGORY_NAMES) + 1}'
+            categories.append(Category(pk=pk, name=name, slug=f'{name.lower().replace(" ", "-")}-{pk}'))
+        Category.objects.bulk_create(categories)
+
+    def ensure_placeholder_image(self):
+        """
+        Stores the single placeholder image every generated product points to.
+        """
+        if default_storage.exists(PLACEHOLDER_IMAGE):
+            return
+        from PIL import Image
+
+        image = BytesIO()
+        Image.new('RGB', (100, 100), color=(120, 170, 90)).save(image, format='PNG')
+        default_storage.save(PLACEHOLDER_IMAGE, ContentFile(image.getvalue()))
+
+    def reset_sequences(self):
+        """
+        Moves the primary key sequences past the explicitly assigned keys.
+        """
+        models = [User, Address, Category, Product, ProductImage, Order, OrderProduct]
+        statements = connection.ops.sequence_reset_sql(no_style(), models)
+        with connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
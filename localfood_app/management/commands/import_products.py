@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from localfood_app import product_import
+from localfood_app.models import User
+
+
+class Command(BaseCommand):
+    """
+    Imports a seller's products from a CSV or JSON Lines file, streaming it row
+    by row, e.g. for a farm with a large assortment or an admin loading a
+    catalog on a seller's behalf.
+
+    The file needs ``name``, ``description``, ``price``, ``quantity`` and
+    ``category`` (a category slug) columns or keys. Invalid rows are listed on
+    stderr and skipped.
+    """
+    help = 'Imports products for a seller from a CSV or JSON Lines file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='A .csv, .jsonl or .ndjson file.')
+        parser.add_argument('--seller', required=True, help='Username of the seller of the products.')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='File format, by default from the extension.')
+        parser.add_argument('--batch-size', type=int, default=500, help='Products inserted per query.')
+        parser.add_argument('--max-errors', type=int, default=100, help='Errors listed at most.')
+
+    def handle(self, *args, **options):
+        try:
+            seller = User.objects.get(username=options['seller'])
+        except User.DoesNotExist:
+            raise CommandError(f'No user named "{options["seller"]}".')
+        try:
+            file_format = options['format'] or product_import.format_of(options['path'])
+        except ValueError as error:
+            raise CommandError(str(error))
+
+        with open(options['path'], 'rb') as file:
+            result = product_import.import_products(
+                seller, product_import.read_rows(file, file_format),
+                batch_size=options['batch_size'], max_errors=options['max_errors'])
+
+        for line, message in result.errors:
+            self.stderr.write(f'Line {line}: {message}')
+        if result.error_count > len(result.errors):
+            self.stderr.write(f'... and {result.error_count - len(result.errors)} more errors.')
+        self.stdout.write(f'Imported {result.created} products for {seller.username}; '
+                          f'skipped {result.error_count} rows.')
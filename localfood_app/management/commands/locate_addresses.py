@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from localfood_app import geo
+from localfood_app.models import Address
+
+
+class Command(BaseCommand):
+    """
+    Recomputes the coordinates and grid cells of all addresses, e.g. after the
+    postal code centroid table or the grid size changed.
+    """
+    help = 'Sets the coordinates and proximity grid cell of every address from its postal code.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Addresses updated per query.')
+
+    def handle(self, *args, **options):
+        located = geo.locate_addresses(Address, batch_size=options['batch_size'])
+        self.stdout.write(f'Located {located} of {Address.objects.count()} addresses.')
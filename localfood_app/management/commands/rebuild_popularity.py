@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from localfood_app import page_cache, popularity
+
+
+class Command(BaseCommand):
+    """
+    Recomputes the sales counts and trending scores of all products from the
+    paid orders, e.g. after bulk imports or a change of the trending epoch.
+    """
+    help = 'Recomputes Product.sales_count and Product.trending_score from the paid order lines.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Products updated per query.')
+
+    def handle(self, *args, **options):
+        sold = popularity.rebuild(batch_size=options['batch_size'])
+        page_cache.invalidate()
+        self.stdout.write(f'Recomputed the popularity of {sold} products with sales.')
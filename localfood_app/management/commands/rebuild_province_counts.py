@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from localfood_app import provinces
+from localfood_app.models import ProvinceCategoryCount
+
+
+class Command(BaseCommand):
+    """
+    Fills in missing seller provinces of products and recomputes the product
+    counts per province and category, e.g. after bulk imports.
+    """
+    help = 'Backfills Product.seller_province and recomputes the province/category product counts.'
+
+    def handle(self, *args, **options):
+        updated = provinces.backfill_seller_provinces()
+        provinces.rebuild_counts()
+        self.stdout.write(f'Set the province of {updated} products; '
+                          f'{ProvinceCategoryCount.objects.count()} province/category counts.')
@@ -0,0 +1,54 @@
+import glob
+import json
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+
+from localfood_app.slow_queries import log_file_pattern
+
+
+class Command(BaseCommand):
+    """
+    Summarizes the slow-query log: the statements with the highest total time,
+    with the views and templates that ran them and a sample query plan.
+    """
+    help = 'Summarizes the slow-query log, worst statements by total time first.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=10, help='Number of statements to show.')
+        parser.add_argument('--pattern', help='Glob of log files to read (defaults to the configured directory).')
+
+    def handle(self, *args, **options):
+        stats = defaultdict(lambda: {
+            'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'url_names': set(), 'templates': set(), 'plan': None,
+        })
+        for path in glob.glob(options['pattern'] or log_file_pattern()):
+            with open(path, encoding='utf-8') as log_file:
+                for line in log_file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    entry = stats[record['sql']]
+                    entry['count'] += 1
+                    entry['total_ms'] += record['duration_ms']
+                    entry['max_ms'] = max(entry['max_ms'], record['duration_ms'])
+                    entry['url_names'].add(record.get('url_name') or '-')
+                    entry['templates'].add(record.get('template') or '-')
+                    entry['plan'] = entry['plan'] or record.get('plan')
+
+        if not stats:
+            self.stdout.write('No slow queries recorded.')
+            return
+
+        worst = sorted(stats.items(), key=lambda item: item[1]['total_ms'], reverse=True)
+        for rank, (sql, entry) in enumerate(worst[:options['limit']], start=1):
+            self.stdout.write(
+                f"#{rank} total {entry['total_ms']:.1f} ms, {entry['count']} calls, "
+                f"avg {entry['total_ms'] / entry['count']:.1f} ms, max {entry['max_ms']:.1f} ms"
+            )
+            self.stdout.write(f"   views: {', '.join(sorted(entry['url_names']))}")
+            self.stdout.write(f"   templates: {', '.join(sorted(entry['templates']))}")
+            self.stdout.write(f'   sql: {sql}')
+            for plan_line in entry['plan'] or []:
+                self.stdout.write(f'      {plan_line}')
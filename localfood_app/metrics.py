@@ -0,0 +1,387 @@
+"""
+In-app metrics shared by every worker process through memory-mapped files.
+
+Each process writes its own file, ``<pid>.db`` in ``settings.METRICS_DIR``;
+recording a value takes a process-local lock for a dictionary lookup and an 8
+byte write into the mapped file. The ``/metrics`` endpoint reads all files,
+sums the values and renders them in the Prometheus text format.
+
+When a process exits, its values are added to ``archive.db`` and its file is
+deleted (``mark_process_dead``, also meant for the server's hook called when a
+worker was killed), so the totals keep growing while the directory holds one
+file per live process. Archiving and reading take ``archive.lock``, so a scrape
+never counts a file twice or misses it.
+
+File layout: an 8 byte header holding the number of used bytes, followed by
+entries of a 4 byte key length, the UTF-8 key padded to 8 bytes and a float64
+value. An entry is fully written before the header is updated, so readers never
+see a partial entry.
+"""
+import atexit
+import fcntl
+import glob
+import hmac
+import json
+import mmap
+import os
+import struct
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+
+INITIAL_FILE_SIZE = 1024 * 1024
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ARCHIVE_FILE = 'archive.db'
+LOCK_FILE = 'archive.lock'
+
+_lock = threading.Lock()
+_writer_of_process = None
+_registry = {}
+
+
+def _padded(length):
+    return length + (-length % 8)
+
+
+def _read_entries(data):
+    """
+    Parses the entries of a metrics file.
+
+    :param data: The file contents (bytes or an mmap).
+    :return: A generator of (key, value, value offset) tuples.
+    """
+    used = min(struct.unpack_from('Q', data, 0)[0], len(data)) if len(data) >= 8 else 0
+    offset = 8
+    while offset + 4 <= used:
+        key_length = struct.unpack_from('I', data, offset)[0]
+        key_start = offset + 4
+        value_offset = _padded(key_start + key_length)
+        if value_offset + 8 > used:
+            break
+        key = bytes(data[key_start:key_start + key_length]).decode('utf-8')
+        yield key, struct.unpack_from('d', data, value_offset)[0], value_offset
+        offset = value_offset + 8
+
+
+class MmapValues:
+    """
+    A memory-mapped file of float values with a single writer at a time.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'a+b')
+        if os.fstat(self._file.fileno()).st_size < 8:
+            self._file.truncate(INITIAL_FILE_SIZE)
+        self._capacity = os.fstat(self._file.fileno()).st_size
+        self._map = mmap.mmap(self._file.fileno(), self._capacity)
+        self._positions = {key: offset for key, _, offset in _read_entries(self._map)}
+        self._used = max(struct.unpack_from('Q', self._map, 0)[0], 8)
+
+    def inc(self, key, amount):
+        """
+        Adds ``amount`` to the value stored under ``key``.
+
+        :param key: The sample key.
+        :param amount: The amount to add.
+        """
+        offset = self._positions.get(key)
+        if offset is None:
+            offset = self._add(key)
+        value = struct.unpack_from('d', self._map, offset)[0]
+        struct.pack_into('d', self._map, offset, value + amount)
+
+    def _add(self, key):
+        encoded = key.encode('utf-8')
+        value_offset = _padded(self._used + 4 + len(encoded))
+        end = value_offset + 8
+        if end > self._capacity:
+            self._grow(end)
+        struct.pack_into('I', self._map, self._used, len(encoded))
+        self._map[self._used + 4:self._used + 4 + len(encoded)] = encoded
+        struct.pack_into('d', self._map, value_offset, 0.0)
+        struct.pack_into('Q', self._map, 0, end)
+        self._used = end
+        self._positions[key] = value_offset
+        return value_offset
+
+    def _grow(self, needed):
+        while self._capacity < needed:
+            self._capacity *= 2
+        self._map.close()
+        self._file.truncate(self._capacity)
+        self._map = mmap.mmap(self._file.fileno(), self._capacity)
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+
+def _writer():
+    """
+    Returns the metrics file writer of the current process; the caller holds
+    ``_lock``.
+    """
+    global _writer_of_process
+    directory, pid = settings.METRICS_DIR, os.getpid()
+    writer = _writer_of_process
+    # a forked worker inherits the writer of its parent
+    if writer is None or writer.directory != directory or writer.pid != pid:
+        os.makedirs(directory, exist_ok=True)
+        writer = _writer_of_process = MmapValues(os.path.join(directory, f'{pid}.db'))
+        writer.directory, writer.pid = directory, pid
+    return writer
+
+
+def _locked(directory, operation):
+    """
+    Holds the archive lock of a metrics directory, ``fcntl.LOCK_SH`` to read or
+    ``fcntl.LOCK_EX`` to archive, and returns the open lock file.
+    """
+    os.makedirs(directory, exist_ok=True)
+    lock_file = open(os.path.join(directory, LOCK_FILE), 'a')
+    fcntl.flock(lock_file, operation)
+    return lock_file
+
+
+def mark_process_dead(pid, directory=None):
+    """
+    Adds the values of an exited process to the archive and deletes its file.
+    Run for the current process at exit; a server should run it for workers it
+    saw die, e.g. from gunicorn's ``child_exit`` hook.
+
+    :param pid: The process ID.
+    :param directory: The metrics directory, by default ``settings.METRICS_DIR``.
+    """
+    directory = settings.METRICS_DIR if directory is None else directory
+    path = os.path.join(directory, f'{pid}.db')
+    if not os.path.exists(path):
+        return
+    with _locked(directory, fcntl.LOCK_EX):
+        try:
+            with open(path, 'rb') as metrics_file:
+                data = metrics_file.read()
+        except FileNotFoundError:
+            return
+        archive = MmapValues(os.path.join(directory, ARCHIVE_FILE))
+        try:
+            for key, value, _ in _read_entries(data):
+                archive.inc(key, value)
+        finally:
+            archive.close()
+        os.remove(path)
+
+
+@atexit.register
+def _archive_own_file():
+    global _writer_of_process
+    with _lock:
+        writer, _writer_of_process = _writer_of_process, None
+        if writer is not None and writer.pid == os.getpid():
+            writer.close()
+            mark_process_dead(writer.pid, writer.directory)
+
+
+def _sample_key(sample_name, labels):
+    return json.dumps([sample_name, sorted(labels.items())])
+
+
+class Metric:
+    """
+    Base class of the metric types.
+
+    Attributes:
+        name (str): The metric name.
+        documentation (str): The HELP text.
+        labelnames (tuple): The names of the labels every sample must have.
+    """
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        _registry[name] = self
+
+    def _labels(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} expects labels {self.labelnames}, got {tuple(labels)}')
+        return {name: str(value) for name, value in labels.items()}
+
+
+class Counter(Metric):
+    """
+    A monotonically increasing value, e.g. a number of requests.
+    """
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        """
+        Increments the counter.
+
+        :param amount: The amount to add.
+        :param labels: The label values.
+        """
+        if settings.METRICS_ENABLED:
+            key = _sample_key(self.name, self._labels(labels))
+            with _lock:
+                _writer().inc(key, amount)
+
+
+class Histogram(Metric):
+    """
+    A distribution of observed values, e.g. request latencies, in fixed buckets.
+    """
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        """
+        Records an observation.
+
+        :param value: The observed value.
+        :param labels: The label values.
+        """
+        if not settings.METRICS_ENABLED:
+            return
+        labels = self._labels(labels)
+        bucket = next((str(bound) for bound in self.buckets if value <= bound), '+Inf')
+        with _lock:
+            writer = _writer()
+            writer.inc(_sample_key(f'{self.name}_bucket', {**labels, 'le': bucket}), 1)
+            writer.inc(_sample_key(f'{self.name}_sum', labels), value)
+            writer.inc(_sample_key(f'{self.name}_count', labels), 1)
+
+
+def collect():
+    """
+    Sums the samples written by every process, live or archived.
+
+    :return: A dict mapping (sample name, sorted label pairs) to the total value.
+    """
+    totals = defaultdict(float)
+    with _locked(settings.METRICS_DIR, fcntl.LOCK_SH):
+        files = []
+        for path in glob.glob(os.path.join(settings.METRICS_DIR, '*.db')):
+            try:
+                with open(path, 'rb') as metrics_file:
+                    files.append(metrics_file.read())
+            except OSError:
+                continue
+    for data in files:
+        for key, value, _ in _read_entries(data):
+            sample_name, labels = json.loads(key)
+            totals[sample_name, tuple(tuple(pair) for pair in labels)] += value
+    return totals
+
+
+def is_scraper(request):
+    """
+    Returns whether a request may read the metrics: it carries
+    ``settings.METRICS_TOKEN`` as a bearer token or comes from one of
+    ``settings.METRICS_ALLOWED_IPS``.
+
+    :param request: The HTTP request.
+    :return: True if the request is allowed.
+    """
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if settings.METRICS_TOKEN and scheme.lower() == 'bearer' and hmac.compare_digest(
+            token.encode(), settings.METRICS_TOKEN.encode()):
+        return True
+    return request.META.get('REMOTE_ADDR') in settings.METRICS_ALLOWED_IPS
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        name + '="' + value.replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"') + '"'
+        for name, value in labels
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+def render_prometheus_text():
+    """
+    Renders all registered metrics in the Prometheus text exposition format.
+
+    :return: The exposition text.
+    """
+    totals = collect()
+    by_sample = defaultdict(list)
+    for (sample_name, labels), value in totals.items():
+        by_sample[sample_name].append((labels, value))
+
+    lines = []
+    for metric in sorted(_registry.values(), key=lambda metric: metric.name):
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.type}')
+        if isinstance(metric, Histogram):
+            lines.extend(_histogram_lines(metric, by_sample))
+        else:
+            for labels, value in sorted(by_sample.get(metric.name, [])):
+                lines.append(f'{metric.name}{_format_labels(labels)} {value!r}')
+    return '\n'.join(lines) + '\n'
+
+
+def _histogram_lines(metric, by_sample):
+    bucket_counts = defaultdict(dict)
+    for labels, value in by_sample.get(f'{metric.name}_bucket', []):
+        series = tuple(pair for pair in labels if pair[0] != 'le')
+        bucket_counts[series][dict(labels)['le']] = value
+
+    lines = []
+    for series in sorted(bucket_counts):
+        cumulative = 0.0
+        for bound in [str(bound) for bound in metric.buckets] + ['+Inf']:
+            cumulative += bucket_counts[series].get(bound, 0.0)
+            labels = _format_labels(series + (('le', bound),))
+            lines.append(f'{metric.name}_bucket{labels} {cumulative!r}')
+    for suffix in ('_sum', '_count'):
+        for labels, value in sorted(by_sample.get(f'{metric.name}{suffix}', [])):
+            lines.append(f'{metric.name}{suffix}{_format_labels(labels)} {value!r}')
+    return lines
+
+
+REQUESTS = Counter(
+    'localfood_http_requests_total',
+    'HTTP requests by URL name, method and status code.',
+    ('view', 'method', 'status'),
+)
+REQUEST_LATENCY = Histogram(
+    'localfood_http_request_duration_seconds',
+    'HTTP request latency by URL name.',
+    ('view',),
+)
+CHECKOUTS = Counter(
+    'localfood_checkout_total',
+    'Checkout (basket payment) attempts by outcome.',
+    ('outcome',),
+)
+CACHE_REQUESTS = Counter(
+    'localfood_cache_requests_total',
+    'Cache lookups by cache and result (hit or miss).',
+    ('cache', 'result'),
+)
+THROTTLED = Counter(
+    'localfood_throttled_requests_total',
+    'Login and sign-up requests rejected by the throttle, by scope and limit.',
+    ('scope', 'key'),
+)
+
+
+def record_cache_access(cache_name, hits, misses=0):
+    """
+    Counts cache hits and misses of one of the application caches.
+
+    :param cache_name: The name of the cache, e.g. ``product``.
+    :param hits: Number of hits.
+    :param misses: Number of misses.
+    """
+    if hits:
+        CACHE_REQUESTS.inc(hits, cache=cache_name, result='hit')
+    if misses:
+        CACHE_REQUESTS.inc(misses, cache=cache_name, result='miss')
@@ -0,0 +1,234 @@
+import cProfile
+import os
+import random
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.deprecation import MiddlewareMixin
+
+from . import metrics, page_cache
+from .instrumentation import (
+    collect_timings, current_template, execute_wrappers, install_template_instrumentation,
+)
+from .routers import pin_to_primary, reset_primary_pin
+from .slow_queries import recorder
+
+
+class ReplicaPinningMiddleware(MiddlewareMixin):
+    """
+    Middleware giving clients read-your-writes consistency with read replicas.
+
+    Unsafe requests read from the primary for their whole duration and give
+    the client a short-lived cookie; while the cookie is valid, the client's
+    reads stay on the primary so it never sees a replica that has not caught
+    up with its own writes yet.
+    """
+    cookie_name = 'localfood_pin_primary'
+    safe_methods = ('GET', 'HEAD', 'OPTIONS')
+
+    def process_request(self, request):
+        reset_primary_pin()
+        pinned_until = request.COOKIES.get(self.cookie_name, '')
+        if request.method not in self.safe_methods:
+            pin_to_primary()
+        elif pinned_until.isdigit() and int(pinned_until) > time.time():
+            pin_to_primary()
+
+    def process_response(self, request, response):
+        if request.method not in self.safe_methods:
+            pin_seconds = settings.REPLICA_PIN_SECONDS
+            response.set_cookie(
+                self.cookie_name,
+                str(int(time.time()) + pin_seconds),
+                max_age=pin_seconds,
+                httponly=True,
+                samesite='Lax',
+            )
+        reset_primary_pin()
+        return response
+
+
+class RequestProfilingMiddleware:
+    """
+    Middleware reporting where a request spends its time.
+
+    Adds a ``Server-Timing`` header with the total time, SQL time and query
+    count, and top-level template render time. A ``REQUEST_PROFILING_SAMPLE_RATE``
+    share of requests also runs under cProfile; the profile is saved to
+    ``REQUEST_PROFILING_DIR`` when the request takes at least
+    ``REQUEST_PROFILING_SLOW_MS``. With ``REQUEST_PROFILING`` off the
+    middleware removes itself from the stack, so it costs nothing.
+    """
+    def __init__(self, get_response):
+        if not settings.REQUEST_PROFILING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        install_template_instrumentation()
+
+    def __call__(self, request):
+        profiler = None
+        if random.random() < settings.REQUEST_PROFILING_SAMPLE_RATE:
+            profiler = cProfile.Profile()
+
+        start = time.perf_counter()
+        with collect_timings() as timings:
+            if profiler is not None:
+                response = profiler.runcall(self.get_response, request)
+            else:
+                response = self.get_response(request)
+        total_ms = (time.perf_counter() - start) * 1000
+
+        response['Server-Timing'] = (
+            f'total;dur={total_ms:.1f}, '
+            f'sql;dur={timings.sql_time * 1000:.1f};desc="{timings.sql_count} queries", '
+            f'tpl;dur={timings.template_time * 1000:.1f}'
+        )
+        if profiler is not None and total_ms >= settings.REQUEST_PROFILING_SLOW_MS:
+            self.dump_profile(request, profiler, total_ms)
+        return response
+
+    def dump_profile(self, request, profiler, total_ms):
+        """
+        Saves a cProfile dump of a slow request.
+
+        :param request: The HTTP request object.
+        :param profiler: The profiler the request ran under.
+        :param total_ms: The total request time in milliseconds.
+        """
+        match = request.resolver_match
+        view_name = match.view_name.replace(':', '-') if match else 'unresolved'
+        os.makedirs(settings.REQUEST_PROFILING_DIR, exist_ok=True)
+        filename = f'{time.strftime("%Y%m%d-%H%M%S")}-{view_name}-{int(total_ms)}ms-{os.getpid()}.prof'
+        profiler.dump_stats(os.path.join(settings.REQUEST_PROFILING_DIR, filename))
+
+
+class MetricsMiddleware:
+    """
+    Middleware counting requests and observing their latency per URL name
+    (e.g. ``localfood_app:basket``) in the shared metrics files.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        start = time.perf_counter()
+        response = self.get_response(request)
+        self.record(request, response, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        self.record(request, response, time.perf_counter() - start)
+        return response
+
+    def record(self, request, response, duration):
+        """
+        Records a finished request.
+
+        :param request: The HTTP request object.
+        :param response: The HTTP response.
+        :param duration: The request duration in seconds.
+        """
+        match = request.resolver_match
+        view = match.view_name if match else 'unresolved'
+        metrics.REQUESTS.inc(view=view, method=request.method, status=response.status_code)
+        metrics.REQUEST_LATENCY.observe(duration, view=view)
+
+
+class SlowQueryMiddleware:
+    """
+    Middleware sending SQL statements slower than ``SLOW_QUERY_MS`` run by the
+    ``localfood_app`` views to the slow-query log, with the URL name and the
+    template that triggered them.
+    """
+    def __init__(self, get_response):
+        if not settings.SLOW_QUERY_MS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        install_template_instrumentation()
+
+    def __call__(self, request):
+        threshold = settings.SLOW_QUERY_MS / 1000
+
+        def slow_query_timer(execute, sql, params, many, context):
+            start = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                duration = time.perf_counter() - start
+                match = request.resolver_match
+                if duration >= threshold and not many and match and match.namespace == 'localfood_app':
+                    recorder.record(
+                        context['connection'].alias, sql, params, duration,
+                        match.view_name, current_template(),
+                    )
+
+        with execute_wrappers(slow_query_timer):
+            return self.get_response(request)
+
+
+class PageCacheMiddleware:
+    """
+    Middleware serving anonymous visitors' catalog pages from the full-page
+    cache, with stale copies served while one worker renders a fresh one (see
+    ``page_cache``). Adds an ``X-Page-Cache`` header with ``HIT``, ``STALE`` or
+    ``MISS`` to cacheable pages.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.PAGE_CACHE_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        key = page_cache.request_cache_key(request)
+        if key is None:
+            return self.get_response(request)
+        entry, state, generation, lock = page_cache.lookup(key)
+        if entry is not None:
+            return page_cache.respond(request, entry, state)
+        response = self.get_response(request)
+        return self.finish(key, response, generation, lock)
+
+    async def __acall__(self, request):
+        key = page_cache.request_cache_key(request)
+        if key is None:
+            return await self.get_response(request)
+        entry, state, generation, lock = await sync_to_async(page_cache.lookup, thread_sensitive=False)(key)
+        if entry is not None:
+            return page_cache.respond(request, entry, state)
+        response = await self.get_response(request)
+        return self.finish(key, response, generation, lock)
+
+    def finish(self, key, response, generation, lock):
+        """
+        Stores a rendered page and marks it as a cache miss.
+
+        :param key: The cache key of the page.
+        :param response: The rendered response.
+        :param generation: The page cache generation seen before rendering.
+        :param lock: The regeneration lock token taken by ``lookup``, or None.
+        :return: The response.
+        """
+        page_cache.store(key, response, generation, lock)
+        metrics.record_cache_access('page', hits=0, misses=1)
+        response['X-Page-Cache'] = 'MISS'
+        return response
@@ -0,0 +1,60 @@
+import csv
+import math
+import re
+from pathlib import Path
+
+from django.db import migrations, models
+
+# frozen copies of localfood_app.geo at the time of this migration
+CENTROIDS_PATH = Path(__file__).resolve().parent.parent / 'data' / 'postal_centroids.csv'
+GRID_DEGREES = 0.25
+GRID_COLUMNS = round(360 / GRID_DEGREES)
+POSTAL_CODE_RE = re.compile(r'^\s*(\d{2})-?\d{3}\s*$')
+
+
+def locate_addresses(apps, schema_editor):
+    Address = apps.get_model('localfood_app', 'Address')
+    with open(CENTROIDS_PATH, newline='', encoding='utf-8') as file:
+        centroids = {row['prefix']: (float(row['latitude']), float(row['longitude']))
+                     for row in csv.DictReader(file)}
+    batch = []
+    for address in Address.objects.only('pk', 'postal_code').iterator(chunk_size=1000):
+        match = POSTAL_CODE_RE.match(address.postal_code or '')
+        location = centroids.get(match.group(1)) if match else None
+        if location is None:
+            continue
+        latitude, longitude = location
+        address.latitude, address.longitude = latitude, longitude
+        address.grid_cell = (math.floor((latitude + 90) / GRID_DEGREES) * GRID_COLUMNS
+                             + math.floor((longitude + 180) / GRID_DEGREES) % GRID_COLUMNS)
+        batch.append(address)
+        if len(batch) == 1000:
+            Address.objects.bulk_update(batch, ['latitude', 'longitude', 'grid_cell'])
+            batch = []
+    Address.objects.bulk_update(batch, ['latitude', 'longitude', 'grid_cell'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('localfood_app', '0002_category_updated_at_product_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='address',
+            name='grid_cell',
+            field=models.IntegerField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='address',
+            name='latitude',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='address',
+            name='longitude',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(locate_addresses, migrations.RunPython.noop),
+    ]
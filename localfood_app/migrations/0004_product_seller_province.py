@@ -0,0 +1,58 @@
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+
+
+def fill_seller_provinces(apps, schema_editor):
+    Address = apps.get_model('localfood_app', 'Address')
+    Product = apps.get_model('localfood_app', 'Product')
+    ProvinceCategoryCount = apps.get_model('localfood_app', 'ProvinceCategoryCount')
+    first_province = Address.objects.filter(user_id=OuterRef('seller_id')).order_by('pk').values('province')[:1]
+    Product.objects.filter(seller__isnull=False).update(seller_province=Subquery(first_province))
+    rows = Product.objects.filter(seller_province__isnull=False).values(
+        'seller_province', 'category_id').annotate(products=Count('id')).order_by()
+    ProvinceCategoryCount.objects.bulk_create([
+        ProvinceCategoryCount(province=row['seller_province'], category_id=row['category_id'], count=row['products'])
+        for row in rows
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('localfood_app', '0003_address_location'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProvinceCategoryCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('province', models.CharField(choices=[('Dolnośląskie', 'Dolnośląskie'), ('Kujawsko-pomorskie', 'Kujawsko-pomorskie'), ('Lubelskie', 'Lubelskie'), ('Lubuskie', 'Lubuskie'), ('Łódzkie', 'Łódzkie'), ('Małopolskie', 'Małopolskie'), ('Mazowieckie', 'Mazowieckie'), ('Opolskie', 'Opolskie'), ('Podkarpackie', 'Podkarpackie'), ('Podlaskie', 'Podlaskie'), ('Pomorskie', 'Pomorskie'), ('Śląskie', 'Śląskie'), ('Świętokrzyskie', 'Świętokrzyskie'), ('Warmińsko-mazurskie', 'Warmińsko-mazurskie'), ('Wielkopolskie', 'Wielkopolskie'), ('Zachodniopomorskie', 'Zachodniopomorskie')], max_length=20)),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='seller_province',
+            field=models.CharField(blank=True, choices=[('Dolnośląskie', 'Dolnośląskie'), ('Kujawsko-pomorskie', 'Kujawsko-pomorskie'), ('Lubelskie', 'Lubelskie'), ('Lubuskie', 'Lubuskie'), ('Łódzkie', 'Łódzkie'), ('Małopolskie', 'Małopolskie'), ('Mazowieckie', 'Mazowieckie'), ('Opolskie', 'Opolskie'), ('Podkarpackie', 'Podkarpackie'), ('Podlaskie', 'Podlaskie'), ('Pomorskie', 'Pomorskie'), ('Śląskie', 'Śląskie'), ('Świętokrzyskie', 'Świętokrzyskie'), ('Warmińsko-mazurskie', 'Warmińsko-mazurskie'), ('Wielkopolskie', 'Wielkopolskie'), ('Zachodniopomorskie', 'Zachodniopomorskie')], editable=False, max_length=20, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['seller_province', '-created_at'], name='product_province_created'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['seller_province', 'category', '-created_at'], name='product_province_cat_created'),
+        ),
+        migrations.AddField(
+            model_name='provincecategorycount',
+            name='category',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='localfood_app.category'),
+        ),
+        migrations.AddConstraint(
+            model_name='provincecategorycount',
+            constraint=models.UniqueConstraint(fields=('province', 'category'), name='unique_province_category_count'),
+        ),
+        migrations.RunPython(fill_seller_provinces, migrations.RunPython.noop),
+    ]
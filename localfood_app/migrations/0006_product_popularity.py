@@ -0,0 +1,61 @@
+import math
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_popularity(apps, schema_editor):
+    Product = apps.get_model('localfood_app', 'Product')
+    OrderProduct = apps.get_model('localfood_app', 'OrderProduct')
+    epoch = datetime.fromisoformat(settings.TRENDING_EPOCH)
+    epoch = epoch if epoch.tzinfo else epoch.replace(tzinfo=timezone.utc)
+    half_life = settings.TRENDING_HALF_LIFE_DAYS * 86400
+    # orders are not timed at payment yet, so every sale counts from its order's creation
+    sales, scores = {}, {}
+    lines = OrderProduct.objects.filter(order__is_paid=True).values_list('product_id', 'quantity', 'order__created_at')
+    for product_id, quantity, sold_at in lines.iterator(chunk_size=5000):
+        sales[product_id] = sales.get(product_id, 0) + quantity
+        scores[product_id] = scores.get(product_id, 0.0) + quantity * math.pow(
+            2, (sold_at - epoch).total_seconds() / half_life)
+    Product.objects.bulk_update(
+        [Product(pk=product_id, sales_count=sales[product_id], trending_score=scores[product_id])
+         for product_id in sales],
+        ['sales_count', 'trending_score'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('localfood_app', '0005_relatedproduct'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='sales_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='trending_score',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['-sales_count', '-id'], name='product_bestsellers'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', '-sales_count', '-id'], name='product_cat_bestsellers'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['-trending_score', '-id'], name='product_trending'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', '-trending_score', '-id'], name='product_cat_trending'),
+        ),
+        migrations.RunPython(fill_popularity, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,74 @@
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+
+
+def fill_sales_rollups(apps, schema_editor):
+    OrderProduct = apps.get_model('localfood_app', 'OrderProduct')
+    ProductDailySales = apps.get_model('localfood_app', 'ProductDailySales')
+    SellerDailySales = apps.get_model('localfood_app', 'SellerDailySales')
+    # paid_at is new, so existing orders count on the day they were created
+    lines = OrderProduct.objects.filter(order__is_paid=True, product__seller__isnull=False).annotate(
+        day=TruncDate('order__created_at'))
+    totals = {'units': Sum('quantity'), 'revenue': Sum(F('quantity') * F('product__price')),
+              'orders': Count('order_id', distinct=True)}
+    ProductDailySales.objects.bulk_create([
+        ProductDailySales(seller_id=row.pop('product__seller_id'), **row)
+        for row in lines.values('product__seller_id', 'product_id', 'day').annotate(**totals).order_by()
+    ], batch_size=1000)
+    SellerDailySales.objects.bulk_create([
+        SellerDailySales(seller_id=row.pop('product__seller_id'), **row)
+        for row in lines.values('product__seller_id', 'day').annotate(**totals).order_by()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('localfood_app', '0006_product_popularity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='paid_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='SellerDailySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('orders', models.PositiveIntegerField(default=0)),
+                ('seller', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ProductDailySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('orders', models.PositiveIntegerField(default=0)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='localfood_app.product')),
+                ('seller', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['seller', 'day'], name='product_sales_seller_day')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='productdailysales',
+            constraint=models.UniqueConstraint(fields=('product', 'day'), name='unique_product_daily_sales'),
+        ),
+        migrations.AddConstraint(
+            model_name='sellerdailysales',
+            constraint=models.UniqueConstraint(fields=('seller', 'day'), name='unique_seller_daily_sales'),
+        ),
+        migrations.RunPython(fill_sales_rollups, migrations.RunPython.noop),
+    ]
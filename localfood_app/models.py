@@ -1,6 +1,44 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import AbstractUser
+from django.dispatch import Signal
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
+
+from . import geo
+
+# Sent inside the payment transaction with the paid ``order``
+order_paid = Signal()
+
+
+class OutOfStock(Exception):
+    """
+    Raised when an order asks for more units of some products than are left.
+
+    Attributes:
+        product_ids (list): The IDs of the products short of stock.
+    """
+    def __init__(self, product_ids):
+        super().__init__(f'Not enough stock of products {product_ids}')
+        self.product_ids = product_ids
+
+PROVINCE_CHOICES = (
+    ('Dolnośląskie', 'Dolnośląskie'),
+    ('Kujawsko-pomorskie', 'Kujawsko-pomorskie'),
+    ('Lubelskie', 'Lubelskie'),
+    ('Lubuskie', 'Lubuskie'),
+    ('Łódzkie', 'Łódzkie'),
+    ('Małopolskie', 'Małopolskie'),
+    ('Mazowieckie', 'Mazowieckie'),
+    ('Opolskie', 'Opolskie'),
+    ('Podkarpackie', 'Podkarpackie'),
+    ('Podlaskie', 'Podlaskie'),
+    ('Pomorskie', 'Pomorskie'),
+    ('Śląskie', 'Śląskie'),
+    ('Świętokrzyskie', 'Świętokrzyskie'),
+    ('Warmińsko-mazurskie', 'Warmińsko-mazurskie'),
+    ('Wielkopolskie', 'Wielkopolskie'),
+    ('Zachodniopomorskie', 'Zachodniopomorskie'),
+)
 
 
 class User(AbstractUser):
@@ -14,6 +52,17 @@ class User(AbstractUser):
     is_buyer = models.BooleanField('buyer status', default=False)
     is_seller = models.BooleanField('seller status', default=False)
 
+    def get_session_auth_hash(self):
+        """
+        Returns an HMAC of the password field; users cached by
+        ``CachedModelBackend`` carry it in place of the password hash.
+
+        :return: The session hash.
+        """
+        if 'password' not in self.__dict__ and '_session_auth_hash' in self.__dict__:
+            return self._session_auth_hash
+        return super().get_session_auth_hash()
+
 
 class Category(models.Model):
     """
@@ -22,9 +71,11 @@ class Category(models.Model):
     Attributes:
         name (str): The name of the category.
         slug (str): The slug (URL-friendly identifier) of the category.
+        updated_at (datetime): The date and time of the last change.
     """
     name = models.CharField(max_length=100)
     slug = models.SlugField(max_length=100, unique=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         """
@@ -47,6 +98,12 @@ class Product(models.Model):
         category (Category): The category to which the product belongs.
         seller (User): The seller of the product.
         created_at (datetime): The date and time when the product was created.
+        updated_at (datetime): The date and time of the last change.
+        seller_province (str): The province of the seller's first address, copied
+            here so listings can be filtered by province through an index.
+        sales_count (int): The number of units sold in paid orders.
+        trending_score (float): The recent units sold, each weighted by how
+            recently it was sold; see ``popularity``.
     """
     name = models.CharField(max_length=100)
     description = models.TextField()
@@ -55,6 +112,35 @@ class Product(models.Model):
     category = models.ForeignKey(Category, on_delete=models.PROTECT, null=False, blank=False)
     seller = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    seller_province = models.CharField(max_length=20, choices=PROVINCE_CHOICES, null=True, blank=True,
+                                       editable=False)
+    sales_count = models.PositiveIntegerField(default=0, editable=False)
+    trending_score = models.FloatField(default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['seller_province', '-created_at'], name='product_province_created'),
+            models.Index(fields=['seller_province', 'category', '-created_at'],
+                         name='product_province_cat_created'),
+            models.Index(fields=['-sales_count', '-id'], name='product_bestsellers'),
+            models.Index(fields=['category', '-sales_count', '-id'], name='product_cat_bestsellers'),
+            models.Index(fields=['-trending_score', '-id'], name='product_trending'),
+            models.Index(fields=['category', '-trending_score', '-id'], name='product_cat_trending'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """
+        Remembers the seller, and the province and category the loaded product
+        is counted under in ``ProvinceCategoryCount``, so a save can move the count.
+        """
+        instance = super().from_db(db, field_names, values)
+        if 'seller_id' in instance.__dict__:
+            instance._loaded_seller_id = instance.seller_id
+        if 'seller_province' in instance.__dict__ and 'category_id' in instance.__dict__:
+            instance._counted_as = (instance.seller_province, instance.category_id)
+        return instance
 
     def get_primary_image(self):
         """
@@ -62,9 +148,56 @@ class Product(models.Model):
 
         :return: The first product image associated with the product.
         """
+        if 'productimage_set' in getattr(self, '_prefetched_objects_cache', {}):
+            images = self.productimage_set.all()
+            return images[0] if images else None
         return self.productimage_set.first()
 
 
+class ProvinceCategoryCount(models.Model):
+    """
+    Model holding the number of products per seller province and category,
+    maintained by signal handlers as products change.
+
+    Attributes:
+        province (str): The seller province.
+        category (Category): The category.
+        count (int): The number of products.
+    """
+    province = models.CharField(max_length=20, choices=PROVINCE_CHOICES)
+    category = models.ForeignKey(Category, on_delete=models.CASCADE)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['province', 'category'], name='unique_province_category_count'),
+        ]
+
+
+class RelatedProduct(models.Model):
+    """
+    Model representing a product frequently bought together with another one,
+    computed offline by the ``build_recommendations`` command.
+
+    Attributes:
+        product (Product): The product the recommendation is shown for.
+        related (Product): The recommended product.
+        rank (int): The position of the recommendation, starting at 1.
+        score (float): The cosine similarity of the two products' order sets.
+        orders (int): The number of paid orders containing both products.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='related_products')
+    related = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+    orders = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'rank'], name='unique_related_product_rank'),
+        ]
+
+
 class ProductImage(models.Model):
     """
     Model representing an image associated with a product.
@@ -91,25 +224,11 @@ class Address(models.Model):
         unit_number (str): The unit number.
         province (str): The province of the address.
         postal_code (str): The postal code of the address.
+        latitude (float): The latitude of the postal district, set from the postal code.
+        longitude (float): The longitude of the postal district, set from the postal code.
+        grid_cell (int): The cell of the proximity search grid containing the address.
     """
-    PROVINCE_CHOICES = (
-        ('Dolnośląskie', 'Dolnośląskie'),
-        ('Kujawsko-pomorskie', 'Kujawsko-pomorskie'),
-        ('Lubelskie', 'Lubelskie'),
-        ('Lubuskie', 'Lubuskie'),
-        ('Łódzkie', 'Łódzkie'),
-        ('Małopolskie', 'Małopolskie'),
-        ('Mazowieckie', 'Mazowieckie'),
-        ('Opolskie', 'Opolskie'),
-        ('Podkarpackie', 'Podkarpackie'),
-        ('Podlaskie', 'Podlaskie'),
-        ('Pomorskie', 'Pomorskie'),
-        ('Śląskie', 'Śląskie'),
-        ('Świętokrzyskie', 'Świętokrzyskie'),
-        ('Warmińsko-mazurskie', 'Warmińsko-mazurskie'),
-        ('Wielkopolskie', 'Wielkopolskie'),
-        ('Zachodniopomorskie', 'Zachodniopomorskie'),
-    )
+    PROVINCE_CHOICES = PROVINCE_CHOICES
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True)
     city = models.CharField(max_length=100)
     street_name = models.CharField(max_length=100, null=True, blank=True)
@@ -118,6 +237,23 @@ class Address(models.Model):
     unit_number = models.CharField(max_length=100, null=True, blank=True)
     province = models.CharField(max_length=20, choices=PROVINCE_CHOICES, null=True, blank=True)
     postal_code = models.CharField(max_length=20, null=True, blank=True)
+    latitude = models.FloatField(null=True, blank=True, editable=False)
+    longitude = models.FloatField(null=True, blank=True, editable=False)
+    grid_cell = models.IntegerField(null=True, blank=True, editable=False, db_index=True)
+
+    def locate(self):
+        """
+        Sets the coordinates and grid cell of the address from its postal code,
+        or clears them if the postal code is unknown.
+        """
+        self.latitude, self.longitude, self.grid_cell = geo.location_fields(self.postal_code)
+
+    def save(self, *args, **kwargs):
+        """
+        Saves the address with its coordinates.
+        """
+        self.locate()
+        super().save(*args, **kwargs)
 
 
 class Order(models.Model):
@@ -129,14 +265,44 @@ class Order(models.Model):
         created_at (datetime): The date and time when the order was created.
         realization_date (datetime): The date and time when the order was realized.
         is_paid (bool): Indicates if the order has been paid for.
+        paid_at (datetime): The date and time of the payment; empty for orders
+            paid before it was recorded.
         is_realized (bool): Indicates if the order has been realized.
     """
     buyer = models.ForeignKey(User, on_delete=models.CASCADE, null=False)
     created_at = models.DateTimeField(auto_now_add=True)
     realization_date = models.DateTimeField(null=True, blank=True)
     is_paid = models.BooleanField(default=False)
+    paid_at = models.DateTimeField(null=True, blank=True)
     is_realized = models.BooleanField(default=False)
 
+    def mark_paid(self):
+        """
+        Marks the order as paid and sends ``order_paid``, once even for
+        concurrent payments of the same order. The products are locked until the
+        payment commits, so concurrent orders cannot sell the same units twice.
+
+        :return: True if the order was paid now, False if it was paid already.
+        :raises OutOfStock: If a product has fewer units left than the order
+            asks for; nothing is paid.
+        """
+        paid_at = timezone.now()
+        with transaction.atomic():
+            if not Order.objects.filter(pk=self.pk, is_paid=False).update(is_paid=True, paid_at=paid_at):
+                return False
+            units = dict(OrderProduct.objects.filter(order_id=self.pk).values('product_id').annotate(
+                units=models.Sum('quantity')).values_list('product_id', 'units').order_by())
+            # locked in ID order, so that two payments cannot deadlock
+            left = dict(Product.objects.select_for_update().filter(pk__in=units).order_by('pk')
+                        .values_list('pk', 'quantity'))
+            short = sorted(product_id for product_id, count in units.items() if left.get(product_id, 0) < count)
+            if short:
+                # rolls back the payment
+                raise OutOfStock(short)
+            self.is_paid, self.paid_at = True, paid_at
+            order_paid.send(sender=Order, order=self)
+        return True
+
     @classmethod
     def add_product_to_basket(cls, user, product_id):
         """
@@ -187,6 +353,59 @@ class OrderProduct(models.Model):
         return self.product.price * self.quantity
 
 
+class SellerDailySales(models.Model):
+    """
+    Model holding the paid sales of a seller on one day, maintained as orders
+    are paid.
+
+    Attributes:
+        seller (User): The seller.
+        day (date): The day of the payments.
+        units (int): The number of units sold.
+        revenue (Decimal): The value of the units at the prices they were paid at.
+        orders (int): The number of paid orders containing the seller's products.
+    """
+    seller = models.ForeignKey(User, on_delete=models.CASCADE)
+    day = models.DateField()
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    orders = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['seller', 'day'], name='unique_seller_daily_sales'),
+        ]
+
+
+class ProductDailySales(models.Model):
+    """
+    Model holding the paid sales of a product on one day, maintained as orders
+    are paid.
+
+    Attributes:
+        seller (User): The seller of the product.
+        product (Product): The product.
+        day (date): The day of the payments.
+        units (int): The number of units sold.
+        revenue (Decimal): The value of the units at the prices they were paid at.
+        orders (int): The number of paid orders containing the product.
+    """
+    seller = models.ForeignKey(User, on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    day = models.DateField()
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    orders = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'day'], name='unique_product_daily_sales'),
+        ]
+        indexes = [
+            models.Index(fields=['seller', 'day'], name='product_sales_seller_day'),
+        ]
+
+
 class OrderImage(models.Model):
     """
     Model representing an image associated with an order.
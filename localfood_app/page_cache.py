@@ -0,0 +1,181 @@
+"""
+Full-page cache for anonymous visitors.
+
+``PageCacheMiddleware`` serves GET and HEAD requests for the URL names in
+``settings.PAGE_CACHE_URL_NAMES`` from the cache when the visitor has no
+session cookie, before sessions, authentication or the view run. Pages are
+keyed by host, path and the query string with its parameters sorted.
+
+A page is fresh for ``PAGE_CACHE_SOFT_TTL`` seconds and kept for
+``PAGE_CACHE_HARD_TTL``. Product and category changes bump a generation
+counter, which makes every cached page stale without deleting it. When a page
+is stale, the first worker to take its lock (``cache.add``) renders it again;
+the others keep serving the stale copy meanwhile, so an expired popular page
+does not send a burst of identical queries to the database. When there is no
+copy at all, the others render the page too, or first poll for up to
+``PAGE_CACHE_WAIT`` seconds if it is set.
+
+Responses that set a cookie are not stored: a page that called ``get_token``
+carries a CSRF token matching only its own visitor's cookie. Pages meant for
+the cache render their CSRF tokens for logged-in users only.
+"""
+import hashlib
+import time
+import uuid
+from urllib.parse import parse_qsl, urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.urls import Resolver404, resolve
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe
+
+from .metrics import record_cache_access
+
+GENERATION_KEY = 'page:generation'
+UNCACHED_HEADERS = {'set-cookie', 'x-page-cache'}
+
+
+def cache_key(host, path, query_string):
+    """
+    Returns the cache key of a page.
+
+    :param host: The requested host.
+    :param path: The URL path.
+    :param query_string: The raw query string; parameter order does not matter.
+    :return: The cache key.
+    """
+    query = urlencode(sorted(parse_qsl(query_string, keep_blank_values=True)))
+    digest = hashlib.md5(f'{host}{path}?{query}'.encode(), usedforsecurity=False).hexdigest()
+    return f'page:v1:{digest}'
+
+
+def lock_key(key):
+    """
+    Returns the key of the lock held by the worker regenerating a page.
+    """
+    return f'{key}:lock'
+
+
+def request_cache_key(request):
+    """
+    Returns the cache key of a request, or None if its response must not be
+    served from or stored in the page cache.
+
+    :param request: The HTTP request.
+    :return: The cache key, or None.
+    """
+    if request.method not in ('GET', 'HEAD') or settings.SESSION_COOKIE_NAME in request.COOKIES:
+        return None
+    try:
+        match = resolve(request.path_info)
+    except Resolver404:
+        return None
+    if match.view_name not in settings.PAGE_CACHE_URL_NAMES:
+        return None
+    request.resolver_match = match
+    return cache_key(request.get_host(), request.path, request.META.get('QUERY_STRING', ''))
+
+
+def lookup(key):
+    """
+    Returns the cached page to serve, or None if the caller has to render it.
+
+    :param key: The cache key of the page.
+    :return: An (entry, state, generation, lock) tuple; the entry is None when
+        the caller renders the page, state is ``HIT``, ``STALE`` or ``MISS``,
+        generation is the one to store a rendered page with and lock is the
+        token of the regeneration lock the caller took, or None.
+    """
+    values = cache.get_many([key, GENERATION_KEY])
+    entry = values.get(key)
+    generation = values.get(GENERATION_KEY, 0)
+    if entry and entry['generation'] == generation and entry['fresh_until'] > time.time():
+        return entry, 'HIT', generation, None
+    lock = uuid.uuid4().hex
+    if cache.add(lock_key(key), lock, timeout=settings.PAGE_CACHE_LOCK_SECONDS):
+        return None, 'MISS', generation, lock
+    if entry:
+        return entry, 'STALE', generation, None
+    deadline = time.monotonic() + settings.PAGE_CACHE_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        entry = cache.get(key)
+        if entry:
+            return entry, 'STALE', generation, None
+    # render without the lock, which another worker still holds
+    return None, 'MISS', generation, None
+
+
+def store(key, response, generation, lock=None):
+    """
+    Stores a freshly rendered page (only plain 200 responses that set no
+    cookie) and releases the regeneration lock if the caller holds it.
+
+    :param key: The cache key of the page.
+    :param response: The rendered response.
+    :param generation: The generation current before the page was rendered, so
+        a page rendered while the catalog changed is already stale.
+    :param lock: The lock token returned by ``lookup``, or None if the caller
+        rendered without the lock.
+    """
+    try:
+        if (response.status_code != 200 or response.streaming or response.cookies
+                or 'no-store' in response.get('Cache-Control', '')):
+            return
+        cache.set(key, {
+            'content': response.content,
+            'headers': [(name, value) for name, value in response.items()
+                        if name.lower() not in UNCACHED_HEADERS],
+            'generation': generation,
+            'fresh_until': time.time() + settings.PAGE_CACHE_SOFT_TTL,
+        }, timeout=settings.PAGE_CACHE_HARD_TTL)
+    finally:
+        # the lock may have expired and been taken by another worker
+        if lock is not None and cache.get(lock_key(key)) == lock:
+            cache.delete(lock_key(key))
+
+
+def respond(request, entry, state):
+    """
+    Builds the response for a cached page, answering revalidations with 304.
+
+    :param request: The HTTP request.
+    :param entry: The cached page.
+    :param state: ``HIT`` or ``STALE``.
+    :return: The response.
+    """
+    response = HttpResponse(entry['content'])
+    for name, value in entry['headers']:
+        response[name] = value
+    response = get_conditional_response(
+        request,
+        etag=response.get('ETag'),
+        last_modified=parse_http_date_safe(response.get('Last-Modified', '')),
+        response=response,
+    )
+    response['X-Page-Cache'] = state
+    record_cache_access('page', hits=1)
+    return response
+
+
+def invalidate():
+    """
+    Marks every cached page as stale.
+    """
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.add(GENERATION_KEY, 1, timeout=None)
+
+
+def invalidate_on_commit():
+    """
+    Marks every cached page as stale now and again once the current
+    transaction commits, so a page rendered from the old rows meanwhile is not
+    served as fresh.
+    """
+    invalidate()
+    transaction.on_commit(invalidate)
@@ -0,0 +1,125 @@
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator, Page, EmptyPage, PageNotAnInteger
+from django.db.models import Q
+
+
+def get_page(queryset, number, per_page, count=None):
+    """
+    ``Paginator.get_page`` with an optional known number of objects, which
+    saves counting the queryset.
+
+    :param queryset: The queryset to paginate.
+    :param number: The requested page number, usually from ``request.GET``.
+    :param per_page: Number of objects per page.
+    :param count: The number of objects, or None to count the queryset.
+    :return: A ``Page`` holding the objects of the requested page.
+    """
+    paginator = Paginator(queryset, per_page)
+    if count is not None:
+        paginator.count = count
+    return paginator.get_page(number)
+
+
+async def aget_page(queryset, number, per_page, count=None):
+    """
+    Async counterpart of ``Paginator.get_page`` using the async ORM.
+
+    Counts the queryset with ``acount()`` (unless ``count`` is given) and
+    fetches only the requested slice, falling back to the first or last page
+    for invalid numbers just like ``get_page``.
+
+    :param queryset: The queryset to paginate.
+    :param number: The requested page number, usually from ``request.GET``.
+    :param per_page: Number of objects per page.
+    :param count: The number of objects, or None to count the queryset.
+    :return: A ``Page`` holding the objects of the requested page.
+    """
+    paginator = Paginator(queryset, per_page)
+    paginator.count = await queryset.acount() if count is None else count
+    try:
+        number = paginator.validate_number(number)
+    except PageNotAnInteger:
+        number = 1
+    except EmptyPage:
+        number = paginator.num_pages
+
+    bottom = (number - 1) * per_page
+    objects = [obj async for obj in queryset[bottom:bottom + per_page]]
+    return Page(objects, number, paginator)
+
+
+class KeysetPage:
+    """
+    A page of a listing paginated by the values of its ordering column instead
+    of an offset, so every page costs the same index range scan and no count.
+
+    Attributes:
+        object_list (list): The objects of the page.
+        after (str): The cursor the page starts after, or None for the first page.
+        next_cursor (str): The cursor of the next page, or None on the last page.
+    """
+    def __init__(self, object_list, after, next_cursor):
+        self.object_list = object_list
+        self.after = after
+        self.next_cursor = next_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.after is not None
+
+
+def _keyset(queryset, field_name, after):
+    """
+    Orders a queryset by a column and the primary key, both descending, and
+    narrows it to the rows after a cursor.
+
+    :return: A (queryset, cursor) tuple; the cursor is None if it was missing or invalid.
+    """
+    queryset = queryset.order_by(f'-{field_name}', '-pk')
+    try:
+        value, pk = (after or '').rsplit('_', 1)
+        value = queryset.model._meta.get_field(field_name).to_python(value)
+        pk = int(pk)
+    except (ValueError, ValidationError):
+        return queryset, None
+    # the first condition bounds the index range scan, the second skips the
+    # rows of the cursor's value up to its primary key
+    return queryset.filter(Q(**{f'{field_name}__lt': value}) | Q(pk__lt=pk), **{f'{field_name}__lte': value}), after
+
+
+def _keyset_page(objects, field_name, after, per_page):
+    next_cursor = None
+    if len(objects) > per_page:
+        objects = objects[:per_page]
+        next_cursor = f'{getattr(objects[-1], field_name)!r}_{objects[-1].pk}'
+    return KeysetPage(objects, after, next_cursor)
+
+
+def get_keyset_page(queryset, field_name, after, per_page):
+    """
+    Returns a page of a queryset ordered by a column, largest first.
+
+    :param queryset: The queryset to paginate.
+    :param field_name: The ordering column; ties are ordered by primary key.
+    :param after: The cursor from the previous page, usually from ``request.GET``.
+    :param per_page: Number of objects per page.
+    :return: A ``KeysetPage``; an invalid cursor gives the first page.
+    """
+    queryset, after = _keyset(queryset, field_name, after)
+    return _keyset_page(list(queryset[:per_page + 1]), field_name, after, per_page)
+
+
+async def aget_keyset_page(queryset, field_name, after, per_page):
+    """
+    Async counterpart of ``get_keyset_page`` using the async ORM.
+    """
+    queryset, after = _keyset(queryset, field_name, after)
+    return _keyset_page([obj async for obj in queryset[:per_page + 1]], field_name, after, per_page)
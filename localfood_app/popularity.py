@@ -0,0 +1,122 @@
+"""
+Popularity of products: the "bestsellers" and "trending" listing sorts.
+
+``Product.sales_count`` is the number of units sold. ``Product.trending_score``
+is a count of units that decays with a half-life of
+``settings.TRENDING_HALF_LIFE_DAYS``. Decaying every score as time passes
+would rewrite the whole table; instead, a sale adds ``2 ** (t / half-life)``
+units, with ``t`` the time since ``settings.TRENDING_EPOCH``. All scores then
+carry the same growing factor, so ordering by the stored score is ordering by
+the decayed one, and a payment only adds to the scores of the products it
+contains (``record_sales``, run by the ``order_paid`` signal).
+
+The weights double every half-life, so a float score lasts about 1000
+half-lives after the epoch (some 19 years at 7 days). Moving the epoch forward
+needs ``manage.py rebuild_popularity``, which also recomputes both columns
+from the paid order lines after bulk writes.
+"""
+import math
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, FloatField, PositiveIntegerField, Q, Sum, Value, When
+from django.utils import timezone
+
+from . import page_cache, product_cache
+from .models import OrderProduct, Product
+
+# sort parameter -> ordering column
+SORTS = {
+    'bestsellers': 'sales_count',
+    'trending': 'trending_score',
+}
+
+
+def _epoch():
+    epoch = datetime.fromisoformat(settings.TRENDING_EPOCH)
+    return epoch if epoch.tzinfo else epoch.replace(tzinfo=dt_timezone.utc)
+
+
+def sale_weight(when):
+    """
+    Returns the trending weight of a unit sold at a time.
+
+    :param when: The aware datetime of the sale.
+    :return: The weight, ``2 ** (time since the epoch / half-life)``.
+    """
+    half_lives = (when - _epoch()).total_seconds() / (settings.TRENDING_HALF_LIFE_DAYS * 86400)
+    return math.pow(2, half_lives)
+
+
+def decayed(trending_score, now=None):
+    """
+    Returns a stored trending score as units sold, decayed to a time.
+
+    :param trending_score: The ``Product.trending_score``.
+    :param now: The time to decay to, by default now.
+    :return: The decayed number of units.
+    """
+    return trending_score / sale_weight(timezone.now() if now is None else now)
+
+
+def record_sales(order_id, now=None):
+    """
+    Adds the units of a paid order to the popularity of its products, in one
+    statement.
+
+    :param order_id: The ID of the order.
+    :param now: The time of the sale, by default now.
+    :return: The IDs of the updated products, whose cached copies the caller
+        invalidates once the transaction commits.
+    """
+    now = timezone.now() if now is None else now
+    sold = dict(OrderProduct.objects.filter(order_id=order_id).values('product_id').annotate(
+        units=Sum('quantity')).values_list('product_id', 'units').order_by())
+    if not sold:
+        return []
+    weight = sale_weight(now)
+    Product.objects.filter(pk__in=sold).update(
+        sales_count=F('sales_count') + Case(
+            *[When(pk=pk, then=Value(units)) for pk, units in sold.items()], output_field=PositiveIntegerField()),
+        trending_score=F('trending_score') + Case(
+            *[When(pk=pk, then=Value(units * weight)) for pk, units in sold.items()], output_field=FloatField()),
+        updated_at=now,
+    )
+    return list(sold)
+
+
+def rebuild(batch_size=1000):
+    """
+    Recomputes the sales count and trending score of every product from the
+    paid order lines, weighting each line by the payment time of its order (or
+    its creation time, for orders paid before payments were timed). Only the
+    products whose values change are written, and removed from the product
+    cache; the cached pages are marked stale.
+
+    :param batch_size: The number of products updated per query.
+    :return: The number of products with sales.
+    """
+    sales, scores = {}, {}
+    lines = OrderProduct.objects.filter(order__is_paid=True).values_list(
+        'product_id', 'quantity', 'order__paid_at', 'order__created_at')
+    for product_id, quantity, sold_at, created_at in lines.iterator(chunk_size=5000):
+        sales[product_id] = sales.get(product_id, 0) + quantity
+        scores[product_id] = scores.get(product_id, 0.0) + quantity * sale_weight(sold_at or created_at)
+
+    with transaction.atomic():
+        stored = {pk: (count, score) for pk, count, score in Product.objects.filter(
+            Q(sales_count__gt=0) | Q(trending_score__gt=0)).values_list('pk', 'sales_count', 'trending_score')}
+        now = timezone.now()
+        # a new updated_at changes the listing ETags with the new order
+        changed = [
+            Product(pk=product_id, sales_count=sales.get(product_id, 0),
+                    trending_score=scores.get(product_id, 0.0), updated_at=now)
+            for product_id in stored.keys() | sales.keys()
+            if sales.get(product_id, 0) != stored.get(product_id, (0, 0.0))[0]
+            or not math.isclose(scores.get(product_id, 0.0), stored.get(product_id, (0, 0.0))[1], rel_tol=1e-9)
+        ]
+        Product.objects.bulk_update(changed, ['sales_count', 'trending_score', 'updated_at'], batch_size=batch_size)
+        product_cache.invalidate_on_commit([product.pk for product in changed])
+        page_cache.invalidate_on_commit()
+    return len(sales)
@@ -0,0 +1,142 @@
+"""
+Cache-aside repository for products.
+
+Products are read on almost every page (detail pages, basket, order history and
+seller order lines) but rarely change. They are cached as model instances,
+with their category, images and the seller's username loaded, under one key
+per product. A batch of products is read with a single ``cache.get_many`` call;
+the misses are loaded with one ``id__in`` query and written back with
+``set_many``. ``signals.py`` deletes the keys when a product or its images
+change, and again when the transaction commits. A category change instead
+bumps a version that is part of every key, so it costs one cache write however
+many products the category has.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Prefetch
+
+from .metrics import record_cache_access
+from .models import Product, ProductImage
+
+KEY_PREFIX = 'product:v1:'
+CATEGORIES_VERSION_KEY = 'product:categories'
+# the templates only show the seller's username; the rest of the user row,
+# password hash included, is kept out of the cache
+SELLER_FIELDS = ('seller__id', 'seller__username')
+
+
+def categories_version():
+    """
+    Returns the version of the categories the cached products were loaded with.
+    """
+    return cache.get(CATEGORIES_VERSION_KEY, 0)
+
+
+def cache_key(product_id, version=None):
+    """
+    Returns the cache key of a product.
+
+    :param product_id: The ID of the product.
+    :param version: The categories version, by default the current one.
+    :return: The cache key.
+    """
+    version = categories_version() if version is None else version
+    return f'{KEY_PREFIX}{version}:{product_id}'
+
+
+def _load(product_ids):
+    # misses are read from the primary: a lagging replica could otherwise put
+    # a row that was just changed (and invalidated) back into the cache
+    fields = [field.name for field in Product._meta.concrete_fields]
+    return Product.objects.using('default').select_related('category', 'seller').only(
+        *fields, *SELLER_FIELDS
+    ).prefetch_related(
+        Prefetch('productimage_set', queryset=ProductImage.objects.using('default').order_by('pk'))
+    ).in_bulk(product_ids)
+
+
+def get_products(product_ids):
+    """
+    Returns products by ID, from the cache where possible.
+
+    :param product_ids: The IDs of the products.
+    :return: A dict of product ID to product; missing products are left out.
+    """
+    product_ids = set(product_ids)
+    if not product_ids:
+        return {}
+    version = categories_version()
+    keys = {cache_key(product_id, version): product_id for product_id in product_ids}
+    cached = cache.get_many(keys)
+    products = {keys[key]: product for key, product in cached.items()}
+    missing = [product_id for product_id in keys.values() if product_id not in products]
+    if missing:
+        loaded = _load(missing)
+        cache.set_many({cache_key(pk, version): product for pk, product in loaded.items()},
+                       timeout=settings.PRODUCT_CACHE_TIMEOUT)
+        products.update(loaded)
+    record_cache_access('product', hits=len(cached), misses=len(missing))
+    return products
+
+
+def get_product(product_id):
+    """
+    Returns a product by ID, from the cache where possible.
+
+    :param product_id: The ID of the product.
+    :return: The product, or None if it does not exist.
+    """
+    return get_products([int(product_id)]).get(int(product_id))
+
+
+def attach_products(order_products):
+    """
+    Sets the product of every order line from the cache, so rendering a page of
+    lines needs no product queries.
+
+    :param order_products: An iterable of ``OrderProduct`` loaded without their products.
+    """
+    order_products = list(order_products)
+    products = get_products(line.product_id for line in order_products)
+    for line in order_products:
+        line.product = products[line.product_id]
+
+
+def invalidate(product_ids):
+    """
+    Removes products from the cache.
+
+    :param product_ids: The IDs of the products.
+    """
+    version = categories_version()
+    cache.delete_many([cache_key(product_id, version) for product_id in product_ids])
+
+
+def invalidate_on_commit(product_ids):
+    """
+    Removes products from the cache now, for the rest of the current
+    transaction, and again once it commits: another request missing the cache
+    before the commit reads the old rows and would keep them cached for
+    ``PRODUCT_CACHE_TIMEOUT``.
+
+    :param product_ids: The IDs of the products.
+    """
+    product_ids = list(product_ids)
+    invalidate(product_ids)
+    transaction.on_commit(lambda: invalidate(product_ids))
+
+
+def invalidate_categories():
+    """
+    Makes every cached product a miss, now and again once the current
+    transaction commits, after a category was saved or deleted.
+    """
+    def bump():
+        try:
+            cache.incr(CATEGORIES_VERSION_KEY)
+        except ValueError:
+            cache.add(CATEGORIES_VERSION_KEY, 1, timeout=None)
+
+    bump()
+    transaction.on_commit(bump)
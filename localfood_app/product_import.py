@@ -0,0 +1,162 @@
+"""
+Streaming import of a seller's catalog from CSV or JSON Lines files.
+
+The file is read one row at a time: every row is validated with
+``ProductImportForm`` (the rules of ``AddProductForm``), its ``category`` slug
+is looked up in a map of all categories read once, and valid rows are inserted
+with ``bulk_create`` every ``batch_size`` rows. An invalid row is reported with
+its line number and skipped; the rows around it are still imported. Only one
+batch and the first ``max_errors`` errors are held in memory, so files of any
+size can be imported (``manage.py import_products``, or the upload page of the
+seller's ongoing sale).
+
+``bulk_create`` bypasses the product signals, so each batch sets the seller's
+province and adds to the province counts itself; the page cache is
+invalidated once at the end.
+"""
+import csv
+import io
+import json
+from collections import Counter
+
+from django.db import transaction
+
+from . import page_cache, provinces
+from .form import ProductImportForm
+from .models import Category, Product
+
+FORMATS = {
+    '.csv': 'csv',
+    '.jsonl': 'jsonl',
+    '.ndjson': 'jsonl',
+}
+
+
+class ImportResult:
+    """
+    The outcome of an import.
+
+    Attributes:
+        created (int): The number of products created.
+        errors (list): The first ``max_errors`` (line, message) tuples of the rows skipped.
+        error_count (int): The number of rows skipped.
+    """
+    def __init__(self, max_errors):
+        self.created = 0
+        self.errors = []
+        self.error_count = 0
+        self.max_errors = max_errors
+
+    def add_error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append((line, message))
+
+
+def format_of(filename):
+    """
+    Returns the format of a file from its extension.
+
+    :param filename: The name of the file.
+    :return: 'csv' or 'jsonl'.
+    :raises ValueError: If the extension is not one of ``FORMATS``.
+    """
+    for extension, file_format in FORMATS.items():
+        if filename.lower().endswith(extension):
+            return file_format
+    raise ValueError(f'Unsupported file type; use one of {", ".join(FORMATS)}.')
+
+
+def read_rows(file, file_format):
+    """
+    Reads the rows of a binary file one at a time.
+
+    :param file: A binary file object, e.g. an uploaded file.
+    :param file_format: 'csv' (with a header row) or 'jsonl' (one object per line).
+    :return: A generator of (line number, row dict, error) tuples; the row is
+        None when the line could not be parsed.
+    """
+    text = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+    try:
+        if file_format == 'csv':
+            reader = csv.DictReader(text)
+            for row in reader:
+                if None in row:
+                    yield reader.line_num, None, 'More values than columns.'
+                else:
+                    yield reader.line_num, row, None
+            return
+        for line, content in enumerate(text, start=1):
+            if not content.strip():
+                continue
+            try:
+                row = json.loads(content)
+            except ValueError as error:
+                yield line, None, f'Invalid JSON: {error}'
+                continue
+            if isinstance(row, dict):
+                yield line, row, None
+            else:
+                yield line, None, 'Expected a JSON object.'
+    except UnicodeDecodeError:
+        yield None, None, 'The file is not UTF-8 text.'
+    finally:
+        # leaves the file itself to its owner
+        text.detach()
+
+
+def _build(row, categories, seller, province):
+    """
+    Validates a row and returns an unsaved product, or the errors of the row.
+    """
+    form = ProductImportForm(row)
+    errors = [f'{field}: {" ".join(messages)}' for field, messages in form.errors.items()]
+    slug = str(row.get('category') or '').strip()
+    if slug not in categories:
+        errors.append(f'category: Unknown category "{slug}".' if slug else 'category: This field is required.')
+    if errors:
+        return None, '; '.join(errors)
+    product = form.save(commit=False)
+    product.category_id = categories[slug]
+    product.seller = seller
+    product.seller_province = province
+    return product, None
+
+
+def _insert(batch, province, result, batch_size):
+    if not batch:
+        return
+    with transaction.atomic():
+        Product.objects.bulk_create(batch, batch_size=batch_size)
+        for category_id, count in Counter(product.category_id for product in batch).items():
+            provinces.adjust_count(province, category_id, count)
+    result.created += len(batch)
+
+
+def import_products(seller, rows, batch_size=500, max_errors=100):
+    """
+    Creates the products of a seller from parsed rows.
+
+    :param seller: The seller of the products.
+    :param rows: The (line number, row dict, error) tuples returned by ``read_rows``.
+    :param batch_size: The number of products inserted per query.
+    :param max_errors: The number of errors kept for the report.
+    :return: An ``ImportResult``.
+    """
+    categories = dict(Category.objects.values_list('slug', 'pk'))
+    province = provinces.seller_province(seller.pk)
+    result, batch = ImportResult(max_errors), []
+    for line, row, error in rows:
+        if error is None:
+            product, error = _build(row, categories, seller, province)
+        if error is not None:
+            result.add_error(line, error)
+            continue
+        batch.append(product)
+        if len(batch) == batch_size:
+            _insert(batch, province, result, batch_size)
+            batch = []
+    _insert(batch, province, result, batch_size)
+    if result.created:
+        page_cache.invalidate()
+    return result
@@ -0,0 +1,139 @@
+"""
+Province filtering of the catalog.
+
+``Product.seller_province`` copies the province of the seller's first address,
+so a province listing is an indexed filter on the product table instead of a
+join through the seller's addresses. ``ProvinceCategoryCount`` holds the number
+of products per province and category. The handlers in ``signals.py`` keep
+both current as products and addresses change: a product moves one count down
+and another up, and a seller's new address updates the province of all of
+their products at once. A province listing is then paginated with the summed
+counts instead of a ``COUNT(*)`` over the products.
+
+Bulk writes (``bulk_create``, ``QuerySet.update``) bypass the signals; call
+``backfill_seller_provinces`` and ``rebuild_counts`` after them, or run
+``manage.py rebuild_province_counts``.
+"""
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, OuterRef, Subquery, Sum
+from django.utils import timezone
+
+from . import product_cache
+from .models import PROVINCE_CHOICES, Address, Product, ProvinceCategoryCount
+
+PROVINCES = [province for province, _ in PROVINCE_CHOICES]
+
+
+def seller_province(seller_id):
+    """
+    Returns the province of a seller's first address.
+
+    :param seller_id: The ID of the seller, or None.
+    :return: The province, or None.
+    """
+    if seller_id is None:
+        return None
+    return Address.objects.filter(user_id=seller_id).order_by('pk').values_list('province', flat=True).first()
+
+
+def adjust_count(province, category_id, delta):
+    """
+    Adds ``delta`` to the product count of a province and category.
+
+    :param province: The province; None is not counted.
+    :param category_id: The ID of the category.
+    :param delta: The change of the count.
+    """
+    if not province or not delta:
+        return
+    counts = ProvinceCategoryCount.objects.filter(province=province, category_id=category_id)
+    if counts.update(count=F('count') + delta):
+        return
+    try:
+        with transaction.atomic():
+            ProvinceCategoryCount.objects.create(province=province, category_id=category_id, count=delta)
+    except IntegrityError:
+        # created concurrently
+        counts.update(count=F('count') + delta)
+
+
+def update_seller_province(seller_id):
+    """
+    Sets the province of all products of a seller from their current first
+    address and moves their counts.
+
+    :param seller_id: The ID of the seller.
+    """
+    with transaction.atomic():
+        province = seller_province(seller_id)
+        # locked so that a concurrent product save cannot move a count in between
+        products = list(Product.objects.select_for_update().filter(seller_id=seller_id).order_by('pk')
+                        .values_list('pk', 'seller_province', 'category_id'))
+        moved = Counter((old, category_id) for _, old, category_id in products if old != province)
+        if not moved:
+            return
+        product_ids = [pk for pk, old, _ in products if old != province]
+        Product.objects.filter(pk__in=product_ids).update(seller_province=province, updated_at=timezone.now())
+        for (old, category_id), number in moved.items():
+            adjust_count(old, category_id, -number)
+            adjust_count(province, category_id, number)
+    # runs from the address signals, possibly inside the caller's transaction
+    product_cache.invalidate_on_commit(product_ids)
+
+
+def listing_count(province, category_slug=None):
+    """
+    Returns the number of products of a province, optionally in one category,
+    from the precomputed counts.
+
+    :param province: The province.
+    :param category_slug: The slug of the category, or None for all categories.
+    :return: The number of products.
+    """
+    counts = ProvinceCategoryCount.objects.filter(province=province)
+    if category_slug is not None:
+        counts = counts.filter(category__slug=category_slug)
+    return counts.aggregate(total=Sum('count'))['total'] or 0
+
+
+def counts_by_province(category_slug=None):
+    """
+    Returns the number of products per province, optionally in one category.
+
+    :param category_slug: The slug of the category, or None for all categories.
+    :return: A dict of province to number of products.
+    """
+    counts = ProvinceCategoryCount.objects.all()
+    if category_slug is not None:
+        counts = counts.filter(category__slug=category_slug)
+    return dict(counts.values('province').annotate(total=Sum('count')).values_list('province', 'total'))
+
+
+def backfill_seller_provinces():
+    """
+    Sets the province of the products that have none from their seller's
+    first address, in one statement.
+
+    :return: The number of updated products.
+    """
+    first_province = Address.objects.filter(user_id=OuterRef('seller_id')).order_by('pk').values('province')[:1]
+    return Product.objects.filter(seller_province__isnull=True, seller__isnull=False).update(
+        seller_province=Subquery(first_province)
+    )
+
+
+def rebuild_counts():
+    """
+    Recomputes all product counts from the product table.
+    """
+    rows = Product.objects.filter(seller_province__isnull=False).values(
+        'seller_province', 'category_id').annotate(products=Count('id')).order_by()
+    with transaction.atomic():
+        ProvinceCategoryCount.objects.all().delete()
+        ProvinceCategoryCount.objects.bulk_create([
+            ProvinceCategoryCount(province=row['seller_province'], category_id=row['category_id'],
+                                  count=row['products'])
+            for row in rows
+        ])
@@ -0,0 +1,24 @@
+"""
+Query budgets: the maximum number of SQL queries a view may run per request.
+
+Budgets are declared next to the views with the ``query_budget`` decorator and
+enforced by the test suite, which renders every budgeted URL against a large
+data set and fails when a view needs more queries, e.g. after a template
+change introduced an N+1.
+"""
+QUERY_BUDGETS = {}
+
+
+def query_budget(url_name, max_queries):
+    """
+    Class decorator declaring the query budget of the view behind a URL name.
+
+    :param url_name: The namespaced URL name, e.g. ``localfood_app:basket``.
+    :param max_queries: The maximum number of queries per request, including
+        the session and user lookups.
+    :return: The decorator.
+    """
+    def decorator(view_class):
+        QUERY_BUDGETS[url_name] = max_queries
+        return view_class
+    return decorator
@@ -0,0 +1,61 @@
+"""
+"Frequently bought together" recommendations.
+
+``manage.py build_recommendations`` counts how often two products appear in
+the same paid order and stores the ``RECOMMENDATIONS_TOP_K`` most similar
+products of every product in ``RelatedProduct``, ranked from 1. The pages read
+them with one query on the (product, rank) index and take the products
+themselves from the product cache, so showing recommendations costs no
+co-occurrence work per request.
+
+The table is rebuilt from scratch by every run; products sold after a run only
+appear in recommendations after the next one. A run moves the ``updated_at`` of
+the products whose recommendations changed, so their page's validators change
+like after any other edit of the product.
+"""
+from django.conf import settings
+
+from . import product_cache
+from .models import RelatedProduct
+
+
+def related_products(product_id, limit=None):
+    """
+    Returns the products most often bought together with a product.
+
+    :param product_id: The ID of the product.
+    :param limit: The maximum number of products, by default ``settings.RECOMMENDATIONS_SHOWN``.
+    :return: A list of products, best first.
+    """
+    limit = settings.RECOMMENDATIONS_SHOWN if limit is None else limit
+    related_ids = list(RelatedProduct.objects.filter(product_id=product_id, rank__lte=limit)
+                       .order_by('rank').values_list('related_id', flat=True))
+    products = product_cache.get_products(related_ids)
+    return [products[related_id] for related_id in related_ids if related_id in products]
+
+
+def basket_recommendations(product_ids, limit=None):
+    """
+    Returns the products most often bought together with the products of a
+    basket, leaving out the products already in it.
+
+    A product recommended for several basket products is ranked by the sum of
+    its scores.
+
+    :param product_ids: The IDs of the products in the basket.
+    :param limit: The maximum number of products, by default ``settings.RECOMMENDATIONS_SHOWN``.
+    :return: A list of products, best first.
+    """
+    limit = settings.RECOMMENDATIONS_SHOWN if limit is None else limit
+    product_ids = set(product_ids)
+    if not product_ids or not limit:
+        return []
+    rows = (RelatedProduct.objects.filter(product_id__in=product_ids, rank__lte=limit + len(product_ids))
+            .exclude(related_id__in=product_ids).values_list('related_id', 'score'))
+    scores = {}
+    for related_id, score in rows:
+        scores[related_id] = scores.get(related_id, 0.0) + score
+    related_ids = sorted(scores, key=lambda related_id: (-scores[related_id], related_id))[:limit]
+    products = product_cache.get_products(related_ids)
+    return [products[related_id] for related_id in related_ids if related_id in products]
+
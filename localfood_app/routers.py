@@ -0,0 +1,81 @@
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+
+# Set once the current request (or task) has written to the primary, or when the
+# client is still inside its read-your-writes window; reads then stay on primary.
+_pinned_to_primary = ContextVar('localfood_pinned_to_primary', default=False)
+
+
+def pin_to_primary():
+    """
+    Sends every following read of the current context to the primary database.
+    """
+    _pinned_to_primary.set(True)
+
+
+def reset_primary_pin():
+    """
+    Clears the primary pin of the current context.
+    """
+    _pinned_to_primary.set(False)
+
+
+def is_pinned_to_primary():
+    """
+    Tells whether reads of the current context are pinned to the primary database.
+
+    :return: True if reads must go to the primary database.
+    """
+    return _pinned_to_primary.get()
+
+
+class ReplicaRouter:
+    """
+    Database router sending catalog reads to read replicas.
+
+    Reads of the models listed in ``REPLICA_MODELS`` go to a random alias from
+    ``settings.DATABASE_REPLICAS`` unless the current context is pinned to the
+    primary. Every write goes to ``default`` and pins the context, so a request
+    always reads its own writes.
+    """
+    REPLICA_MODELS = {
+        'localfood_app.product',
+        'localfood_app.category',
+        'localfood_app.productimage',
+    }
+
+    def db_for_read(self, model, **hints):
+        """
+        Chooses a replica for catalog reads.
+
+        :param model: The model being read.
+        :return: A replica alias, or None to use the default database.
+        """
+        replicas = getattr(settings, 'DATABASE_REPLICAS', [])
+        if not replicas or is_pinned_to_primary():
+            return None
+        if model._meta.label_lower not in self.REPLICA_MODELS:
+            return None
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        """
+        Sends every write to the primary and pins the current context to it.
+
+        :param model: The model being written.
+        :return: The default database alias.
+        """
+        pin_to_primary()
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        """
+        Allows relations between objects loaded from the primary or any replica,
+        since replicas hold the same data.
+        """
+        databases = {'default', *getattr(settings, 'DATABASE_REPLICAS', [])}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
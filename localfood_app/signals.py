@@ -0,0 +1,129 @@
+"""
+Signal handlers keeping the caches consistent with the database; connected in
+``LocalfoodAppConfig.ready``.
+"""
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import analytics, events, page_cache, popularity, product_cache, provinces, stock, usernames
+from .backends import user_cache_key
+from .models import Address, Category, Product, ProductImage, User, order_paid
+
+
+@receiver([post_save, post_delete], sender=Product)
+def invalidate_product(sender, instance, **kwargs):
+    product_cache.invalidate_on_commit([instance.pk])
+
+
+@receiver([post_save, post_delete], sender=ProductImage)
+def touch_product_of_image(sender, instance, **kwargs):
+    # the product page and listing validators only read Product.updated_at
+    Product.objects.filter(pk=instance.product_id).update(updated_at=timezone.now())
+
+
+@receiver([post_save, post_delete], sender=ProductImage)
+def invalidate_product_of_image(sender, instance, **kwargs):
+    product_cache.invalidate_on_commit([instance.product_id])
+
+
+@receiver([post_save, post_delete], sender=Category)
+def invalidate_category_products(sender, instance, **kwargs):
+    product_cache.invalidate_categories()
+
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=ProductImage)
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=Address)
+def invalidate_pages(sender, **kwargs):
+    page_cache.invalidate_on_commit()
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_user(sender, instance, **kwargs):
+    # again on commit: CachedModelBackend may re-cache the old row meanwhile
+    key = user_cache_key(instance.pk)
+    cache.delete(key)
+    transaction.on_commit(lambda: cache.delete(key))
+
+
+@receiver(post_save, sender=User)
+def remember_username(sender, instance, update_fields, **kwargs):
+    # new users and renames; e.g. login only updates last_login
+    if update_fields is None or 'username' in update_fields:
+        usernames.index.add(instance.username)
+
+
+@receiver(pre_save, sender=Product)
+def set_seller_province(sender, instance, **kwargs):
+    if instance._state.adding or instance.seller_id != getattr(instance, '_loaded_seller_id', instance.seller_id):
+        instance.seller_province = provinces.seller_province(instance.seller_id)
+
+
+@receiver(post_save, sender=Product)
+def count_saved_product(sender, instance, created, **kwargs):
+    counted_as = (instance.seller_province, instance.category_id)
+    previous = None if created else getattr(instance, '_counted_as', counted_as)
+    if previous != counted_as:
+        if previous is not None:
+            provinces.adjust_count(*previous, -1)
+        provinces.adjust_count(*counted_as, 1)
+    instance._counted_as = counted_as
+    instance._loaded_seller_id = instance.seller_id
+
+
+@receiver(post_delete, sender=Product)
+def count_deleted_product(sender, instance, **kwargs):
+    provinces.adjust_count(instance.seller_province, instance.category_id, -1)
+
+
+@receiver([post_save, post_delete], sender=Address)
+def update_seller_province(sender, instance, **kwargs):
+    if instance.user_id is not None:
+        provinces.update_seller_province(instance.user_id)
+
+
+@receiver(order_paid)
+def record_sales(sender, order, **kwargs):
+    product_ids = popularity.record_sales(order.pk)
+
+    def invalidate():
+        # not before: a request missing the cache meanwhile would store the old row
+        product_cache.invalidate(product_ids)
+        page_cache.invalidate()
+
+    if product_ids:
+        transaction.on_commit(invalidate)
+
+
+@receiver(order_paid)
+def roll_up_sales(sender, order, **kwargs):
+    analytics.record_order(order)
+
+
+@receiver(order_paid)
+def take_stock(sender, order, **kwargs):
+    levels = stock.take_paid_units(order.pk, order.paid_at)
+
+    def publish():
+        product_cache.invalidate(levels)
+        page_cache.invalidate()
+        stock.publish(levels)
+
+    transaction.on_commit(publish)
+
+
+@receiver(post_save, sender=Product)
+def publish_stock(sender, instance, created, **kwargs):
+    if not created:
+        levels = {instance.pk: instance.quantity}
+        transaction.on_commit(lambda: stock.publish(levels))
+
+
+@receiver(order_paid)
+def notify_sellers(sender, order, **kwargs):
+    messages = events.paid_order_messages(order)
+    transaction.on_commit(lambda: events.publish_paid_order(messages))
@@ -0,0 +1,147 @@
+"""
+Slow-query log for the ``localfood_app`` views.
+
+``SlowQueryMiddleware`` times every SQL statement run while serving a request.
+Statements slower than ``settings.SLOW_QUERY_MS`` are queued together with the
+URL name and the template being rendered at the time; a background thread runs
+``EXPLAIN`` for them on its own connection (so the request never waits for it)
+and appends a JSON record to a per-process rotating file in
+``settings.SLOW_QUERY_LOG_DIR``. ``manage.py slow_queries_report`` summarizes
+the files.
+"""
+import json
+import logging
+import os
+import queue
+import threading
+from datetime import datetime, timezone
+from logging.handlers import RotatingFileHandler
+
+from django.conf import settings
+from django.db import connections
+
+EXPLAIN_PREFIXES = {
+    'postgresql': 'EXPLAIN (ANALYZE off) ',
+    'sqlite': 'EXPLAIN QUERY PLAN ',
+    'mysql': 'EXPLAIN ',
+}
+EXPLAINABLE_STATEMENTS = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE')
+
+
+def log_file_pattern():
+    """
+    Returns the glob matching the slow-query files of every process, including
+    rotated ones.
+    """
+    return os.path.join(settings.SLOW_QUERY_LOG_DIR, 'slow-queries-*.jsonl*')
+
+
+def explain(alias, sql, params):
+    """
+    Returns the query plan of a statement without executing it.
+
+    :param alias: The database alias the statement ran on.
+    :param sql: The SQL statement with placeholders.
+    :param params: The statement parameters.
+    :return: The plan as a list of lines, or None if it cannot be explained.
+    """
+    connection = connections[alias]
+    prefix = EXPLAIN_PREFIXES.get(connection.vendor)
+    if prefix is None or not sql.lstrip().upper().startswith(EXPLAINABLE_STATEMENTS):
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(prefix + sql, params)
+        return [' '.join(str(column) for column in row) for row in cursor.fetchall()]
+
+
+class SlowQueryRecorder:
+    """
+    Queues slow statements and explains and logs them in a background thread.
+    """
+    def __init__(self):
+        self._queue = queue.Queue(maxsize=1000)
+        self._thread = None
+        self._logger = None
+        self._log_dir = None
+        self._start_lock = threading.Lock()
+
+    def record(self, alias, sql, params, duration, url_name, template):
+        """
+        Queues a slow statement; drops it if the queue is full rather than
+        slowing down the request.
+
+        :param alias: The database alias.
+        :param sql: The SQL statement with placeholders.
+        :param params: The statement parameters, used only to run EXPLAIN.
+        :param duration: The statement duration in seconds.
+        :param url_name: The URL name of the view that ran it.
+        :param template: The template being rendered, if any.
+        """
+        self._ensure_started()
+        entry = {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'url_name': url_name,
+            'template': template,
+            'alias': alias,
+            'duration_ms': round(duration * 1000, 3),
+            'sql': sql,
+        }
+        try:
+            self._queue.put_nowait((entry, params))
+        except queue.Full:
+            pass
+
+    def flush(self):
+        """
+        Blocks until every queued statement has been explained and written.
+        """
+        self._queue.join()
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='slow-query-explainer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            entry, params = self._queue.get()
+            try:
+                self._write(entry, params)
+            finally:
+                self._queue.task_done()
+                if self._queue.empty():
+                    connections.close_all()
+
+    def _write(self, entry, params):
+        try:
+            entry['plan'] = explain(entry['alias'], entry['sql'], params)
+        except Exception as exc:
+            entry['plan'] = None
+            entry['plan_error'] = str(exc)
+        self._get_logger().info(json.dumps(entry, default=str))
+
+    def _get_logger(self):
+        directory = settings.SLOW_QUERY_LOG_DIR
+        if self._logger is None or self._log_dir != directory:
+            os.makedirs(directory, exist_ok=True)
+            logger = logging.getLogger(f'{__name__}.{os.getpid()}')
+            logger.propagate = False
+            logger.setLevel(logging.INFO)
+            for handler in logger.handlers[:]:
+                logger.removeHandler(handler)
+                handler.close()
+            logger.addHandler(RotatingFileHandler(
+                os.path.join(directory, f'slow-queries-{os.getpid()}.jsonl'),
+                maxBytes=settings.SLOW_QUERY_LOG_MAX_BYTES,
+                backupCount=settings.SLOW_QUERY_LOG_BACKUP_COUNT,
+                encoding='utf-8',
+            ))
+            self._log_dir = directory
+            self._logger = logger
+        return self._logger
+
+
+recorder = SlowQueryRecorder()
@@ -0,0 +1,67 @@
+"""
+Stock levels of products, and their live updates on the product pages.
+
+Paying an order takes its units from ``Product.quantity`` (``take_paid_units``,
+run by the ``order_paid`` signal); a payment asking for more units than are
+left is rejected with ``OutOfStock``. Saving a product may change it too. Either
+way the new levels are published on the ``product:<id>`` topics once the
+transaction commits.
+
+Under the ASGI profile a product page follows those topics through
+``async_views.ProductStockEventsView``. Its subscription keeps only the latest
+level per product and the stream sends at most one update every
+``settings.STOCK_EVENTS_INTERVAL_SECONDS``, so during a flash sale every viewer
+gets a bounded number of small messages however many orders are paid.
+"""
+from django.db.models import Case, F, PositiveIntegerField, Sum, Value, When
+from django.utils import timezone
+
+from . import events
+from .models import OrderProduct, Product
+
+
+def product_topic(product_id):
+    return f'product:{product_id}'
+
+
+def levels(product_ids):
+    """
+    Returns the available quantity of some products.
+
+    :param product_ids: The IDs of the products.
+    :return: A dict of product ID to quantity; missing products are left out.
+    """
+    return dict(Product.objects.filter(pk__in=list(product_ids)).values_list('pk', 'quantity'))
+
+
+def take_paid_units(order_id, now=None):
+    """
+    Takes the units of a paid order from the stock of its products, in one
+    statement. ``Order.mark_paid`` has locked the products and checked that
+    they have the units left.
+
+    :param order_id: The ID of the order.
+    :param now: The time of the payment, by default now.
+    :return: A dict of product ID to the quantity left; the caller invalidates
+        the cached copies of these products once the transaction commits.
+    """
+    sold = dict(OrderProduct.objects.filter(order_id=order_id).values('product_id').annotate(
+        units=Sum('quantity')).values_list('product_id', 'units').order_by())
+    if not sold:
+        return {}
+    Product.objects.filter(pk__in=sold).update(
+        quantity=F('quantity') - Case(
+            *[When(pk=pk, then=Value(units)) for pk, units in sold.items()], output_field=PositiveIntegerField()),
+        updated_at=timezone.now() if now is None else now,
+    )
+    return levels(sold)
+
+
+def publish(stock_levels):
+    """
+    Publishes stock levels to the streams following the products.
+
+    :param stock_levels: A dict of product ID to quantity.
+    """
+    for product_id, quantity in stock_levels.items():
+        events.publish(product_topic(product_id), {'product': product_id, 'quantity': quantity})
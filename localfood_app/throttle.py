@@ -0,0 +1,207 @@
+"""
+Sliding-window throttling of the login and sign-up forms.
+
+Checking a password (or hashing a new one) is deliberately expensive, so a
+burst of credential-stuffing attempts can keep every worker busy. The views
+using ``ThrottleMixin`` count POST requests per client IP and per submitted
+username before the form is validated, and answer over the limit with 429
+without any hashing. A view can take back the count of a successful attempt,
+so that e.g. only failed logins count against a username.
+
+Each limit in ``settings.THROTTLE_RATES`` is ``(requests, window seconds)``.
+Counts are kept per fixed window in the shared cache and weighted into a
+sliding window: the previous window's count counts for the part of it that
+still overlaps the last ``window`` seconds. A request first increments its
+current windows and is then judged on the counts ``incr`` returned, so
+concurrent requests each see the ones before them; a rejected request is
+decremented again. When the cache backend fails, the counts are kept in process
+memory instead, so throttling still works per worker.
+"""
+import hashlib
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.shortcuts import render
+
+from .metrics import THROTTLED
+
+KEY_PREFIX = 'throttle:v1:'
+
+
+class LocalCounters:
+    """
+    In-process fallback for the window counts, used while the cache fails.
+    """
+    def __init__(self):
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        now = time.monotonic()
+        with self._lock:
+            return {key: self._counts[key][0] for key in keys
+                    if key in self._counts and self._counts[key][1] > now}
+
+    def incr(self, key, timeout, delta=1):
+        now = time.monotonic()
+        with self._lock:
+            if len(self._counts) > 10000:
+                self._counts = {key: value for key, value in self._counts.items() if value[1] > now}
+            count, expires = self._counts.get(key, (0, now + timeout))
+            if expires <= now:
+                count, expires = 0, now + timeout
+            self._counts[key] = (max(count + delta, 0), expires)
+            return self._counts[key][0]
+
+    def clear(self):
+        with self._lock:
+            self._counts.clear()
+
+
+local_counters = LocalCounters()
+
+
+def _window_keys(scope, kind, value, window, now):
+    digest = hashlib.md5(value.encode(), usedforsecurity=False).hexdigest()
+    number = int(now // window)
+    return [f'{KEY_PREFIX}{scope}:{kind}:{digest}:{window}:{number - 1}',
+            f'{KEY_PREFIX}{scope}:{kind}:{digest}:{window}:{number}']
+
+
+def _incr(key, timeout):
+    cache.add(key, 0, timeout=timeout)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # expired between add and incr
+        cache.add(key, 1, timeout=timeout)
+        return 1
+
+
+def _limits(scope, identities, now, kinds=None):
+    limits = []
+    for kind, (requests, window) in settings.THROTTLE_RATES.get(scope, {}).items():
+        if identities.get(kind) and (kinds is None or kind in kinds):
+            limits.append((kind, requests, window, _window_keys(scope, kind, identities[kind], window, now)))
+    return limits
+
+
+def hit(scope, identities, now=None):
+    """
+    Counts one request against the limits of a scope, unless it is over one.
+
+    :param scope: The key of the limits in ``settings.THROTTLE_RATES``, e.g. ``login``.
+    :param identities: A dict of identity kind (``ip`` or ``username``) to value;
+        empty values are not limited.
+    :param now: The current Unix time, for tests.
+    :return: The seconds to wait before retrying if the request is over a
+        limit (and was not counted), otherwise None.
+    """
+    now = time.time() if now is None else now
+    limits = _limits(scope, identities, now)
+    if not limits:
+        return None
+
+    previous_keys = [previous for *_, (previous, _) in limits]
+    try:
+        counts = cache.get_many(previous_keys)
+        counts.update({current: _incr(current, 2 * window) for _, _, window, (_, current) in limits})
+        counters = None
+    except Exception:
+        counts = local_counters.get_many(previous_keys)
+        counts.update({current: local_counters.incr(current, 2 * window) for _, _, window, (_, current) in limits})
+        counters = local_counters
+
+    for kind, requests, window, (previous, current) in limits:
+        elapsed = (now % window) / window
+        if counts.get(previous, 0) * (1 - elapsed) + counts[current] > requests:
+            _decr(limits, counters)
+            THROTTLED.inc(scope=scope, key=kind)
+            return max(1, math.ceil(window * (1 - elapsed)))
+    return None
+
+
+def _decr(limits, counters=None):
+    for _, _, window, (_, current) in limits:
+        if counters is None:
+            try:
+                cache.decr(current)
+                continue
+            except ValueError:
+                # the window expired meanwhile
+                continue
+            except Exception:
+                counters = local_counters
+        counters.incr(current, 2 * window, delta=-1)
+
+
+def refund(scope, identities, kinds, now):
+    """
+    Takes back one request counted by ``hit``, e.g. for a successful login.
+
+    :param scope: The key of the limits in ``settings.THROTTLE_RATES``.
+    :param identities: The identities the request was counted for.
+    :param kinds: The identity kinds to take the request back from, e.g. ``('username',)``.
+    :param now: The Unix time given to ``hit``, so the same window is decremented.
+    """
+    _decr(_limits(scope, identities, now, kinds))
+
+
+def client_ip(request):
+    """
+    Returns the client IP of a request, from ``settings.THROTTLE_IP_HEADER``
+    when the app runs behind a proxy that sets it.
+
+    :param request: The HTTP request.
+    :return: The IP address, or an empty string.
+    """
+    if settings.THROTTLE_IP_HEADER and request.META.get(settings.THROTTLE_IP_HEADER):
+        return request.META[settings.THROTTLE_IP_HEADER].split(',')[0].strip()
+    return request.META.get('REMOTE_ADDR', '')
+
+
+class ThrottleMixin:
+    """
+    Throttles POST requests of a form view per client IP and submitted username.
+
+    Views set ``throttle_scope`` to a key of ``settings.THROTTLE_RATES``;
+    throttled requests get ``throttle_template_name`` rendered with an empty
+    ``throttle_form_class`` form and status 429. Views call
+    ``throttle_succeeded`` after a successful attempt to take it back from the
+    ``throttle_failures_only`` limits.
+    """
+    throttle_scope = None
+    throttle_template_name = None
+    throttle_form_class = None
+    # identity kinds whose limits count only failed attempts
+    throttle_failures_only = ()
+    _throttle_hit = None
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method == 'POST' and settings.THROTTLE_ENABLED:
+            identities = {
+                'ip': client_ip(request),
+                'username': request.POST.get('username', '').strip().lower(),
+            }
+            now = time.time()
+            retry_after = hit(self.throttle_scope, identities, now)
+            self._throttle_hit = (identities, now)
+            if retry_after is not None:
+                response = render(request, self.throttle_template_name, {
+                    'form': self.throttle_form_class(),
+                    'throttle_message': f'Too many attempts. Please try again in {retry_after} seconds.',
+                }, status=429)
+                response['Retry-After'] = str(retry_after)
+                return response
+        return super().dispatch(request, *args, **kwargs)
+
+    def throttle_succeeded(self):
+        """
+        Takes the current request back from the ``throttle_failures_only`` limits.
+        """
+        if self._throttle_hit is not None and self.throttle_failures_only:
+            identities, now = self._throttle_hit
+            refund(self.throttle_scope, identities, self.throttle_failures_only, now)
@@ -1,21 +1,23 @@
+from django.conf import settings
 from django.urls import path
 from django.views.generic.base import TemplateView
 
+from . import async_views, views
 from .views import (
-    HomePageView,
     CreateUserView,
+    UsernameAvailabilityView,
     LoginView,
     AddProductView,
     OngoingSaleView,
-    CategoryProductView,
+    InventoryView,
+    ImportProductsView,
     BasketView,
     EditBasketView,
     OrderHistoryView,
     OrderHistoryDetailView,
-    ProductDetailView,
     SellerOrderView,
     SellerOrderDetailView,
-    ProductSearchView,
+    SellerAnalyticsView,
     ProfileView,
     LogoutView,
     ProfileUpdateView,
@@ -25,24 +27,31 @@ from .views import (
 
 app_name = 'localfood_app'
 
+# The read-heavy catalog views have async versions for the ASGI profile.
+catalog_views = async_views if settings.ASGI_PROFILE else views
+
 
 urlpatterns = [
     path('', TemplateView.as_view(template_name="localfood_app/welcome.html"), name='welcome'),
-    path('home/', HomePageView.as_view(), name='home'),
+    path('home/', catalog_views.HomePageView.as_view(), name='home'),
     # path('sales/', SalesPageView.as_view(), name='sales'),
     path('add_product/', AddProductView.as_view(), name='add_product'),
     path('signup/', CreateUserView.as_view(), name='signup'),
+    path('signup/username-available/', UsernameAvailabilityView.as_view(), name='username_available'),
     path('login/', LoginView.as_view(), name='login'),
     path('ongoing_sale/', OngoingSaleView.as_view(), name='ongoing_sale'),
-    path('category/<slug:slug>/', CategoryProductView.as_view(), name='category'),
+    path('ongoing_sale/inventory/', InventoryView.as_view(), name='inventory'),
+    path('ongoing_sale/import/', ImportProductsView.as_view(), name='import_products'),
+    path('category/<slug:slug>/', catalog_views.CategoryProductView.as_view(), name='category'),
     path('basket/', BasketView.as_view(), name='basket'),
     path('basket/edit/<int:order_product_id>/', EditBasketView.as_view(), name='edit_basket'),
     path('order_history/', OrderHistoryView.as_view(), name='order_history'),
     path('order_history/<int:order_id>/', OrderHistoryDetailView.as_view(), name='order_history_detail'),
-    path('product_detail/<int:product_id>/', ProductDetailView.as_view(), name='product_detail'),
+    path('product_detail/<int:product_id>/', catalog_views.ProductDetailView.as_view(), name='product_detail'),
     path('seller_orders/', SellerOrderView.as_view(), name='seller_order'),
     path('seller_order_detail/<int:order_id>/', SellerOrderDetailView.as_view(), name='seller_order_detail'),
-    path('search/', ProductSearchView.as_view(), name='search'),
+    path('seller_analytics/', SellerAnalyticsView.as_view(), name='seller_analytics'),
+    path('search/', catalog_views.ProductSearchView.as_view(), name='search'),
     path('profile/', ProfileView.as_view(), name='profile'),
     path('logout/', LogoutView.as_view(), name='logout'),
     path('profile/edit/', ProfileUpdateView.as_view(), name='profile_edit'),
@@ -50,3 +59,9 @@ urlpatterns = [
 
 ]
 
+# Event streams hold their connection open, which only the ASGI profile can afford.
+if settings.ASGI_PROFILE:
+    urlpatterns += [
+        path('seller_orders/events/', async_views.SellerOrderEventsView.as_view(), name='seller_order_events'),
+        path('product_stock/events/', async_views.ProductStockEventsView.as_view(), name='product_stock_events'),
+    ]
@@ -0,0 +1,143 @@
+"""
+Username availability checks backed by a Bloom filter.
+
+Every process keeps a Bloom filter of the existing usernames, built lazily by
+the first check. A username the filter has never seen is free without asking
+the database; only possible matches (taken, or a false positive at roughly
+``USERNAME_FILTER_ERROR_RATE``) are checked with an indexed ``exists()`` query.
+
+Users created or renamed by this process are added right away. Users created
+by other processes are picked up every ``USERNAME_FILTER_REFRESH_SECONDS`` by
+loading the rows above the highest ID seen less ``USERNAME_FILTER_RESCAN_IDS``,
+so a user whose transaction committed after one with a higher ID is still
+found. Renames in other processes are only seen when the filter is rebuilt, so
+the filter only answers the live check of the sign-up form; the form's own
+validation always asks the database, and the unique constraint on the column
+rejects a name taken meanwhile.
+"""
+import hashlib
+import math
+import threading
+import time
+
+from django.conf import settings
+
+from .metrics import record_cache_access
+from .models import User
+
+
+class BloomFilter:
+    """
+    A fixed-size Bloom filter of strings.
+
+    :param capacity: The number of items the filter is sized for.
+    :param error_rate: The false positive rate at full capacity.
+    """
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return [(first + number * second) % self.size for number in range(self.hash_count)]
+
+    def add(self, item):
+        positions = self._positions(item)
+        if self._has(positions):
+            return
+        for position in positions:
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def _has(self, positions):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in positions)
+
+    def __contains__(self, item):
+        return self._has(self._positions(item))
+
+
+class UsernameIndex:
+    """
+    The process-wide Bloom filter of usernames and the highest user ID in it.
+    """
+    def __init__(self):
+        self._filter = None
+        self._last_id = 0
+        self._refreshed_at = 0.0
+        self._lock = threading.Lock()
+
+    def might_exist(self, username):
+        """
+        Returns False if the username is certainly free.
+
+        :param username: The username.
+        :return: True if the username may be taken.
+        """
+        with self._lock:
+            if self._filter is None or time.monotonic() - self._refreshed_at > settings.USERNAME_FILTER_REFRESH_SECONDS:
+                self._refresh()
+            return username in self._filter
+
+    def add(self, username):
+        """
+        Adds the username of a new or renamed user; ignored until the filter is
+        built.
+
+        :param username: The username.
+        """
+        with self._lock:
+            if self._filter is not None:
+                self._filter.add(username)
+
+    def reset(self):
+        """
+        Drops the filter; the next check builds it again.
+        """
+        with self._lock:
+            self._filter = None
+
+    def _refresh(self):
+        if self._filter is None:
+            self._last_id = 0
+            start = 0
+        else:
+            # IDs are taken in order but committed in any order; read the
+            # latest ones again for users that became visible late
+            start = max(self._last_id - settings.USERNAME_FILTER_RESCAN_IDS, 0)
+        new_users = User.objects.filter(pk__gt=start).order_by('pk').values_list('pk', 'username')
+        if self._filter is None:
+            total = User.objects.count()
+            self._filter = BloomFilter(max(total * 2, settings.USERNAME_FILTER_MIN_CAPACITY),
+                                       settings.USERNAME_FILTER_ERROR_RATE)
+        for user_id, username in new_users.iterator(chunk_size=10000):
+            self._filter.add(username)
+            self._last_id = max(self._last_id, user_id)
+        if self._filter.count > self._filter.capacity:
+            # past its capacity the error rate grows quickly; rebuild it larger
+            self._filter = None
+            self._refresh()
+            return
+        self._refreshed_at = time.monotonic()
+
+
+index = UsernameIndex()
+
+
+def is_username_taken(username):
+    """
+    Returns whether a username is taken, querying the database only when the
+    Bloom filter cannot rule it out. For hints only: a final check must ask the
+    database (``validators.validate_username_unique``).
+
+    :param username: The username.
+    :return: True if a user with this username exists.
+    """
+    if not index.might_exist(username):
+        record_cache_access('username_filter', hits=1)
+        return False
+    record_cache_access('username_filter', hits=0, misses=1)
+    return User.objects.filter(username=username).exists()
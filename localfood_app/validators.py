@@ -5,5 +5,6 @@ User = get_user_model()
 
 
 def validate_username_unique(value):
-    if User.objects.filter(username=value):
+    # the database, not the username filter: this check decides the sign-up
+    if User.objects.filter(username=value).exists():
         raise ValidationError('Taka nazwa użytkownika jest już w użyciu')
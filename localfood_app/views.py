@@ -1,22 +1,42 @@
-from django.contrib.auth import authenticate, login, logout, update_session_auth_hash
+from django.conf import settings
+from django.contrib import messages
+from django.contrib.auth import login, logout, update_session_auth_hash
 from django.contrib.auth.forms import PasswordChangeForm
 from django.contrib.auth.views import PasswordChangeView
 from django.core.paginator import Paginator
-from django.http import HttpResponse, HttpResponseBadRequest
+from django.db import IntegrityError, transaction
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, JsonResponse
 from django.shortcuts import render, redirect, get_object_or_404
 from django.urls.base import reverse_lazy
 from django.views import View
 from django.views.generic.edit import UpdateView
 
-from .models import Product, User, ProductImage, Order, OrderProduct
-from .form import UserCreateForm, AddProductForm, LoginForm, ProfileForm
+from . import (analytics, catalog, conditional, inventory, metrics, product_cache, product_import, recommendations,
+               usernames)
+from .conditional import ConditionalGetMixin
+from .throttle import ThrottleMixin
+from .models import Product, User, ProductImage, Order, OrderProduct, OutOfStock
+from .form import (UserCreateForm, AddProductForm, InventoryFormSet, LoginForm, ProductImportUploadForm, ProfileForm,
+                   SalesRangeForm)
+from .query_budget import query_budget
 from django.contrib.auth.mixins import LoginRequiredMixin
 
 
-class HomePageView(LoginRequiredMixin, View):
+@query_budget('localfood_app:home', 7)
+class HomePageView(LoginRequiredMixin, ConditionalGetMixin, View):
     """
     View for displaying the home page with a list of products.
     """
+    def get_validators(self, request):
+        """
+        Returns the ETag and Last-Modified of the home page without rendering it.
+
+        :param request: The HTTP request object.
+        :return: An (etag, last_modified) tuple.
+        """
+        products = catalog.for_request(catalog.recent_products(), request)
+        return conditional.listing_validators(request, products)
+
     def get(self, request):
         """
         Handles GET requests to display the home page with a paginated list of products.
@@ -24,11 +44,10 @@ class HomePageView(LoginRequiredMixin, View):
         :param request: The HTTP request object.
         :return: Rendered home page with a list of products.
         """
-        paginator = Paginator(Product.objects.all().order_by('-created_at'), 10)
-        page = request.GET.get('page')
-        products = paginator.get_page(page)
+        products = catalog.listing_page(catalog.for_request(catalog.recent_products(), request), request, 10)
         ctx = {
-            'products': products
+            'products': products,
+            **catalog.filter_context(request),
         }
         return render(request, 'localfood_app/dashboard.html', ctx)
 
@@ -45,11 +64,15 @@ class HomePageView(LoginRequiredMixin, View):
         return redirect(request.META.get('HTTP_REFERER'))
 
 
-class CreateUserView(View):
+class CreateUserView(ThrottleMixin, View):
     """
     View for handling user
     istration.
     """
+    throttle_scope = 'signup'
+    throttle_template_name = 'localfood_app/signup.html'
+    throttle_form_class = UserCreateForm
+
     def get(self, request):
         """
        Handles GET requests to display the user registration form.
@@ -71,13 +94,19 @@ class CreateUserView(View):
         form = UserCreateForm(request.POST)
         if form.is_valid():
             account_type = form.cleaned_data['account_type']
-            user = User.objects.create_user(
-                username=form.cleaned_data['username'],
-                email=form.cleaned_data['email'],
-                password=form.cleaned_data['password1'],
-                first_name=form.cleaned_data['first_name'],
-                last_name=form.cleaned_data['last_name'],
-            )
+            try:
+                with transaction.atomic():
+                    user = User.objects.create_user(
+                        username=form.cleaned_data['username'],
+                        email=form.cleaned_data['email'],
+                        password=form.cleaned_data['password1'],
+                        first_name=form.cleaned_data['first_name'],
+                        last_name=form.cleaned_data['last_name'],
+                    )
+            except IntegrityError:
+                # taken by a sign-up the username filter has not seen yet
+                form.add_error('username', 'Taka nazwa użytkownika jest już w użyciu')
+                return render(request, 'localfood_app/signup.html', {'form': form})
 
             if account_type == 'business':
                 user.is_seller = True
@@ -91,10 +120,31 @@ class CreateUserView(View):
             return render(request, 'localfood_app/signup.html', {'form': form})
 
 
-class LoginView(View):
+class UsernameAvailabilityView(View):
+    """
+    View telling the sign-up form whether a username is still free.
+    """
+    def get(self, request):
+        """
+        Handles GET requests with the username to check in the ``username`` parameter.
+
+        :param request: The HTTP request object.
+        :return: JSON with the username and whether it is available.
+        """
+        username = request.GET.get('username', '').strip()
+        available = bool(username) and not usernames.is_username_taken(username)
+        return JsonResponse({'username': username, 'available': available})
+
+
+class LoginView(ThrottleMixin, View):
     """
     View for handling user login.
     """
+    throttle_scope = 'login'
+    throttle_template_name = 'localfood_app/login.html'
+    throttle_form_class = LoginForm
+    throttle_failures_only = ('username',)
+
     def get(self, request):
         """
         Handles GET requests to display the login form.
@@ -115,13 +165,9 @@ class LoginView(View):
         """
         form = LoginForm(request.POST)
         if form.is_valid():
-            user = authenticate(
-                username=form.cleaned_data['username'],
-                password=form.cleaned_data['password'],
-            )
-            if user:
-                login(request, user)
-                return redirect("localfood_app:home")
+            login(request, form.get_user())
+            self.throttle_succeeded()
+            return redirect("localfood_app:home")
 
         return render(request, 'localfood_app/login.html', {'form': form})
 
@@ -167,6 +213,7 @@ class AddProductView(View):
         return render(request, 'localfood_app/add_product.html', {'form': form})
 
 
+@query_budget('localfood_app:ongoing_sale', 4)
 class OngoingSaleView(View):
     """
     View for displaying a seller's ongoing sales.
@@ -178,17 +225,117 @@ class OngoingSaleView(View):
         :param request: The HTTP request object.
         :return: Rendered ongoing sales page with a list of products.
         """
-        paginator = Paginator(Product.objects.filter(seller=request.user).
-                              order_by('-created_at'), 10)
+        paginator = Paginator(catalog.with_listing_relations(
+            Product.objects.filter(seller=request.user).order_by('-created_at')), 10)
         page = request.GET.get('page')
         products = paginator.get_page(page)
         return render(request, 'localfood_app/ongoing_sale.html', {'products': products})
 
 
-class CategoryProductView(View):
+@query_budget('localfood_app:inventory', 4)
+class InventoryView(LoginRequiredMixin, View):
+    """
+    View for editing the prices and quantities of a page of the seller's products at once.
+    """
+    def get(self, request):
+        """
+        Handles GET requests to display a page of the seller's products with their price and quantity.
+
+        :param request: The HTTP request object.
+        :return: Rendered inventory page with the formset.
+        """
+        products = self.get_page(request)
+        formset = InventoryFormSet(initial=[
+            {'product': product.pk, 'price': product.price, 'quantity': product.quantity} for product in products
+        ])
+        return self.render(request, products, formset, {product.pk: product for product in products})
+
+    def post(self, request):
+        """
+        Handles POST requests to save the changed prices and quantities in one transaction.
+
+        :param request: The HTTP request object.
+        :return: Redirects back to the same page if the formset is valid,
+         otherwise re-renders the page with errors.
+        """
+        formset = InventoryFormSet(request.POST)
+        if formset.is_valid():
+            changes = {}
+            for form in formset:
+                changed = {name: form.cleaned_data[name] for name in form.changed_data if name in inventory.FIELDS}
+                if changed:
+                    changes[form.cleaned_data['product']] = changed
+            updated = inventory.update_products(request.user, changes)
+            messages.success(request, f'Updated {updated} product{"" if updated == 1 else "s"}.')
+            return redirect(request.get_full_path())
+        product_ids = [form.cleaned_data.get('product') for form in formset if hasattr(form, 'cleaned_data')]
+        products = Product.objects.filter(seller=request.user, pk__in=[pk for pk in product_ids if pk]).only(
+            'pk', 'name', 'price', 'quantity').in_bulk()
+        return self.render(request, self.get_page(request), formset, products, status=400)
+
+    def get_page(self, request):
+        return Paginator(Product.objects.filter(seller=request.user).only('pk', 'name', 'price', 'quantity')
+                         .order_by('-created_at', '-pk'), InventoryFormSet.max_num).get_page(request.GET.get('page'))
+
+    def render(self, request, products, formset, products_by_id, status=200):
+        products_by_id = {str(pk): product for pk, product in products_by_id.items()}
+        rows = [(form, products_by_id.get(str(form['product'].value()))) for form in formset]
+        return render(request, 'localfood_app/inventory.html', {
+            'products': products, 'formset': formset, 'rows': rows,
+        }, status=status)
+
+
+class ImportProductsView(LoginRequiredMixin, View):
+    """
+    View for importing the seller's products from an uploaded CSV or JSON Lines file.
+    """
+    def get(self, request):
+        """
+        Handles GET requests to display the upload form.
+
+        :param request: The HTTP request object.
+        :return: Rendered import page with the upload form.
+        """
+        return render(request, 'localfood_app/import_products.html', {'form': ProductImportUploadForm()})
+
+    def post(self, request):
+        """
+        Handles POST requests to import the uploaded file, row by row.
+
+        :param request: The HTTP request object.
+        :return: Rendered import page with the number of imported products and
+         the errors of the skipped rows, or with the form errors.
+        """
+        form = ProductImportUploadForm(request.POST, request.FILES)
+        result = None
+        if form.is_valid():
+            upload = form.cleaned_data['file']
+            try:
+                file_format = product_import.format_of(upload.name)
+            except ValueError as error:
+                form.add_error('file', str(error))
+            else:
+                result = product_import.import_products(request.user, product_import.read_rows(upload, file_format))
+        return render(request, 'localfood_app/import_products.html', {'form': form, 'result': result},
+                      status=200 if result else 400)
+
+
+@query_budget('localfood_app:category', 7)
+class CategoryProductView(ConditionalGetMixin, View):
     """
    View for displaying products in a specific category.
    """
+    def get_validators(self, request, slug):
+        """
+        Returns the ETag and Last-Modified of a category page without rendering it.
+
+        :param request: The HTTP request object.
+        :param slug: The slug of the category.
+        :return: An (etag, last_modified) tuple.
+        """
+        products = catalog.for_request(catalog.category_products(slug), request)
+        return conditional.listing_validators(request, products)
+
     def get(self, request, slug):
         """
         Handles GET requests to display products filtered by category.
@@ -197,11 +344,13 @@ class CategoryProductView(View):
         :param slug: The slug of the category.
         :return: Rendered category products page with a list of products.
         """
-        paginator = Paginator(Product.objects.filter(category__slug=slug).
-                              order_by('-created_at'), 10)
-        page = request.GET.get('page')
-        products = paginator.get_page(page)
-        return render(request, 'localfood_app/dashboard.html', {'products': products})
+        products = catalog.listing_page(catalog.for_request(catalog.category_products(slug), request), request, 10,
+                                        slug)
+        ctx = {
+            'products': products,
+            **catalog.filter_context(request, slug),
+        }
+        return render(request, 'localfood_app/dashboard.html', ctx)
 
     def post(self, request, slug):
         """
@@ -217,6 +366,7 @@ class CategoryProductView(View):
         return redirect(request.META.get('HTTP_REFERER'))
 
 
+@query_budget('localfood_app:basket', 7)
 class BasketView(View):
     """
     View for displaying the user's shopping basket.
@@ -237,17 +387,19 @@ class BasketView(View):
             return render(request, 'localfood_app/basket.html')
 
         if order:
-            order_products = OrderProduct.objects.filter(order=order)
-            paginator = Paginator(order_products.order_by('-created_at'), 20)
+            paginator = Paginator(OrderProduct.objects.filter(order=order).order_by('-created_at'), 20)
             page = request.GET.get('page')
             order_products = paginator.get_page(page)
+            product_cache.attach_products(order_products)
             total_price = sum(order_product.calculate_total_price()
                               for order_product in order_products)
 
             ctx = {
                 'order_products': order_products,
                 'total_price': total_price,
-                'order': order
+                'order': order,
+                'related_products': recommendations.basket_recommendations(
+                    order_product.product_id for order_product in order_products),
             }
             return render(request, 'localfood_app/basket.html', ctx)
 
@@ -274,26 +426,38 @@ class BasketView(View):
         payment_value = request.POST.get('payment')
 
         if not order_id or not payment_value:
+            metrics.CHECKOUTS.inc(outcome='invalid')
             return HttpResponseBadRequest("Order ID and payment value are required.")
 
         if not order_id.isdigit():
+            metrics.CHECKOUTS.inc(outcome='invalid')
             return HttpResponseBadRequest("Invalid order ID format.")
 
         order_id = int(order_id)
 
         if payment_value != 'paid':
+            metrics.CHECKOUTS.inc(outcome='invalid')
             return HttpResponseBadRequest("Invalid payment value.")
 
         try:
             order = Order.objects.get(id=order_id, buyer=request.user)
-            if not order.is_paid:
-                order.is_paid = True
-                order.save()
+            if order.mark_paid():
+                metrics.CHECKOUTS.inc(outcome='paid')
+            else:
+                metrics.CHECKOUTS.inc(outcome='already_paid')
             return redirect('localfood_app:home')
         except Order.DoesNotExist:
+            metrics.CHECKOUTS.inc(outcome='not_found')
+            return redirect('localfood_app:basket')
+        except OutOfStock as error:
+            metrics.CHECKOUTS.inc(outcome='out_of_stock')
+            names = ', '.join(Product.objects.filter(pk__in=error.product_ids).order_by('name')
+                              .values_list('name', flat=True))
+            messages.error(request, f'Not enough left of: {names}. Please change your basket.')
             return redirect('localfood_app:basket')
 
 
+@query_budget('localfood_app:edit_basket', 4)
 class EditBasketView(View):
     """
     View for editing items in the shopping basket.
@@ -307,6 +471,7 @@ class EditBasketView(View):
         :return: Rendered edit basket page with the selected product.
         """
         product = get_object_or_404(OrderProduct, id=order_product_id)
+        product_cache.attach_products([product])
         return render(request, 'localfood_app/edit_basket.html', {'product': product})
 
     def post(self, request, order_product_id):
@@ -345,6 +510,7 @@ class EditBasketView(View):
     #     return HttpResponse("Invalid request method or parameters", status=400)
 
 
+@query_budget('localfood_app:order_history', 3)
 class OrderHistoryView(View):
     """
     View for displaying the user's order history.
@@ -366,6 +532,7 @@ class OrderHistoryView(View):
         return render(request, 'localfood_app/order_history.html', ctx)
 
 
+@query_budget('localfood_app:order_history_detail', 5)
 class OrderHistoryDetailView(View):
     """
     View for displaying the details of a specific order in the user's order history.
@@ -378,9 +545,11 @@ class OrderHistoryDetailView(View):
         :param order_id: The ID of the order to display details for.
         :return: Rendered order detail page with the order products and total price.
         """
-        paginator = Paginator(OrderProduct.objects.filter(order_id=order_id, order__buyer = request.user), 10)
+        paginator = Paginator(
+            OrderProduct.objects.filter(order_id=order_id, order__buyer=request.user).order_by('pk'), 10)
         page = request.GET.get('page')
         order_products = paginator.get_page(page)
+        product_cache.attach_products(order_products)
         total_price = sum(order_product.calculate_total_price() for order_product in order_products)
         ctx = {
             'order_products': order_products,
@@ -390,10 +559,21 @@ class OrderHistoryDetailView(View):
         return render(request, 'localfood_app/order_history_detail.html', ctx)
 
 
-class ProductDetailView(View):
+@query_budget('localfood_app:product_detail', 7)
+class ProductDetailView(ConditionalGetMixin, View):
     """
     View for displaying the details of a specific product.
     """
+    def get_validators(self, request, product_id):
+        """
+        Returns the ETag and Last-Modified of a product page without rendering it.
+
+        :param request: The HTTP request object.
+        :param product_id: The ID of the product.
+        :return: An (etag, last_modified) tuple, or None if the product does not exist.
+        """
+        return conditional.product_validators(request, product_id)
+
     def get(self, request, product_id):
         """
         Handles GET requests to display the details of a specific product.
@@ -402,8 +582,13 @@ class ProductDetailView(View):
         :param product_id: The ID of the product to display.
         :return: Rendered product detail page.
         """
-        product = Product.objects.get(id=product_id)
-        return render(request, 'localfood_app/product_detail.html', {'product': product})
+        product = product_cache.get_product(product_id)
+        if product is None:
+            raise Http404('No product matches the given query.')
+        return render(request, 'localfood_app/product_detail.html', {
+            'product': product,
+            'related_products': recommendations.related_products(product.pk),
+        })
 
     def post(self, request, product_id):
         """
@@ -418,6 +603,7 @@ class ProductDetailView(View):
         return redirect('localfood_app:home')
 
 
+@query_budget('localfood_app:seller_order', 4)
 class SellerOrderView(View):
     """
     View for displaying orders for a specific seller.
@@ -431,18 +617,20 @@ class SellerOrderView(View):
         """
         seller = request.user
 
-        paginator = Paginator(OrderProduct.objects.filter(product__seller=seller), 10)
+        paginator = Paginator(OrderProduct.objects.filter(product__seller=seller).order_by('-created_at'), 10)
         page = request.GET.get('page')
         order_products = paginator.get_page(page)
-        orders = Order.objects.filter(orderproduct__in=order_products).distinct()
+        orders = Order.objects.filter(orderproduct__in=order_products).select_related('buyer').distinct()
 
         ctx = {
             'order_products': order_products,
-            'orders': orders
+            'orders': orders,
+            'order_events': settings.ASGI_PROFILE,
         }
         return render(request, 'localfood_app/seller_orders.html', ctx)
 
 
+@query_budget('localfood_app:seller_order_detail', 5)
 class SellerOrderDetailView(View):
     """
     View for displaying the details of a specific order for a seller.
@@ -455,9 +643,11 @@ class SellerOrderDetailView(View):
         :param order_id: The ID of the order to display details for.
         :return: Rendered seller order detail page with the order products and total price.
         """
-        paginator = Paginator(OrderProduct.objects.filter(order_id=order_id, product__seller=request.user), 10)
+        paginator = Paginator(
+            OrderProduct.objects.filter(order_id=order_id, product__seller=request.user).order_by('pk'), 10)
         page = request.GET.get('page')
         order_products = paginator.get_page(page)
+        product_cache.attach_products(order_products)
         total_price = sum(order_product.calculate_total_price() for order_product in order_products)
         ctx = {
             'order_products': order_products,
@@ -466,10 +656,47 @@ class SellerOrderDetailView(View):
 
         return render(request, 'localfood_app/seller_order_detail.html', ctx)
 
-class ProductSearchView(View):
+@query_budget('localfood_app:seller_analytics', 5)
+class SellerAnalyticsView(LoginRequiredMixin, View):
+    """
+    View for displaying a seller's sales over a range of days, from the daily rollups.
+    """
+    def get(self, request):
+        """
+        Handles GET requests to display the sales totals, the sales per day and the
+        best-selling products of the seller between two days.
+
+        :param request: The HTTP request object, optionally with ``start`` and ``end`` dates.
+        :return: Rendered seller analytics page; the last 30 days if the range is missing or invalid.
+        """
+        start, end = analytics.default_range()
+        form = SalesRangeForm(request.GET if request.GET else None, initial={'start': start, 'end': end})
+        if form.is_valid():
+            start, end = form.cleaned_data['start'], form.cleaned_data['end']
+        ctx = {
+            'form': form,
+            'start': start,
+            'end': end,
+            **analytics.seller_report(request.user, start, end),
+        }
+        return render(request, 'localfood_app/seller_analytics.html', ctx)
+
+
+@query_budget('localfood_app:search', 6)
+class ProductSearchView(ConditionalGetMixin, View):
     """
     View for handling product search functionality.
     """
+    def get_validators(self, request):
+        """
+        Returns the ETag and Last-Modified of a search results page without rendering it.
+
+        :param request: The HTTP request object containing the search query.
+        :return: An (etag, last_modified) tuple.
+        """
+        products = catalog.for_request(catalog.search_products(request.GET.get('q', '').strip()), request)
+        return conditional.listing_validators(request, products)
+
     def get(self, request):
         """
         Handles GET requests to search for products based on user input.
@@ -478,24 +705,19 @@ class ProductSearchView(View):
         :return: Rendered search results page with filtered products and pagination.
         """
         query = request.GET.get('q', '').strip()
-
-        if query:
-            queryset = Product.objects.filter(name__icontains=query)
-
-        else:
-            queryset = Product.objects.all()
-
-        paginator = Paginator(queryset, 10)
+        paginator = Paginator(catalog.for_request(catalog.search_products(query), request), 10)
         page = request.GET.get('page')
         products = paginator.get_page(page)
 
         ctx = {
             'products': products,
             'query': query,
+            **catalog.filter_context(request, with_counts=False),
         }
 
         return render(request, 'localfood_app/search_page.html', ctx)
 
+@query_budget('localfood_app:profile', 1)
 class ProfileView(View):
     """
     View for displaying and editing the user's profile.
@@ -579,3 +801,23 @@ class LogoutView(View):
         """
         logout(request)
         return redirect('localfood_app:home')
+
+
+class MetricsView(View):
+    """
+    View exposing the application metrics in the Prometheus text format to
+    the scraper; other clients get a 404.
+    """
+    def get(self, request):
+        """
+        Handles GET requests from the metrics scraper.
+
+        :param request: The HTTP request object.
+        :return: The metrics of all worker processes, summed.
+        """
+        if not metrics.is_scraper(request):
+            raise Http404
+        return HttpResponse(
+            metrics.render_prometheus_text(),
+            content_type='text/plain; version=0.0.4; charset=utf-8',
+        )
@@ -1,12 +1,69 @@
 import pytest
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
 from django.test import Client
 from django.core.files.uploadedfile import SimpleUploadedFile
-from io import BytesIO
+from io import BytesIO, StringIO
 from PIL import Image
 
+from localfood_app import events
+from localfood_app.usernames import index as username_index
+
 User = get_user_model()
 
+
+@pytest.fixture(scope='session')
+def django_db_modify_db_settings(django_db_modify_db_settings_parallel_suffix):
+    """
+    Adds a ``replica`` database next to ``default`` as a stand-in read replica.
+    Only tests asking for it with ``django_db(databases=[...])`` set it up.
+    """
+    from django.conf import settings
+    from django.db import connections
+
+    default = connections['default'].settings_dict
+    settings.DATABASES['replica'] = {
+        **default,
+        'NAME': f"{default['NAME']}_replica",
+        'TEST': {**default['TEST'], 'NAME': None, 'MIRROR': None},
+    }
+
+@pytest.fixture(autouse=True)
+def metrics_dir(settings, tmp_path):
+    """
+    Keeps the metrics files of each test in its own temporary directory.
+    """
+    settings.METRICS_DIR = str(tmp_path / 'metrics')
+    return tmp_path / 'metrics'
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    """
+    Starts every test with an empty cache.
+    """
+    cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def process_events(settings):
+    """
+    Delivers server-sent events within the test process, without sockets.
+    """
+    settings.EVENTS_BACKEND = 'process'
+    events.reset()
+    yield
+    events.reset()
+
+
+@pytest.fixture(autouse=True)
+def reset_username_index():
+    """
+    Rebuilds the username Bloom filter in every test, since the test database
+    is rolled back underneath it.
+    """
+    username_index.reset()
+
 @pytest.fixture
 def client():
     return Client()
@@ -45,4 +102,88 @@ def image_upload():
         name='test_image.jpg',
         content=image.read(),
         content_type='image/jpeg'
-    )
\ No newline at end of file
+    )
+
+QUERY_BUDGET_REPORT = {}
+
+
+@pytest.fixture
+def large_catalog(db):
+    """
+    Builds a catalog big enough to expose N+1 queries: many products with
+    several images, a full basket and paid orders with many lines.
+
+    Returns a dict with the users and the request (path and user) to use for
+    every budgeted URL name.
+    """
+    from localfood_app.models import Category, Product, ProductImage, Order, OrderProduct
+
+    seller = User.objects.create_user(username='budgetseller', password='password123', is_seller=True)
+    buyer = User.objects.create_user(username='budgetbuyer', password='password123', is_buyer=True)
+    categories = [
+        Category.objects.create(name=f'Category {number}', slug=f'category-{number}')
+        for number in range(5)
+    ]
+    products = Product.objects.bulk_create([
+        Product(
+            name=f'Product {number}',
+            description='Fresh from the farm',
+            price=5 + number,
+            quantity=100,
+            category=categories[number % len(categories)],
+            seller=seller,
+        )
+        for number in range(40)
+    ])
+    ProductImage.objects.bulk_create([
+        ProductImage(product=product, file_path=f'product_image/{product.pk}-{number}.jpg')
+        for product in products
+        for number in range(3)
+    ])
+
+    basket = Order.objects.create(buyer=buyer)
+    OrderProduct.objects.bulk_create([
+        OrderProduct(order=basket, product=product, quantity=2) for product in products[:15]
+    ])
+    paid_orders = [Order.objects.create(buyer=buyer, is_paid=True) for _ in range(12)]
+    OrderProduct.objects.bulk_create([
+        OrderProduct(order=order, product=product, quantity=1)
+        for order in paid_orders
+        for product in products[:10]
+    ])
+    basket_line = basket.orderproduct_set.first()
+    call_command('build_recommendations', stdout=StringIO())
+    call_command('backfill_sales_rollups', stdout=StringIO())
+
+    return {
+        'seller': seller,
+        'buyer': buyer,
+        'requests': {
+            'localfood_app:home': ('/home/', buyer),
+            'localfood_app:category': (f'/category/{categories[0].slug}/', buyer),
+            'localfood_app:search': ('/search/?q=Product', buyer),
+            'localfood_app:product_detail': (f'/product_detail/{products[0].pk}/', buyer),
+            'localfood_app:basket': ('/basket/', buyer),
+            'localfood_app:edit_basket': (f'/basket/edit/{basket_line.pk}/', buyer),
+            'localfood_app:order_history': ('/order_history/', buyer),
+            'localfood_app:order_history_detail': (f'/order_history/{paid_orders[0].pk}/', buyer),
+            'localfood_app:ongoing_sale': ('/ongoing_sale/', seller),
+            'localfood_app:inventory': ('/ongoing_sale/inventory/', seller),
+            'localfood_app:seller_order': ('/seller_orders/', seller),
+            'localfood_app:seller_order_detail': (f'/seller_order_detail/{paid_orders[0].pk}/', seller),
+            'localfood_app:seller_analytics': ('/seller_analytics/', seller),
+            'localfood_app:profile': ('/profile/', buyer),
+        },
+    }
+
+
+def pytest_terminal_summary(terminalreporter):
+    """
+    Prints the actual query count of every budgeted view next to its budget.
+    """
+    if not QUERY_BUDGET_REPORT:
+        return
+    terminalreporter.write_sep('-', 'query budgets')
+    for url_name, (actual, budget) in sorted(QUERY_BUDGET_REPORT.items()):
+        status = 'OVER' if actual > budget else 'ok'
+        terminalreporter.write_line(f'{url_name:<40} {actual:>3} / {budget:<3} {status}')
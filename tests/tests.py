@@ -1,12 +1,42 @@
-from io import BytesIO
+import asyncio
+import json
+import math
+import os
+import socket
+import tempfile
+import threading
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from io import BytesIO, StringIO
 from unittest.mock import patch
 import pytest
 from PIL import Image
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth.hashers import check_password
+from django.contrib.auth.models import AnonymousUser
+from django.http import Http404, HttpResponse
+from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.test import AsyncRequestFactory, Client
 from django.urls import reverse
+from django.utils import timezone
+from localfood_app import async_views, page_cache, product_cache, usernames, views  # noqa: F401 (views registers the query budgets)
+from localfood_app.backends import CachedModelBackend, user_cache_key
 from localfood_app.form import UserCreateForm, AddProductForm
-from localfood_app.models import Category, Product, Order, OrderProduct
-from conftest import client, user_data, user, User, image_upload
+from localfood_app.metrics import MmapValues, render_prometheus_text
+from localfood_app.middleware import ReplicaPinningMiddleware
+from localfood_app.models import (
+    Address, Category, OutOfStock, Product, ProductImage, Order, OrderProduct, ProductDailySales,
+    ProvinceCategoryCount, RelatedProduct, SellerDailySales,
+)
+from localfood_app.query_budget import QUERY_BUDGETS
+from localfood_app.routers import reset_primary_pin
+from localfood_app.slow_queries import recorder as slow_query_recorder
+from localfood_app import analytics, events, geo, metrics, popularity, provinces, recommendations, throttle
+from conftest import client, user_data, user, User, image_upload, large_catalog, QUERY_BUDGET_REPORT
 
 
 
@@ -345,3 +375,1378 @@ def test_seller_order_detail_view(client, user):
     assert 'order_products' in response.context
     assert list(response.context['order_products']) == [order_product]
     assert response.context['total_price'] == order_product.calculate_total_price()
+
+
+@pytest.mark.django_db(databases=['default', 'replica'])
+def test_replica_router_reads_catalog_from_replica(settings):
+    """
+    Test that catalog reads go to the replica while nothing pins the primary.
+    """
+    settings.DATABASE_REPLICAS = ['replica']
+    category = Category.objects.using('replica').create(name='Replica Category', slug='replica-category')
+    Product.objects.using('replica').create(
+        name='Replica Product',
+        description='Only on the replica',
+        price=10.00,
+        quantity=5,
+        category_id=category.id,
+    )
+    reset_primary_pin()
+
+    assert Product.objects.filter(name='Replica Product').exists()
+    assert not Product.objects.using('default').filter(name='Replica Product').exists()
+
+
+@pytest.mark.django_db(databases=['default', 'replica'])
+def test_replica_router_reads_own_writes_from_primary(settings):
+    """
+    Test that a write pins the following reads of the same request to the primary.
+    """
+    settings.DATABASE_REPLICAS = ['replica']
+    reset_primary_pin()
+
+    Category.objects.create(name='Primary Category', slug='primary-category')
+
+    assert Category.objects.filter(slug='primary-category').exists()
+
+
+@pytest.mark.django_db(databases=['default', 'replica'])
+def test_replica_pinning_cookie_keeps_client_on_primary(client, user, settings):
+    """
+    Test that after a POST the client keeps reading from the primary database.
+    """
+    settings.DATABASE_REPLICAS = ['replica']
+    category = Category.objects.create(name='Test Category', slug='test-category')
+    product = Product.objects.create(
+        name='Test Product',
+        description='Test Description',
+        price=10.00,
+        quantity=5,
+        category=category,
+        seller=user
+    )
+
+    response = client.post(reverse('localfood_app:product_detail', args=[product.id]))
+    assert response.status_code == 302
+    assert ReplicaPinningMiddleware.cookie_name in response.cookies
+
+    response = client.get(reverse('localfood_app:product_detail', args=[product.id]))
+    assert response.status_code == 200
+    assert response.context['product'] == product
+
+
+def call_async_view(view_class, path, user, **kwargs):
+    """
+    Calls an async view directly, the way Django does under ASGI.
+    """
+    request = AsyncRequestFactory().get(path)
+    request.user = user
+
+    async def auser():
+        return user
+
+    request.auser = auser
+    return async_to_sync(view_class.as_view())(request, **kwargs)
+
+
+@pytest.mark.django_db
+def test_async_home_page_view(user):
+    """
+    Test that the async home page lists products using the async ORM.
+    """
+    category = Category.objects.create(name='Test Category', slug='test-category')
+    for number in range(12):
+        Product.objects.create(
+            name=f'Product {number}',
+            description='Test Description',
+            price=10.00,
+            quantity=5,
+            category=category,
+            seller=user
+        )
+
+    response = call_async_view(async_views.HomePageView, '/home/?page=2', user)
+
+    assert response.status_code == 200
+    assert 'Product 1' in response.content.decode()
+    assert 'Product 11' not in response.content.decode()
+    assert 'Page 2 of 2' in response.content.decode()
+
+
+def test_async_home_page_view_requires_login():
+    """
+    Test that the async home page redirects anonymous users to the login page.
+    """
+    response = call_async_view(async_views.HomePageView, '/home/', AnonymousUser())
+
+    assert response.status_code == 302
+    assert response.url.startswith('/login/')
+
+
+@pytest.mark.django_db
+def test_async_product_detail_view(user):
+    """
+    Test that the async product detail view renders the product and 404s for missing ones.
+    """
+    category = Category.objects.create(name='Test Category', slug='test-category')
+    product = Product.objects.create(
+        name='Test Product',
+        description='Test Description',
+        price=10.00,
+        quantity=5,
+        category=category,
+        seller=user
+    )
+
+    response = call_async_view(async_views.ProductDetailView, '/', user, product_id=product.id)
+    assert response.status_code == 200
+    assert 'Test Product' in response.content.decode()
+
+    with pytest.raises(Http404):
+        call_async_view(async_views.ProductDetailView, '/', user, product_id=product.id + 1)
+
+
+@pytest.mark.django_db
+def test_request_profiling_server_timing_header(client, user, settings):
+    """
+    Test that profiling adds a Server-Timing header with SQL and template timings.
+    """
+    settings.REQUEST_PROFILING = True
+    Category.objects.create(name='Test Category', slug='test-category')
+
+    response = client.get(reverse('localfood_app:category', args=['test-category']))
+
+    timing = response['Server-Timing']
+    assert timing.startswith('total;dur=')
+    assert 'sql;dur=' in timing
+    assert 'tpl;dur=' in timing
+    assert '"0 queries"' not in timing
+
+
+@pytest.mark.django_db
+def test_request_profiling_dumps_slow_requests(client, user, settings, tmp_path):
+    """
+    Test that sampled requests over the slow threshold leave a cProfile dump.
+    """
+    settings.REQUEST_PROFILING = True
+    settings.REQUEST_PROFILING_SAMPLE_RATE = 1
+    settings.REQUEST_PROFILING_SLOW_MS = 0
+    settings.REQUEST_PROFILING_DIR = str(tmp_path)
+
+    client.get(reverse('localfood_app:search'))
+
+    dumps = list(tmp_path.glob('*-localfood_app-search-*.prof'))
+    assert len(dumps) == 1
+
+
+def test_request_profiling_disabled_by_default(client):
+    """
+    Test that without REQUEST_PROFILING no Server-Timing header is sent.
+    """
+    response = client.get(reverse('localfood_app:welcome'))
+
+    assert 'Server-Timing' not in response
+
+
+@pytest.mark.django_db
+def test_metrics_endpoint_counts_requests_per_url_name(client, settings):
+    """
+    Test that requests are counted and timed per URL name and served at /metrics
+    to the scraper only.
+    """
+    settings.METRICS_TOKEN = 'scraper-token'
+    client.get(reverse('localfood_app:welcome'))
+    client.get(reverse('localfood_app:welcome'))
+    assert client.get('/metrics').status_code == 404
+    assert client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code == 404
+    response = client.get('/metrics', HTTP_AUTHORIZATION='Bearer scraper-token')
+
+    assert response.status_code == 200
+    text = response.content.decode()
+    assert 'localfood_http_requests_total{method="GET",status="200",view="localfood_app:welcome"} 2.0' in text
+    assert 'localfood_http_request_duration_seconds_bucket{view="localfood_app:welcome",le="+Inf"} 2.0' in text
+    assert 'localfood_http_request_duration_seconds_count{view="localfood_app:welcome"} 2.0' in text
+
+    settings.METRICS_TOKEN, settings.METRICS_ALLOWED_IPS = '', ['127.0.0.1']
+    assert client.get('/metrics').status_code == 200
+
+
+def test_metrics_are_summed_across_process_files(metrics_dir):
+    """
+    Test that values written to separate per-process files are aggregated, and
+    that the values of an exited process are kept in the archive.
+    """
+    metrics_dir.mkdir()
+    first = MmapValues(str(metrics_dir / '1.db'))
+    second = MmapValues(str(metrics_dir / '2.db'))
+    key = '["localfood_checkout_total", [["outcome", "paid"]]]'
+    first.inc(key, 2)
+    second.inc(key, 3)
+
+    assert 'localfood_checkout_total{outcome="paid"} 5.0' in render_prometheus_text()
+
+    first.close()
+    metrics.mark_process_dead(1)
+    metrics.mark_process_dead(1)
+    assert sorted(path.name for path in metrics_dir.glob('*.db')) == ['2.db', 'archive.db']
+    assert 'localfood_checkout_total{outcome="paid"} 5.0' in render_prometheus_text()
+
+
+@pytest.mark.django_db
+def test_metrics_count_checkout_outcomes(client, user):
+    """
+    Test that checkout outcomes are counted.
+    """
+    client.post(reverse('localfood_app:basket'), {'order_id': 'abc', 'payment': 'paid'})
+
+    assert 'localfood_checkout_total{outcome="invalid"} 1.0' in render_prometheus_text()
+
+
+@pytest.mark.django_db
+def test_slow_query_log_records_view_template_and_plan(client, user, settings, tmp_path):
+    """
+    Test that slow statements are written with their URL name, template and EXPLAIN plan,
+    and that the report command summarizes them.
+    """
+    settings.SLOW_QUERY_MS = 0.000001
+    settings.SLOW_QUERY_LOG_DIR = str(tmp_path)
+    category = Category.objects.create(name='Test Category', slug='test-category')
+    Product.objects.create(
+        name='Test Product',
+        description='Test Description',
+        price=10.00,
+        quantity=5,
+        category=category,
+        seller=user
+    )
+
+    client.get(reverse('localfood_app:category', args=['test-category']))
+    slow_query_recorder.flush()
+
+    records = [json.loads(line) for path in tmp_path.glob('slow-queries-*.jsonl') for line in path.open()]
+    assert records
+    assert {record['url_name'] for record in records} == {'localfood_app:category'}
+    assert any(record['template'] == 'localfood_app/dashboard.html' for record in records)
+    assert any(record['plan'] for record in records)
+
+    out = StringIO()
+    call_command('slow_queries_report', limit=3, stdout=out)
+    assert out.getvalue().startswith('#1 total')
+    assert 'localfood_app:category' in out.getvalue()
+
+
+@pytest.mark.parametrize('url_name', sorted(QUERY_BUDGETS))
+def test_view_stays_within_query_budget(client, large_catalog, url_name):
+    """
+    Test that every budgeted view renders a large catalog within its query budget.
+    """
+    path, user = large_catalog['requests'][url_name]
+    budget = QUERY_BUDGETS[url_name]
+    client.force_login(user)
+
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(path)
+
+    QUERY_BUDGET_REPORT[url_name] = (len(queries), budget)
+    assert response.status_code == 200
+    assert len(queries) <= budget, '\n'.join(query['sql'] for query in queries)
+
+
+@pytest.mark.django_db
+def test_generate_dataset_is_deterministic():
+    """
+    Test that the dataset generator creates the requested rows and that the same seed
+    produces the same data on an empty database.
+    """
+    options = {
+        'buyers': 8, 'sellers': 3, 'categories': 4, 'products': 20, 'orders': 12,
+        'seed': 7, 'until': '2024-06-30', 'chunk_size': 5, 'workers': 1, 'stdout': StringIO(),
+    }
+
+    def snapshot():
+        return (
+            list(Product.objects.order_by('pk').values_list('pk', 'name', 'price', 'seller_id', 'created_at')),
+            list(OrderProduct.objects.order_by('pk').values_list('pk', 'order_id', 'product_id', 'quantity')),
+        )
+
+    with patch('localfood_app.management.commands.generate_dataset.Command.ensure_placeholder_image'):
+        call_command('generate_dataset', **options)
+        first = snapshot()
+        for model in (OrderProduct, Order, Product, Category, User):
+            model.objects.all().delete()
+        call_command('generate_dataset', **options)
+
+    assert User.objects.filter(is_seller=True).count() == 3
+    assert User.objects.filter(is_buyer=True).count() == 8
+    assert Product.objects.count() == 20
+    assert Order.objects.count() == 12
+    assert Order.objects.filter(is_paid=False).values('buyer').distinct().count() == \
+        Order.objects.filter(is_paid=False).count()
+    assert snapshot() == first
+    assert User.objects.first().check_password('localfood')
+
+
+@pytest.mark.django_db
+def test_product_detail_conditional_get(client, user):
+    """
+    Test that a product page is answered with 304 for a current ETag, without loading
+    the product or rendering, and with 200 again after the product changes.
+    """
+    client.force_login(user)
+    category = Category.objects.create(name='Test Category', slug='test-category')
+    product = Product.objects.create(
+        name='Test Product',
+        description='Test Description',
+        price=10.00,
+        quantity=5,
+        category=category,
+        seller=user
+    )
+    path = reverse('localfood_app:product_detail', args=[product.pk])
+
+    response = client.get(path)
+    etag = response['ETag']
+    assert response.status_code == 200
+    assert 'Last-Modified' in response
+    assert 'Cookie' in response['Vary']
+
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(path, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304
+    assert not response.templates
+    assert not any('"localfood_app_product"."name"' in query['sql'] for query in queries)
+
+    product.price = 12.00
+    product.save()
+    response = client.get(path, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response['ETag'] != etag
+
+    etag = response['ETag']
+    image = ProductImage.objects.create(product=product, file_path='product_image/new.jpg')
+    response = client.get(path, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response['ETag'] != etag
+
+    etag = response['ETag']
+    image.delete()
+    response = client.get(path, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+
+    etag = response['ETag']
+    category.name = 'Renamed Category'
+    category.save()
+    assert client.get(path, HTTP_IF_NONE_MATCH=etag).status_code == 200
+
+
+@pytest.mark.django_db
+def test_category_listing_conditional_get(client, user):
+    """
+    Test that a category page's ETag depends on its products and the page number,
+    that a new product in the category or a deleted older one invalidates it,
+    and that a revalidation does not count the products.
+    """
+    client.force_login(user)
+    category = Category.objects.create(name='Test Category', slug='test-category')
+    path = reverse('localfood_app:category', args=['test-category'])
+
+    etag = client.get(path)['ETag']
+    with CaptureQueriesContext(connection) as queries:
+        assert client.get(path, HTTP_IF_NONE_MATCH=etag).status_code == 304
+    assert not any('COUNT(' in query['sql'] for query in queries)
+    assert client.get(path + '?page=2', HTTP_IF_NONE_MATCH=etag).status_code == 200
+
+    older, newer = [Product.objects.create(
+        name='Test Product',
+        description='Test Description',
+        price=10.00,
+        quantity=5,
+        category=category,
+        seller=user
+    ) for _ in range(2)]
+    assert client.get(path, HTTP_IF_NONE_MATCH=etag).status_code == 200
+
+    etag = client.get(path)['ETag']
+    older.delete()
+    assert client.get(path, HTTP_IF_NONE_MATCH=etag).status_code == 200
+
+
+@pytest.mark.django_db
+def test_async_category_listing_conditional_get(user):
+    """
+    Test that the async category view answers a current ETag with 304.
+    """
+    Category.objects.create(name='Test Category', slug='test-category')
+    path = reverse('localfood_app:category', args=['test-category'])
+    response = call_async_view(async_views.CategoryProductView, path, user, slug='test-category')
+    assert response.status_code == 200
+
+    request = AsyncRequestFactory().get(path, headers={'If-None-Match': response['ETag']})
+    request.user = user
+    response = async_to_sync(async_views.CategoryProductView.as_view())(request, slug='test-category')
+    assert response.status_code == 304
+
+
+@pytest.mark.django_db
+def test_product_cache_loads_misses_in_one_query_and_invalidates(user, django_capture_on_commit_callbacks):
+    """
+    Test that cached products are served without queries, misses are loaded with a single
+    query (plus their images) without the seller's password, saving a product drops it
+    from the cache, again when the transaction commits, and saving a category drops
+    every product without loading them.
+    """
+    category = Category.objects.create(name='Test Category', slug='test-category')
+    products = [
+        Product.objects.create(
+            name=f'Product {number}',
+            description='Test Description',
+            price=10.00,
+            quantity=5,
+            category=category,
+            seller=user
+        )
+        for number in range(3)
+    ]
+    ids = [product.pk for product in products]
+
+    with CaptureQueriesContext(connection) as queries:
+        loaded = product_cache.get_products(ids)
+    assert sorted(loaded) == ids
+    assert len(queries) == 2
+    assert loaded[ids[0]].category.name == 'Test Category'
+    assert loaded[ids[0]].seller.username == user.username
+    assert 'password' not in loaded[ids[0]].seller.__dict__
+
+    with CaptureQueriesContext(connection) as queries:
+        assert product_cache.get_product(ids[0]).name == 'Product 0'
+    assert len(queries) == 0
+
+    products[0].name = 'Renamed'
+    products[0].save()
+    assert product_cache.get_product(ids[0]).name == 'Renamed'
+    assert product_cache.get_product(0) is None
+
+    with django_capture_on_commit_callbacks(execute=True):
+        products[1].name = 'Renamed too'
+        products[1].save()
+        # another request missing the cache before the commit stores the old row
+        cache.set(product_cache.cache_key(ids[1]), loaded[ids[1]])
+    assert product_cache.get_product(ids[1]).name == 'Renamed too'
+
+    category.name = 'Renamed Category'
+    with CaptureQueriesContext(connection) as queries:
+        category.save()
+    assert not any('localfood_app_product' in query['sql'] for query in queries)
+    assert product_cache.get_product(ids[2]).category.name == 'Renamed Category'
+
+
+@pytest.mark.django_db
+def test_basket_reads_products_from_cache(client, user):
+    """
+    Test that a repeated basket request loads the order lines but not their products.
+    """
+    client.force_login(user)
+    category = Category.objects.create(name='Test Category', slug='test-category')
+    product = Product.objects.create(
+        name='Test Product',
+        description='Test Description',
+        price=10.00,
+        quantity=5,
+        category=category,
+        seller=user
+    )
+    Order.add_product_to_basket(user, product.pk)
+    client.get(reverse('localfood_app:basket'))
+
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(reverse('localfood_app:basket'))
+    assert b'Test Product' in response.content
+    assert not any('"localfood_app_product"."name"' in query['sql'] for query in queries)
+
+
+@pytest.mark.django_db
+def test_page_cache_serves_anonymous_category_pages(client, user, settings):
+    """
+    Test that an anonymous category page is rendered once and then served from the cache
+    without queries, cookies or a CSRF token, that logged-in users bypass the cache, and
+    that a page setting a cookie is not stored.
+    """
+    category = Category.objects.create(name='Test Category', slug='test-category')
+    Product.objects.create(name='Bread', description='Local', price=4, quantity=10, category=category, seller=user)
+    path = reverse('localfood_app:category', args=['test-category'])
+    anonymous = Client()
+
+    response = anonymous.get(path + '?b=2&a=1')
+    assert response['X-Page-Cache'] == 'MISS'
+
+    with CaptureQueriesContext(connection) as queries:
+        response = anonymous.get(path + '?a=1&b=2')
+    assert response['X-Page-Cache'] == 'HIT'
+    assert len(queries) == 0
+    assert 'Set-Cookie' not in response
+    assert b'Test Category' in response.content
+    assert b'csrfmiddlewaretoken' not in response.content
+
+    assert 'X-Page-Cache' not in client.get(path)
+
+    key = page_cache.cache_key('testserver', '/with-form/', '')
+    response = HttpResponse('form')
+    response.set_cookie(settings.CSRF_COOKIE_NAME, 'token')
+    page_cache.store(key, response, 0)
+    assert cache.get(key) is None
+
+
+@pytest.mark.django_db
+def test_page_cache_serves_stale_copy_while_another_worker_regenerates(client, user):
+    """
+    Test that a product change makes cached pages stale, that stale copies are served
+    while the regeneration lock is held, and that the lock holder renders the new page.
+    """
+    category = Category.objects.create(name='Test Category', slug='test-category')
+    path = reverse('localfood_app:category', args=['test-category'])
+    anonymous = Client()
+    anonymous.get(path)
+    Product.objects.create(
+        name='Fresh Product',
+        description='Test Description',
+        price=10.00,
+        quantity=5,
+        category=category,
+        seller=user
+    )
+
+    key = page_cache.cache_key('testserver', path, '')
+    cache.add(page_cache.lock_key(key), True)
+    response = anonymous.get(path)
+    assert response['X-Page-Cache'] == 'STALE'
+    assert b'Fresh Product' not in response.content
+
+    cache.delete(page_cache.lock_key(key))
+    response = anonymous.get(path)
+    assert response['X-Page-Cache'] == 'MISS'
+    assert b'Fresh Product' in response.content
+    assert anonymous.get(path)['X-Page-Cache'] == 'HIT'
+
+
+@pytest.mark.django_db
+def test_page_cache_keeps_the_lock_of_another_worker(settings):
+    """
+    Test that a worker rendering a cold page after waiting for the lock holder
+    in vain does not release the lock it never took.
+    """
+    settings.PAGE_CACHE_WAIT = 0
+    Category.objects.create(name='Test Category', slug='test-category')
+    path = reverse('localfood_app:category', args=['test-category'])
+    key = page_cache.cache_key('testserver', path, '')
+    cache.add(page_cache.lock_key(key), 'other-worker')
+
+    response = Client().get(path)
+    assert response['X-Page-Cache'] == 'MISS'
+    assert cache.get(page_cache.lock_key(key)) == 'other-worker'
+
+
+@pytest.mark.django_db
+def test_logged_in_user_is_identified_without_queries(client, user):
+    """
+    Test that sessions and users come from the cache without the password hash,
+    that a profile update replaces the cached user, and that sessions created
+    through ``ModelBackend`` stay logged in.
+    """
+    client.get(reverse('localfood_app:profile'))
+
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(reverse('localfood_app:profile'))
+    assert response.context['user'].first_name == 'John'
+    assert len(queries) == 0
+    assert 'password' not in cache.get(user_cache_key(user.pk)).__dict__
+
+    other = Client()
+    other.force_login(user, backend='django.contrib.auth.backends.ModelBackend')
+    assert other.get(reverse('localfood_app:profile')).context['user'] == user
+
+    client.post(reverse('localfood_app:profile_edit'), {
+        'first_name': 'Jane',
+        'last_name': 'Doe',
+        'email': 'testuser@example.com',
+    })
+    assert client.get(reverse('localfood_app:profile')).context['user'].first_name == 'Jane'
+
+    client.get(reverse('localfood_app:profile'))
+    response = client.post(reverse('localfood_app:change_password'), {
+        'old_password': 'password123',
+        'new_password1': 'new-Passw0rd-42',
+        'new_password2': 'new-Passw0rd-42',
+    })
+    assert response.status_code == 302
+    assert client.get(reverse('localfood_app:profile')).context['user'].is_authenticated
+    assert User.objects.get(pk=user.pk).check_password('new-Passw0rd-42')
+
+
+@pytest.mark.django_db
+def test_deactivated_user_is_not_recached_before_commit(user, django_capture_on_commit_callbacks):
+    """
+    Test that a user cached by a concurrent request before a deactivation
+    commits is removed from the cache on commit.
+    """
+    backend = CachedModelBackend()
+    assert backend.get_user(user.pk) == user
+    with django_capture_on_commit_callbacks(execute=True):
+        stale = User.objects.get(pk=user.pk)
+        user.is_active = False
+        user.save()
+        # another request misses the cache and loads the row before the commit
+        cache.set(user_cache_key(user.pk), stale)
+    assert backend.get_user(user.pk) is None
+
+
+@pytest.mark.django_db
+def test_username_availability_queries_only_possible_matches(client, user):
+    """
+    Test that the availability endpoint reports taken and free usernames, and
+    that a username the Bloom filter rules out costs no user query.
+    """
+    url = reverse('localfood_app:username_available')
+    assert client.get(url, {'username': 'testuser'}).json() == {'username': 'testuser', 'available': False}
+    assert client.get(url, {'username': ''}).json()['available'] is False
+
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(url, {'username': 'brand-new-user'})
+    assert response.json()['available'] is True
+    assert not [query for query in queries if 'localfood_app_user' in query['sql']]
+
+    User.objects.create_user(username='brand-new-user', password='secret')
+    assert client.get(url, {'username': 'brand-new-user'}).json()['available'] is False
+
+
+@pytest.mark.django_db
+def test_username_filter_finds_late_commits_and_renames(settings, user_data):
+    """
+    Test that a refresh finds a user committed below the highest ID already
+    seen, that a rename is added at once, and that the sign-up form checks the
+    database even when the filter has not seen the name.
+    """
+    settings.USERNAME_FILTER_REFRESH_SECONDS = 3600
+    first = User.objects.create_user(username='first', password='secret')
+    User.objects.create_user(username='second', password='secret')
+    assert usernames.is_username_taken('second')
+    first.delete()
+    # bulk_create sends no post_save, like a row committed by another process
+    User.objects.bulk_create([User(pk=first.pk, username='late-commit')])
+
+    form = UserCreateForm(data={**user_data, 'username': 'late-commit'})
+    assert not usernames.index.might_exist('late-commit')
+    assert not form.is_valid() and 'username' in form.errors
+
+    settings.USERNAME_FILTER_REFRESH_SECONDS = 0
+    assert usernames.index.might_exist('late-commit')
+
+    settings.USERNAME_FILTER_REFRESH_SECONDS = 3600
+    renamed = User.objects.get(username='second')
+    renamed.username = 'renamed'
+    renamed.save()
+    assert usernames.index.might_exist('renamed')
+
+
+def test_bloom_filter_has_no_false_negatives():
+    """
+    Test that every added item is found and that the false positive rate stays
+    near the configured one.
+    """
+    bloom = usernames.BloomFilter(1000, 0.01)
+    for number in range(1000):
+        bloom.add(f'user{number}')
+    assert all(f'user{number}' in bloom for number in range(1000))
+    false_positives = sum(f'other{number}' in bloom for number in range(10000))
+    assert false_positives < 300
+
+
+@pytest.mark.django_db
+def test_login_throttle_rejects_attempts_before_hashing(client, user, settings):
+    """
+    Test that login attempts over the per-username limit get 429 without the
+    password being checked, and that a successful login checks it only once.
+    """
+    settings.THROTTLE_RATES = {'login': {'ip': (100, 60), 'username': (3, 600)}}
+    url = reverse('localfood_app:login')
+    with patch('django.contrib.auth.backends.ModelBackend.authenticate', return_value=None) as check:
+        for _ in range(3):
+            assert client.post(url, {'username': 'victim', 'password': 'guess'}).status_code == 200
+        response = client.post(url, {'username': 'Victim', 'password': 'guess'})
+    assert response.status_code == 429
+    assert int(response['Retry-After']) > 0
+    assert 'Too many attempts' in response.content.decode()
+    assert check.call_count == 3
+
+    with patch('django.contrib.auth.base_user.check_password', wraps=check_password) as check:
+        response = client.post(url, {'username': 'testuser', 'password': 'password123'})
+    assert response.status_code == 302
+    assert check.call_count == 1
+
+    # only failed logins count against the username
+    for _ in range(3):
+        assert client.post(url, {'username': 'testuser', 'password': 'password123'}).status_code == 302
+    for _ in range(3):
+        assert client.post(url, {'username': 'testuser', 'password': 'wrong'}).status_code == 200
+    assert client.post(url, {'username': 'testuser', 'password': 'password123'}).status_code == 429
+
+
+def test_throttle_counts_before_deciding(settings):
+    """
+    Test that a concurrent burst lets through exactly the limit, since each
+    request is judged on the count its own increment returned.
+    """
+    settings.THROTTLE_RATES = {'test': {'ip': (5, 60)}}
+    barrier = threading.Barrier(20)
+    results = []
+
+    def attempt():
+        barrier.wait()
+        results.append(throttle.hit('test', {'ip': '10.0.0.3'}, now=600))
+
+    threads = [threading.Thread(target=attempt) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results.count(None) == 5
+    # the rejected requests were not counted
+    assert cache.get(throttle._window_keys('test', 'ip', '10.0.0.3', 60, 600)[1]) == 5
+
+
+def test_throttle_window_slides_and_falls_back_to_process_memory(settings):
+    """
+    Test that the previous window's count is weighted by its overlap, and that
+    counting continues in process memory when the cache fails.
+    """
+    settings.THROTTLE_RATES = {'test': {'ip': (4, 60)}}
+    for _ in range(4):
+        assert throttle.hit('test', {'ip': '10.0.0.1'}, now=600) is None
+    assert throttle.hit('test', {'ip': '10.0.0.1'}, now=630) == 30
+    # half the previous window overlaps: 4 * 0.5 = 2 requests counted
+    assert throttle.hit('test', {'ip': '10.0.0.1'}, now=690) is None
+    assert throttle.hit('test', {'ip': '10.0.0.1'}, now=690) is None
+    assert throttle.hit('test', {'ip': '10.0.0.1'}, now=690) == 30
+    assert throttle.hit('test', {'ip': ''}, now=690) is None
+
+    throttle.local_counters.clear()
+    with patch.object(cache, 'get_many', side_effect=ConnectionError):
+        for _ in range(4):
+            assert throttle.hit('test', {'ip': '10.0.0.2'}, now=600) is None
+        assert throttle.hit('test', {'ip': '10.0.0.2'}, now=600) == 60
+
+
+@pytest.mark.django_db
+def test_category_near_me_lists_nearby_sellers_by_distance(client, user):
+    """
+    Test that the "near me" mode keeps only the products of sellers within the
+    radius, nearest first, for the user's own address or a given postal code.
+    """
+    category = Category.objects.create(name='Test Category', slug='test-category')
+    Address.objects.create(user=user, city='Warszawa', postal_code='00-950')
+    for name, postal_code in [('Krakow', '30-001'), ('Piaseczno', '05-500'), ('Warsaw', '01-100')]:
+        seller = User.objects.create_user(username=f'seller-{name}', password='secret', is_seller=True)
+        Address.objects.create(user=seller, city=name, postal_code=postal_code)
+        Product.objects.create(name=f'{name} honey', description='Local', price=10, quantity=5,
+                               category=category, seller=seller)
+    path = reverse('localfood_app:category', args=['test-category'])
+
+    response = client.get(path, {'near': 'me', 'km': 50})
+    products = list(response.context['products'])
+    assert [product.name for product in products] == ['Warsaw honey', 'Piaseczno honey']
+    warsaw, piaseczno = geo.locate('00-950'), geo.locate('05-500')
+    assert products[1].distance == pytest.approx(geo.haversine_km(*warsaw, *piaseczno))
+
+    response = client.get(path, {'near': '30-950', 'km': 10})
+    assert [product.name for product in response.context['products']] == ['Krakow honey']
+    assert len(client.get(path, {'near': '??'}).context['products']) == 3
+
+
+def test_grid_cells_cover_the_search_radius():
+    """
+    Test that every point within the radius lies in one of the returned cells.
+    """
+    latitude, longitude = 52.23, 21.01
+    cells = set(geo.cells_within(latitude, longitude, 40))
+    for step in range(36):
+        bearing = math.radians(step * 10)
+        point = (latitude + 39.9 / geo.KM_PER_DEGREE * math.cos(bearing),
+                 longitude + 39.9 / (geo.KM_PER_DEGREE * math.cos(math.radians(latitude))) * math.sin(bearing))
+        assert geo.haversine_km(latitude, longitude, *point) < 40.5
+        assert geo.grid_cell(*point) in cells
+
+
+def _province_counts():
+    return {(row.province, row.category_id): row.count for row in ProvinceCategoryCount.objects.exclude(count=0)}
+
+
+@pytest.mark.django_db
+def test_province_counts_follow_product_and_address_changes():
+    """
+    Test that the seller province of products and the per-province counts are
+    kept equal to a full recount as products and seller addresses change.
+    """
+    vegetables = Category.objects.create(name='Vegetables', slug='vegetables')
+    fruit = Category.objects.create(name='Fruit', slug='fruit')
+    seller = User.objects.create_user(username='farmer', password='secret', is_seller=True)
+    address = Address.objects.create(user=seller, city='Warszawa', province='Mazowieckie', postal_code='00-950')
+    carrots, apples = [
+        Product.objects.create(name=name, description='Local', price=5, quantity=5, category=category, seller=seller)
+        for name, category in [('Carrots', vegetables), ('Apples', vegetables)]
+    ]
+    assert carrots.seller_province == 'Mazowieckie'
+    assert _province_counts() == {('Mazowieckie', vegetables.pk): 2}
+
+    apples = Product.objects.get(pk=apples.pk)
+    apples.category = fruit
+    apples.save()
+    address.province = 'Małopolskie'
+    address.save()
+    assert Product.objects.get(pk=carrots.pk).seller_province == 'Małopolskie'
+    assert _province_counts() == {('Małopolskie', vegetables.pk): 1, ('Małopolskie', fruit.pk): 1}
+
+    Product.objects.get(pk=carrots.pk).delete()
+    expected = _province_counts()
+    provinces.rebuild_counts()
+    assert _province_counts() == expected == {('Małopolskie', fruit.pk): 1}
+
+
+@pytest.mark.django_db
+def test_province_filtered_listing_costs_the_same_as_unfiltered(client, user):
+    """
+    Test that a province-filtered category page lists only that province's
+    products with the precomputed count, using as many queries as the
+    unfiltered page.
+    """
+    category = Category.objects.create(name='Test Category', slug='test-category')
+    for name, province in [('Mazowieckie', 'Mazowieckie'), ('Pomorskie', 'Pomorskie')]:
+        seller = User.objects.create_user(username=f'seller-{name}', password='secret', is_seller=True)
+        Address.objects.create(user=seller, city=name, province=province)
+        for number in range(12 if province == 'Mazowieckie' else 3):
+            Product.objects.create(name=f'{name} {number}', description='Local', price=10, quantity=5,
+                                   category=category, seller=seller)
+    path = reverse('localfood_app:category', args=['test-category'])
+    client.get(path)
+
+    with CaptureQueriesContext(connection) as unfiltered:
+        client.get(path)
+    with CaptureQueriesContext(connection) as filtered:
+        response = client.get(path, {'province': 'Pomorskie'})
+    products = response.context['products']
+    assert products.paginator.count == 3
+    assert {product.seller_province for product in products} == {'Pomorskie'}
+    assert ('Mazowieckie', 12) in response.context['provinces']
+    assert len(filtered) == len(unfiltered)
+
+    response = client.get(path, {'province': 'Mazowieckie', 'page': 2})
+    assert '&amp;province=Mazowieckie' in response.content.decode()
+
+
+def _paid_order(buyer, *products):
+    order = Order.objects.create(buyer=buyer, is_paid=True)
+    OrderProduct.objects.bulk_create([OrderProduct(order=order, product=product, quantity=1) for product in products])
+    return order
+
+
+@pytest.mark.django_db
+def test_build_recommendations_ranks_products_bought_together(user):
+    """
+    Test that the recommendations count each pair of products once per paid order,
+    across chunks, rank them by cosine similarity and ignore unpaid orders.
+    """
+    category = Category.objects.create(name='Test Category', slug='test-category')
+    bread, butter, jam, milk, salt = [
+        Product.objects.create(name=name, description='Local', price=5, quantity=10, category=category, seller=user)
+        for name in ('Bread', 'Butter', 'Jam', 'Milk', 'Salt')
+    ]
+    for _ in range(3):
+        _paid_order(user, bread, butter)
+    _paid_order(user, bread, jam, jam)
+    _paid_order(user, jam, milk)
+    _paid_order(user, milk)
+    Order.objects.create(buyer=user).orderproduct_set.create(product=salt, quantity=1)
+
+    call_command('build_recommendations', chunk_size=2, top_k=2, stdout=StringIO())
+
+    related = {(row.product_id, row.rank): (row.related_id, row.orders)
+               for row in RelatedProduct.objects.all()}
+    assert related == {
+        (bread.pk, 1): (butter.pk, 3),
+        (bread.pk, 2): (jam.pk, 1),
+        (butter.pk, 1): (bread.pk, 3),
+        (jam.pk, 1): (milk.pk, 1),
+        (jam.pk, 2): (bread.pk, 1),
+        (milk.pk, 1): (jam.pk, 1),
+    }
+    assert RelatedProduct.objects.get(product=bread, rank=1).score == pytest.approx(3 / math.sqrt(4 * 3))
+
+    call_command('build_recommendations', min_support=2, stdout=StringIO())
+    assert list(RelatedProduct.objects.values_list('product_id', 'related_id')) == [
+        (bread.pk, butter.pk), (butter.pk, bread.pk)]
+
+
+@pytest.mark.django_db
+def test_product_and_basket_pages_show_related_products(client, user):
+    """
+    Test that the product page shows its related products with one recommendation
+    query, that the basket leaves out the products already in it, and that a
+    rebuild changes the product page ETag through the database, while a rebuild
+    without changes leaves the products alone.
+    """
+    client.force_login(user)
+    category = Category.objects.create(name='Test Category', slug='test-category')
+    bread, butter, jam = [
+        Product.objects.create(name=name, description='Local', price=5, quantity=10, category=category, seller=user)
+        for name in ('Bread', 'Butter', 'Jam')
+    ]
+    _paid_order(user, bread, butter, jam)
+    _paid_order(user, bread, butter)
+    path = reverse('localfood_app:product_detail', args=[bread.pk])
+    etag = client.get(path)['ETag']
+    call_command('build_recommendations', stdout=StringIO())
+    # another process shares nothing but the database
+    cache.clear()
+
+    response = client.get(path, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response.context['related_products'] == [butter, jam]
+    assert 'Frequently bought together' in response.content.decode()
+    with CaptureQueriesContext(connection) as queries:
+        client.get(path)
+    assert sum('localfood_app_relatedproduct' in query['sql'] for query in queries) == 1
+    updated = Product.objects.get(pk=bread.pk).updated_at
+    call_command('build_recommendations', stdout=StringIO())
+    assert Product.objects.get(pk=bread.pk).updated_at == updated
+
+    Order.add_product_to_basket(user, butter.pk)
+    response = client.get(reverse('localfood_app:basket'))
+    assert response.context['related_products'] == [bread, jam]
+    assert recommendations.basket_recommendations([bread.pk, butter.pk, jam.pk]) == []
+
+
+@pytest.mark.django_db
+def test_payment_updates_popularity_once(client, user, settings, django_capture_on_commit_callbacks):
+    """
+    Test that paying an order adds its units to the sales counts and the trending
+    scores of its products, that a repeated payment adds nothing, that the cached
+    products are refreshed once the payment commits, and that ``rebuild``
+    recomputes the same values.
+    """
+    settings.TRENDING_EPOCH = '2024-01-01T00:00:00+00:00'
+    settings.TRENDING_HALF_LIFE_DAYS = 7
+    category = Category.objects.create(name='Test Category', slug='test-category')
+    bread, butter = [
+        Product.objects.create(name=name, description='Local', price=5, quantity=10, category=category, seller=user)
+        for name in ('Bread', 'Butter')
+    ]
+    for product in (bread, bread, butter):
+        Order.add_product_to_basket(user, product.pk)
+    order = Order.objects.get(buyer=user, is_paid=False)
+    stale = product_cache.get_product(bread.pk)
+
+    with django_capture_on_commit_callbacks(execute=True):
+        client.post(reverse('localfood_app:basket'), {'order_id': order.pk, 'payment': 'paid'})
+        # another worker caching the product before the payment commits
+        cache.set(product_cache.cache_key(bread.pk), stale)
+    client.post(reverse('localfood_app:basket'), {'order_id': order.pk, 'payment': 'paid'})
+    bread.refresh_from_db()
+    butter.refresh_from_db()
+    assert (bread.sales_count, butter.sales_count) == (2, 1)
+    assert product_cache.get_product(bread.pk).sales_count == 2
+    assert popularity.decayed(bread.trending_score) == pytest.approx(2, rel=1e-3)
+    assert bread.trending_score == pytest.approx(2 * butter.trending_score)
+    assert popularity.sale_weight(datetime(2024, 1, 15, tzinfo=dt_timezone.utc)) == 4
+
+    popularity.rebuild()
+    assert Product.objects.get(pk=bread.pk).trending_score == pytest.approx(bread.trending_score, rel=1e-3)
+    assert Product.objects.get(pk=bread.pk).sales_count == 2
+
+    # a bulk write the signals missed; rebuild fixes the product and its cached copy
+    Product.objects.filter(pk=butter.pk).update(sales_count=7)
+    assert product_cache.get_product(butter.pk).sales_count == 7
+    generation = cache.get(page_cache.GENERATION_KEY, 0)
+    with django_capture_on_commit_callbacks(execute=True):
+        popularity.rebuild()
+    assert product_cache.get_product(butter.pk).sales_count == 1
+    assert cache.get(page_cache.GENERATION_KEY, 0) > generation
+
+
+@pytest.mark.django_db
+def test_bestsellers_sort_pages_by_keyset(client, user):
+    """
+    Test that the bestsellers sort lists a category by units sold with keyset
+    pagination, through ties, without counting the listing.
+    """
+    client.force_login(user)
+    category = Category.objects.create(name='Test Category', slug='test-category')
+    products = [
+        Product.objects.create(name=f'Product {number}', description='Local', price=5, quantity=10,
+                               category=category, seller=user)
+        for number in range(25)
+    ]
+    Product.objects.filter(pk__in=[product.pk for product in products[:12]]).update(sales_count=3)
+    Product.objects.filter(pk=products[20].pk).update(sales_count=9)
+    path = reverse('localfood_app:category', args=['test-category'])
+
+    listed, after = [], None
+    while True:
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(path, {'sort': 'bestsellers', **({'after': after} if after else {})})
+        assert not any('COUNT(' in query['sql'] and 'localfood_app_product' in query['sql']
+                       and 'MAX(' not in query['sql'] for query in queries)
+        page = response.context['products']
+        listed += [product.pk for product in page]
+        if not page.has_next():
+            break
+        after = page.next_cursor
+        assert f'after={after}' in response.content.decode()
+
+    expected = sorted(products, key=lambda product: (-Product.objects.get(pk=product.pk).sales_count, -product.pk))
+    assert listed == [product.pk for product in expected]
+    assert listed[0] == products[20].pk
+    assert client.get(path, {'sort': 'bestsellers', 'after': 'bogus'}).context['products'].after is None
+
+
+def _rollups():
+    return (
+        sorted(SellerDailySales.objects.values_list('seller_id', 'day', 'units', 'revenue', 'orders')),
+        sorted(ProductDailySales.objects.values_list('product_id', 'seller_id', 'day', 'units', 'revenue', 'orders')),
+    )
+
+
+@pytest.mark.django_db
+def test_paid_orders_roll_up_into_daily_seller_sales(client, user):
+    """
+    Test that paying orders adds them to the seller's and the products' rows of
+    the day, counting an order once per seller, that the backfill rebuilds the
+    same rows, and that the analytics page sums the requested range.
+    """
+    category = Category.objects.create(name='Test Category', slug='test-category')
+    seller = User.objects.create_user(username='seller', password='password123', is_seller=True)
+    bread, butter = [
+        Product.objects.create(name=name, description='Local', price=price, quantity=10, category=category,
+                               seller=seller)
+        for name, price in (('Bread', 4), ('Butter', 7))
+    ]
+    for products in ([bread, bread, butter], [bread]):
+        for product in products:
+            Order.add_product_to_basket(user, product.pk)
+        Order.objects.get(buyer=user, is_paid=False).mark_paid()
+    Order.add_product_to_basket(user, butter.pk)
+
+    today = timezone.localdate()
+    incremental = _rollups()
+    assert incremental == (
+        [(seller.pk, today, 4, Decimal('19.00'), 2)],
+        [(bread.pk, seller.pk, today, 3, Decimal('12.00'), 2), (butter.pk, seller.pk, today, 1, Decimal('7.00'), 1)],
+    )
+    call_command('backfill_sales_rollups', chunk_size=1, stdout=StringIO())
+    assert _rollups() == incremental
+
+    SellerDailySales.objects.create(seller=seller, day=today - timedelta(days=40), units=9, revenue=90, orders=3)
+    client.force_login(seller)
+    response = client.get(reverse('localfood_app:seller_analytics'))
+    assert response.context['totals'] == {'units': 4, 'revenue': Decimal('19.00'), 'orders': 2}
+    assert [row['product'] for row in response.context['top_products']] == [bread, butter]
+    response = client.get(reverse('localfood_app:seller_analytics'), {
+        'start': (today - timedelta(days=60)).isoformat(), 'end': today.isoformat()})
+    assert response.context['totals']['units'] == 13
+    response = client.get(reverse('localfood_app:seller_analytics'), {
+        'start': today.isoformat(), 'end': (today - timedelta(days=1)).isoformat()})
+    assert response.context['start'] == analytics.default_range()[0]
+    assert 'must not be after' in response.content.decode()
+
+
+@pytest.mark.django_db
+def test_inventory_updates_only_the_changed_fields_of_own_products(client, user, django_capture_on_commit_callbacks):
+    """
+    Test that the inventory page saves the prices and quantities the seller
+    changed in one batch, keeps the quantity a payment changed meanwhile,
+    ignores the products of other sellers and refreshes the product cache.
+    """
+    category = Category.objects.create(name='Test Category', slug='test-category')
+    seller = User.objects.create_user(username='seller', password='password123', is_seller=True)
+    other = User.objects.create_user(username='other', password='password123', is_seller=True)
+    bread = Product.objects.create(name='Bread', description='Local', price=4, quantity=10, category=category,
+                                   seller=seller)
+    jam = Product.objects.create(name='Jam', description='Local', price=9, quantity=5, category=category,
+                                 seller=seller)
+    foreign = Product.objects.create(name='Cheese', description='Local', price=20, quantity=3, category=category,
+                                     seller=other)
+    client.login(username='seller', password='password123')
+    url = reverse('localfood_app:inventory')
+
+    response = client.get(url)
+    assert [product.name for _, product in response.context['rows']] == ['Jam', 'Bread']
+    assert product_cache.get_product(bread.pk).price == 4
+
+    # a buyer pays for a jar while the page is open
+    Order.add_product_to_basket(user, jam.pk)
+    Order.objects.get(buyer=user, is_paid=False).mark_paid()
+
+    def form_data(rows):
+        data = {'form-TOTAL_FORMS': len(rows), 'form-INITIAL_FORMS': len(rows)}
+        for number, (product, shown, submitted) in enumerate(rows):
+            data[f'form-{number}-product'] = product.pk
+            for name in ('price', 'quantity'):
+                data[f'initial-form-{number}-{name}'] = shown[name]
+                data[f'form-{number}-{name}'] = submitted[name]
+        return data
+
+    with django_capture_on_commit_callbacks(execute=True):
+        response = client.post(url, form_data([
+            (jam, {'price': '9.00', 'quantity': 5}, {'price': '8.50', 'quantity': 5}),
+            (bread, {'price': '4.00', 'quantity': 10}, {'price': '4.50', 'quantity': 30}),
+            (foreign, {'price': '20.00', 'quantity': 3}, {'price': '1.00', 'quantity': 0}),
+        ]))
+    assert response.status_code == 302
+    jam.refresh_from_db()
+    bread.refresh_from_db()
+    foreign.refresh_from_db()
+    assert (jam.price, jam.quantity) == (Decimal('8.50'), 4)
+    assert (bread.price, bread.quantity) == (Decimal('4.50'), 30)
+    assert (foreign.price, foreign.quantity) == (Decimal('20.00'), 3)
+    assert product_cache.get_product(bread.pk).price == Decimal('4.50')
+    assert 'Updated 2 products.' in client.get(response.url).content.decode()
+
+    response = client.post(url, form_data([
+        (bread, {'price': '4.50', 'quantity': 30}, {'price': '4.50', 'quantity': -1}),
+    ]))
+    assert response.status_code == 400
+    assert response.context['rows'][0][1] == bread
+    bread.refresh_from_db()
+    assert bread.quantity == 30
+
+
+@pytest.mark.django_db
+def test_import_products_command_streams_csv_in_batches(tmp_path):
+    """
+    Test that the import command creates the valid rows of a CSV file in
+    batches, reports the invalid ones by line and keeps the province counts.
+    """
+    vegetables = Category.objects.create(name='Vegetables', slug='vegetables')
+    dairy = Category.objects.create(name='Dairy', slug='dairy')
+    seller = User.objects.create_user(username='seller', password='password123', is_seller=True)
+    Address.objects.create(user=seller, city='Warszawa', province='Mazowieckie', postal_code='00-950')
+    path = tmp_path / 'catalog.csv'
+    path.write_text(
+        'name,description,price,quantity,category\n'
+        'Carrots,Crunchy,3.50,100,vegetables\n'
+        'Beets,Red,cheap,10,vegetables\n'
+        'Milk,Fresh,4,20,bakery\n'
+        'Kefir,Sour,5,-1,dairy,extra\n'
+        'Cheese,Aged,25,8,dairy\n'
+        'Onions,Sweet,2,50,vegetables\n',
+        encoding='utf-8',
+    )
+    stdout, stderr = StringIO(), StringIO()
+    with CaptureQueriesContext(connection) as queries:
+        call_command('import_products', str(path), seller='seller', batch_size=2, stdout=stdout, stderr=stderr)
+
+    assert 'Imported 3 products for seller; skipped 3 rows.' in stdout.getvalue()
+    errors = stderr.getvalue()
+    assert 'Line 3: price: Enter a number.' in errors
+    assert 'Line 4: category: Unknown category "bakery".' in errors
+    assert 'Line 5: More values than columns.' in errors
+    products = Product.objects.order_by('pk')
+    assert [(product.name, product.category_id, product.seller_province) for product in products] == [
+        ('Carrots', vegetables.pk, 'Mazowieckie'), ('Cheese', dairy.pk, 'Mazowieckie'),
+        ('Onions', vegetables.pk, 'Mazowieckie')]
+    assert _province_counts() == {('Mazowieckie', vegetables.pk): 2, ('Mazowieckie', dairy.pk): 1}
+    assert sum('INSERT INTO "localfood_app_product"' in query['sql'] for query in queries.captured_queries) == 2
+
+
+@pytest.mark.django_db
+def test_import_products_view_reports_row_errors(client):
+    """
+    Test that a seller can upload a JSON Lines file, that malformed lines are
+    reported without stopping the import, and that other file types are refused.
+    """
+    category = Category.objects.create(name='Vegetables', slug='vegetables')
+    User.objects.create_user(username='seller', password='password123', is_seller=True)
+    client.login(username='seller', password='password123')
+    url = reverse('localfood_app:import_products')
+    upload = SimpleUploadedFile('catalog.jsonl', (
+        '{"name": "Carrots", "description": "Crunchy", "price": 3.5, "quantity": 100, "category": "vegetables"}\n'
+        '{"name": "Beets"\n'
+        '\n'
+        '["Onions"]\n'
+        '{"name": "Leeks", "description": "Long", "price": "2.00", "quantity": 7, "category": "vegetables"}\n'
+    ).encode())
+
+    response = client.post(url, {'file': upload})
+    assert response.status_code == 200
+    result = response.context['result']
+    assert (result.created, result.error_count) == (2, 2)
+    assert [line for line, _ in result.errors] == [2, 4]
+    assert 'Imported 2 products' in response.content.decode()
+    assert set(Product.objects.values_list('name', 'category_id')) == {('Carrots', category.pk), ('Leeks', category.pk)}
+
+    response = client.post(url, {'file': SimpleUploadedFile('catalog.xlsx', b'PK')})
+    assert response.status_code == 400
+    assert 'Unsupported file type' in response.content.decode()
+
+
+@pytest.mark.django_db
+def test_seller_order_stream_pushes_paid_orders(user, django_capture_on_commit_callbacks):
+    """
+    Test that the seller's event stream gets an event when an order with their
+    products is paid, and that a reconnecting client first gets the orders it missed.
+    """
+    category = Category.objects.create(name='Test Category', slug='test-category')
+    seller = User.objects.create_user(username='seller', password='password123', is_seller=True)
+    bread = Product.objects.create(name='Bread', description='Local', price=4, quantity=10, category=category,
+                                   seller=seller)
+
+    def pay():
+        with django_capture_on_commit_callbacks(execute=True):
+            Order.add_product_to_basket(user, bread.pk)
+            Order.add_product_to_basket(user, bread.pk)
+            order = Order.objects.get(buyer=user, is_paid=False)
+            order.mark_paid()
+        return order
+
+    async def open_stream(headers=None):
+        request = AsyncRequestFactory().get('/', headers=headers)
+
+        async def auser():
+            return seller
+
+        request.auser = auser
+        response = await async_views.SellerOrderEventsView.as_view()(request)
+        assert response['Content-Type'] == 'text/event-stream'
+        stream = aiter(response.streaming_content)
+        assert (await anext(stream)).startswith(b'retry:')
+        return stream
+
+    async def scenario():
+        stream = await open_stream()
+        first = await sync_to_async(pay)()
+        event = (await asyncio.wait_for(anext(stream), 5)).decode()
+        await stream.aclose()
+        assert event.startswith('event: order\n')
+        assert json.loads(event.split('data: ')[1]) == {
+            'order': first.pk, 'paid_at': first.paid_at.isoformat(), 'units': 2, 'total': '8.00'}
+
+        second = await sync_to_async(pay)()
+        stream = await open_stream({'Last-Event-ID': first.paid_at.isoformat()})
+        event = (await asyncio.wait_for(anext(stream), 5)).decode()
+        await stream.aclose()
+        assert f'id: {second.paid_at.isoformat()}' in event
+
+    async_to_sync(scenario)()
+
+
+@pytest.mark.django_db
+def test_product_stock_stream_merges_updates(user, settings, django_capture_on_commit_callbacks):
+    """
+    Test that paying takes the units from the stock, refreshes the cached
+    products once it commits, and that the stock stream of a product page sends
+    the current levels, then one update per product for the changes made while
+    it was not reading.
+    """
+    settings.STOCK_EVENTS_INTERVAL_SECONDS = 0
+    category = Category.objects.create(name='Test Category', slug='test-category')
+    seller = User.objects.create_user(username='seller', password='password123', is_seller=True)
+    bread = Product.objects.create(name='Bread', description='Local', price=4, quantity=10, category=category,
+                                   seller=seller)
+    jam = Product.objects.create(name='Jam', description='Local', price=9, quantity=1, category=category,
+                                 seller=seller)
+
+    def pay(*products):
+        stale = product_cache.get_products([product.pk for product in products])
+        with django_capture_on_commit_callbacks(execute=True):
+            for product in products:
+                Order.add_product_to_basket(user, product.pk)
+            Order.objects.get(buyer=user, is_paid=False).mark_paid()
+            # another worker caching the products before the payment commits
+            cache.set_many({product_cache.cache_key(pk): product for pk, product in stale.items()})
+
+    def restock():
+        with django_capture_on_commit_callbacks(execute=True):
+            jam.refresh_from_db()
+            jam.quantity = 5
+            jam.save()
+
+    async def read(stream):
+        event = (await asyncio.wait_for(anext(stream), 5)).decode()
+        assert event.startswith('event: stock\n')
+        return json.loads(event.split('data: ')[1])
+
+    async def scenario():
+        request = AsyncRequestFactory().get('/', {'product': [bread.pk, jam.pk]})
+        response = await async_views.ProductStockEventsView.as_view()(request)
+        assert response['Content-Type'] == 'text/event-stream'
+        stream = aiter(response.streaming_content)
+        assert (await anext(stream)).startswith(b'retry:')
+        assert await read(stream) == {str(bread.pk): 10, str(jam.pk): 1}
+
+        await sync_to_async(pay)(bread, bread)
+        assert await read(stream) == {str(bread.pk): 8}
+
+        await sync_to_async(pay)(bread, jam)
+        await sync_to_async(pay)(bread)
+        await sync_to_async(restock)()
+        assert await read(stream) == {str(bread.pk): 6, str(jam.pk): 5}
+        await stream.aclose()
+
+    async_to_sync(scenario)()
+    bread.refresh_from_db()
+    assert bread.quantity == 6
+    assert product_cache.get_product(bread.pk).quantity == 6
+
+    for query in ({}, {'product': 'bread'}, {'product': range(settings.STOCK_EVENTS_MAX_PRODUCTS + 1)}):
+        response = async_to_sync(async_views.ProductStockEventsView.as_view())(
+            AsyncRequestFactory().get('/', query))
+        assert response.status_code == 400
+
+
+@pytest.mark.django_db
+def test_payment_without_enough_stock_is_rejected(client, user):
+    """
+    Test that an order asking for more units than are left is not paid, takes
+    nothing from the stock and sends the buyer back to the basket.
+    """
+    category = Category.objects.create(name='Test Category', slug='test-category')
+    bread = Product.objects.create(name='Bread', description='Local', price=4, quantity=10, category=category,
+                                   seller=user)
+    jam = Product.objects.create(name='Jam', description='Local', price=9, quantity=1, category=category,
+                                 seller=user)
+    for product in (bread, jam, jam):
+        Order.add_product_to_basket(user, product.pk)
+    order = Order.objects.get(buyer=user, is_paid=False)
+    with pytest.raises(OutOfStock) as error:
+        order.mark_paid()
+    assert error.value.product_ids == [jam.pk]
+
+    response = client.post(reverse('localfood_app:basket'), {'order_id': order.pk, 'payment': 'paid'}, follow=True)
+    assert response.redirect_chain[-1][0] == reverse('localfood_app:basket')
+    assert 'Not enough left of: Jam' in response.content.decode()
+    assert 'localfood_checkout_total{outcome="out_of_stock"} 1.0' in render_prometheus_text()
+    order.refresh_from_db()
+    assert not order.is_paid
+    assert list(Product.objects.order_by('pk').values_list('quantity', flat=True)) == [10, 1]
+    assert Product.objects.get(pk=bread.pk).sales_count == 0
+
+
+def test_unix_socket_backend_fans_events_out(settings):
+    """
+    Test that the unix socket backend delivers an event published from another
+    thread to a subscriber, and removes the sockets of exited processes.
+    """
+    settings.EVENTS_BACKEND = 'unix'
+    settings.EVENTS_SOCKET_DIR = tempfile.mkdtemp(prefix='lf-events-')
+    events.reset()
+    stale = f'{settings.EVENTS_SOCKET_DIR}/stale.sock'
+    with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as exited:
+        exited.bind(stale)
+
+    async def scenario():
+        subscription = events.subscribe('seller:1')
+        threading.Thread(target=events.publish, args=('seller:1', {'order': 7})).start()
+        try:
+            return await asyncio.wait_for(subscription.get(), 5)
+        finally:
+            events.unsubscribe(subscription)
+
+    assert async_to_sync(scenario)() == {'order': 7}
+    assert not os.path.exists(stale)